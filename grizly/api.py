@@ -6,12 +6,14 @@ from .ui.start import UI
 
 from .tools.extract import copy_df_to_excel
 from .tools.qframe import QFrame, union, join, initiate
+from .tools.cache import ResultCache, MetadataCache
 from .tools.crosstab import Crosstab
 from .tools.email import Email
 from .tools.sfdc import SFDC
 from .tools.s3 import S3, s3_to_csv, csv_to_s3, df_to_s3, s3_to_rds
 from .tools.github import GitHub
 from .tools.sqldb import SQLDB, check_if_exists, delete_where, get_columns, copy_table
+from .tools.pool import configure_pools, get_pool_metrics, dispose_pools
 from .scheduling.orchestrate import Workflow, Listener, EmailListener, Schedule, Runner, retry
 
 
@@ -31,6 +31,7 @@ from ..tools.email import Email, EmailAccount
 from ..tools.s3 import df_to_s3, s3_to_rds
 from ..utils import get_path
 from ..tools.sqldb import SQLDB
+from ..tools.pool import get_pool
 
 
 workflows_dir = os.getenv("GRIZLY_WORKFLOWS_HOME") or "/home/acoe_workflows"
@@ -655,8 +656,12 @@ class Workflow:
         {priority},
         '{now_utc}'
         )"""
-        sqla_engine = create_engine(engine)
-        execute_query(sqla_engine, sql)
+        con = get_pool(engine).connect()
+        cursor = con.cursor()
+        cursor.execute(sql)
+        con.commit()
+        cursor.close()
+        con.close()
 
         self.logger.info(f"{self.name} has been uploaded to workflow_queue")
 
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from logging import Logger
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..utils import get_path
+
+
+class ResultCache:
+    """On-disk cache of query results.
+
+    Results are stored as Parquet files under a key which is a hash of the engine string and the compiled SQL.
+    Every entry has its own time to live. When the size of the cache exceeds max_size, the least recently
+    used entries are removed.
+
+    Parameters
+    ----------
+    path : str, optional
+        Cache directory, by default ~/.grizly/cache
+    ttl : int, optional
+        Default number of seconds after which the entries expire, by default None (entries never expire)
+    max_size : int, optional
+        Maximum size of the cache in bytes, by default None (no limit)
+
+    Examples
+    --------
+    >>> cache = ResultCache(path=get_path(".grizly", "cache_tutorial"), ttl=3600)
+    >>> key = cache.get_key("sqlite://", "SELECT 1 AS one")
+    >>> cache.put(key, pa.table({"one": [1]}))
+    >>> cache.get(key).to_pydict()
+    {'one': [1]}
+    >>> cache.get(cache.get_key("sqlite://", "SELECT 2 AS two")) is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> cache.clear()
+    """
+
+    def __init__(self, path: str = None, ttl: int = None, max_size: int = None, logger: Logger = None):
+        self.path = path or get_path(".grizly", "cache")
+        self.ttl = ttl
+        self.max_size = max_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_key(self, engine: str, sql: str, options: dict = None):
+        """Returns the key of the result of sql executed with engine. Options which change the result, eg. its
+        format, are part of the key."""
+        parts = [engine, sql] + ([options] if options else [])
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Returns cached pyarrow.Table or None if the entry doesn't exist or has expired."""
+        entry = self._get_entry(key)
+        if entry is None:
+            self._count(hit=False)
+            return None
+        try:
+            table = pq.read_table(self._get_data_path(key))
+        except (OSError, pa.ArrowException):
+            self.logger.warning(f"Cache entry {key} could not be read and was removed.")
+            self.remove(key)
+            self._count(hit=False)
+            return None
+        # modification time of the metadata file is the time of last use
+        os.utime(self._get_meta_path(key))
+        self._count(hit=True)
+        self.logger.debug(f"Cache hit: {key}")
+        return table
+
+    def put(self, key: str, table, ttl: int = None):
+        """Stores pyarrow.Table under key.
+
+        Parameters
+        ----------
+        key : str
+            Key returned by get_key()
+        table : pyarrow.Table
+            Result to store
+        ttl : int, optional
+            Number of seconds after which the entry expires, by default ResultCache.ttl
+        """
+        tmp_path = self._get_tmp_path(key)
+        pq.write_table(table, tmp_path)
+        self._add(key, tmp_path, ttl)
+
+    def put_file(self, key: str, parquet_path: str, ttl: int = None):
+        """Stores a copy of Parquet file under key. See put()."""
+        tmp_path = self._get_tmp_path(key)
+        shutil.copyfile(parquet_path, tmp_path)
+        self._add(key, tmp_path, ttl)
+
+    def remove(self, key: str):
+        """Removes the entry stored under key."""
+        for path in (self._get_meta_path(key), self._get_data_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """Removes all entries and resets hit and miss counters."""
+        for name in os.listdir(self.path):
+            if name.endswith((".json", ".parquet", ".tmp")):
+                os.remove(os.path.join(self.path, name))
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def evict(self):
+        """Removes expired entries and, if the cache is larger than max_size, the least recently used entries."""
+        entries = []
+        for key in self._get_keys():
+            entry = self._get_entry(key)
+            if entry is not None:
+                entries.append((entry["last_used"], entry["size"], key))
+        if self.max_size is None:
+            return
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, key in sorted(entries):
+            if size <= self.max_size:
+                break
+            self.logger.debug(f"Cache entry {key} evicted.")
+            self.remove(key)
+            size -= entry_size
+
+    def stats(self):
+        """Returns the number of hits, misses, entries and the size of the cache in bytes."""
+        entries = [entry for entry in map(self._get_entry, self._get_keys()) if entry is not None]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "size": sum(entry["size"] for entry in entries),
+        }
+
+    def _add(self, key, tmp_path, ttl):
+        ttl = ttl if ttl is not None else self.ttl
+        meta = {"created": time.time(), "ttl": ttl}
+        # data file is replaced first, so the metadata never points to an incomplete file
+        os.replace(tmp_path, self._get_data_path(key))
+        meta_tmp_path = self._get_tmp_path(key)
+        with open(meta_tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_tmp_path, self._get_meta_path(key))
+        self.evict()
+
+    def _get_entry(self, key):
+        meta_path = self._get_meta_path(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            last_used = os.path.getmtime(meta_path)
+            size = os.path.getsize(self._get_data_path(key))
+        except (OSError, ValueError):
+            return None
+        if meta["ttl"] is not None and meta["created"] + meta["ttl"] < time.time():
+            self.remove(key)
+            return None
+        return dict(meta, last_used=last_used, size=size)
+
+    def _get_keys(self):
+        return [name[: -len(".json")] for name in os.listdir(self.path) if name.endswith(".json")]
+
+    def _get_meta_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def _get_data_path(self, key):
+        return os.path.join(self.path, key + ".parquet")
+
+    def _get_tmp_path(self, key):
+        return os.path.join(self.path, f"{key}.{uuid.uuid4().hex}.tmp")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+class MetadataCache:
+    """Cache of table metadata (existence, column names and types) used by SQLDB.
+
+    Entries are stored under engine string, schema and table and expire after ttl seconds. They're kept in memory
+    and, if path is specified, also on disk as json files, so they can be reused by other processes. SQLDB removes
+    the entries of the tables it creates, drops or copies.
+
+    Parameters
+    ----------
+    ttl : int, optional
+        Number of seconds after which the entries expire, by default 300
+    path : str, optional
+        Directory of on-disk entries, by default None (entries are kept only in memory)
+
+    Examples
+    --------
+    >>> cache = MetadataCache(ttl=60)
+    >>> cache.put("sqlite://", "schema", "table", [["id", "integer", 32]])
+    >>> cache.get("sqlite://", "schema", "table")
+    [['id', 'integer', 32]]
+    >>> cache.invalidate("sqlite://", "schema", "table")
+    >>> cache.get("sqlite://", "schema", "table") is None
+    True
+    """
+
+    def __init__(self, ttl: int = 300, path: str = None, logger: Logger = None):
+        self.ttl = ttl
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def get(self, engine: str, schema: str, table: str):
+        """Returns cached rows of (column name, type, max length) of the table or None if the entry doesn't exist
+        or has expired. Empty list means that the table doesn't exist."""
+        key = self._get_key(engine, schema, table)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.path:
+            entry = self._read_entry(key)
+        if entry is None or entry["created"] + self.ttl < time.time():
+            self._count(hit=False)
+            return None
+        with self._lock:
+            self._entries[key] = entry
+        self._count(hit=True)
+        return entry["columns"]
+
+    def put(self, engine: str, schema: str, table: str, columns: list):
+        """Stores rows of (column name, type, max length) of the table, empty list if the table doesn't exist."""
+        key = self._get_key(engine, schema, table)
+        entry = {"created": time.time(), "columns": [list(column) for column in columns]}
+        with self._lock:
+            self._entries[key] = entry
+        if self.path:
+            tmp_path = os.path.join(self.path, f"{key}.{uuid.uuid4().hex}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f, default=str)
+            os.replace(tmp_path, self._get_entry_path(key))
+
+    def invalidate(self, engine: str, schema: str, table: str):
+        """Removes the entry of the table and the entry without schema (see SQLDB.check_if_exists)."""
+        keys = {self._get_key(engine, schema, table), self._get_key(engine, None, table)}
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.path:
+            for key in keys:
+                try:
+                    os.remove(self._get_entry_path(key))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        """Removes all entries and resets hit and miss counters."""
+        with self._lock:
+            self._entries = {}
+            self.hits = 0
+            self.misses = 0
+        if self.path:
+            for name in os.listdir(self.path):
+                if name.endswith((".json", ".tmp")):
+                    os.remove(os.path.join(self.path, name))
+
+    def _get_key(self, engine, schema, table):
+        return hashlib.sha256(json.dumps([engine, schema or "", table]).encode("utf-8")).hexdigest()
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def _read_entry(self, key):
+        try:
+            with open(self._get_entry_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
@@ -1,11 +1,17 @@
 import csv
+import gzip
+import io
 import pandas as pd
 import openpyxl
-from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
+import os
+import shutil
 from os.path import basename
 
+from .pool import get_pool
+
 # Rename to Extract and remove existing Extract class
 class Extract:
     def __init__(self):
@@ -13,22 +19,107 @@ class Extract:
         self.path = None
         self.logger = logging.getLogger(__name__)
 
-    def to_csv(self, csv_path, sep="\t", chunksize=None, debug=False, cursor=None):
+    def to_csv(
+        self,
+        csv_path,
+        sep="\t",
+        chunksize=None,
+        debug=False,
+        cursor=None,
+        keys=None,
+        workers=None,
+        partition_by=None,
+        partition_method="range",
+        compression=None,
+        max_rows=None,
+        max_bytes=None,
+        estimate=False,
+    ):
+        """Writes QFrame to csv file. See grizly.tools.extract.to_csv for description of compression, max_rows
+        and max_bytes and QFrame.to_df for description of keys, workers, partition_by, partition_method and
+        estimate. If cursor is given, the session statements of the hints (eg. SET query_group) are executed and
+        the temporary tables of cte='temp' are created with it before the query, the tables are dropped afterwards.
+        """
         self.logger.info(f"Downloading data into '{basename(csv_path)}'...")
 
         if self.tool_name == "QFrame":
-            self.sql = self.get_sql()
-            if "denodo" in self.engine.lower():
-                self.sql += " CONTEXT('swap' = 'ON', 'swapsize' = '400', 'swapblocksize' = '1000', 'maxresultsize' = '100', 'i18n' = 'us_est', 'queryTimeout' = '9000000000', 'simplify' = 'off')"
-            row_count = to_csv(
-                columns=self.get_fields(aliased=True),
-                csv_path=csv_path,
-                sql=self.sql,
-                engine=self.engine,
-                sep=sep,
-                chunksize=chunksize,
-                cursor=cursor,
-            )
+            self.sql = self.get_sql(print_sql=False)
+            context = self._compile_hints()[0]
+            statements = self._get_session_sql()
+            self.sql += context
+            columns = self.get_fields(aliased=True)
+            if workers:
+                if max_rows or max_bytes:
+                    raise ValueError("Parameters max_rows and max_bytes can't be used with workers.")
+                # chunks are written concurrently to part files which are then merged in the order of chunks
+                qfs = self._get_chunks(
+                    chunksize,
+                    keys=keys,
+                    workers=workers,
+                    partition_by=partition_by,
+                    partition_method=partition_method,
+                    estimate=estimate,
+                )
+                parts = [(qf.get_sql(print_sql=False) + context, f"{csv_path}.part{i}") for i, qf in enumerate(qfs)]
+
+                def write_part(part, con):
+                    sql, part_path = part
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    part_cursor = con.cursor()
+                    part_row_count = to_csv(
+                        columns,
+                        part_path,
+                        sql,
+                        sep=sep,
+                        chunksize=chunksize,
+                        cursor=part_cursor,
+                        mode="a",
+                        compression=compression,
+                    )
+                    part_cursor.close()
+                    return part_row_count
+
+                row_count = sum(self._run_chunks(write_part, parts, workers))
+                # compressed parts are complete gzip/zstd streams, concatenated they form a valid file
+                _CSVWriter(csv_path, columns, sep=sep, compression=compression).close()
+                with open(csv_path, "ab") as csvfile:
+                    for _, part_path in parts:
+                        with open(part_path, "rb") as part_file:
+                            shutil.copyfileobj(part_file, csvfile)
+                        os.remove(part_path)
+            else:
+                if keys and chunksize:
+                    # keyset pagination, every chunk is a separate query starting after the last row of the previous one
+                    sql = [qf.get_sql(print_sql=False) + context for qf in self.cut(chunksize, keys=keys)]
+                else:
+                    sql = self.sql
+                con = None
+                if cursor is None and (statements or self._compile()["temp_tables"]):
+                    # session statements (hints) and temporary tables have to be on the same connection as the query
+                    con = self._get_sqldb().get_connection()
+                    cursor = con.cursor()
+                elif cursor is not None:
+                    # connection of the user's cursor is not opened by SQLDB, so the hints are set here
+                    for statement in statements:
+                        cursor.execute(statement)
+                # cursor is None only if there are no temporary tables
+                with self._temp_tables(cursor=cursor):
+                    row_count = to_csv(
+                        columns=columns,
+                        csv_path=csv_path,
+                        sql=sql,
+                        engine=self.engine,
+                        sep=sep,
+                        chunksize=chunksize,
+                        cursor=cursor,
+                        compression=compression,
+                        max_rows=max_rows,
+                        max_bytes=max_bytes,
+                    )
+                if con is not None:
+                    cursor.close()
+                    con.close()
             self.logger.info(f"Successfully wrote to '{basename(csv_path)}'")
             if debug:
                 return row_count
@@ -36,33 +127,104 @@ class Extract:
         elif self.tool_name == "GitHub":
             self.df.to_csv(csv_path)
 
-    def to_parquet(self, parquet_path, chunksize=None, debug=False, cursor=None):
+    def to_parquet(
+        self,
+        parquet_path,
+        chunksize=None,
+        debug=False,
+        cursor=None,
+        keys=None,
+        workers=None,
+        partition_by=None,
+        partition_method="range",
+        row_group_size=100000,
+        compression="snappy",
+        estimate=False,
+    ):
         """Saves data to Parquet file.
-        TO CHECK: I don't think we need chunksize anymore since we do chunks with
-        sql
 
-        Note: You need to use BIGINT and not INTEGER as custom_type in QFrame. The
-        problem is that parquet files use int64 and INTEGER is only int4
+        For QFrame the rows are fetched in batches of row_group_size rows and each batch is written as a row group
+        with pyarrow.parquet.ParquetWriter, so the whole result is never kept in memory (unless workers are used).
+        Parquet schema is based on the types of QFrame fields (see QFrame.get_dtypes) and 'dim' fields are
+        dictionary encoded. If QFrame.cache is set, the result is read from the cache or the written file is
+        added to it.
 
         Parameters
         ----------
         parquet_path : str
             Path to template Parquet file
         chunksize : str
-            Not implemented
+            Number of rows retrieved with a single query, used only with keys or workers
         debug : str, optional
             Whether to display the number of rows returned by the query
+        keys : list or str, optional
+            Aliases of the columns which uniquely identify the rows, used with chunksize, see QFrame.to_df()
+        workers : int, optional
+            Number of chunks retrieved concurrently, see QFrame.to_df()
+        partition_by : str, optional
+            Key used to divide the QFrame into workers partitions, see QFrame.to_df()
+        partition_method : {'range', 'hash'}, optional
+            Method used to divide the QFrame, see QFrame.partition()
+        row_group_size : int, optional
+            Maximum number of rows in a row group, by default 100000
+        compression : str, optional
+            Compression codec, eg. 'snappy', 'gzip', 'zstd', 'none', by default 'snappy'
+        estimate : bool, optional
+            Whether workers' chunks are sized from the estimated number of rows, see QFrame.cut()
         Returns
         -------
         Class
         """
         if self.tool_name == "QFrame":
-            self.df = self.to_df()
-            self.df.astype(dtype=self.dtypes).to_parquet(parquet_path)
+            interface = self.interface
+            cache_key = self._get_cache_key("parquet", interface=interface) if self.cache is not None else None
+            table = self.cache.get(cache_key) if cache_key else None
+            cached = table is not None
+            if cached:
+                readers = [pa.RecordBatchReader.from_batches(table.schema, table.to_batches(row_group_size))]
+            elif workers:
+                table = self._to_arrow(
+                    chunksize=chunksize,
+                    keys=keys,
+                    workers=workers,
+                    partition_by=partition_by,
+                    partition_method=partition_method,
+                    estimate=estimate,
+                    interface=interface,
+                    batch_rows=row_group_size,
+                )
+                readers = [pa.RecordBatchReader.from_batches(table.schema, table.to_batches(row_group_size))]
+            elif keys and chunksize:
+                readers = (
+                    qf._to_arrow(stream=True, interface=interface, batch_rows=row_group_size)
+                    for qf in self.cut(chunksize, keys=keys)
+                )
+            else:
+                readers = [self._to_arrow(stream=True, interface=interface, batch_rows=row_group_size)]
+
+            dim_columns = self._get_dim_columns()
+            row_count = 0
+            writer = None
+            try:
+                for reader in readers:
+                    if writer is None:
+                        writer = pq.ParquetWriter(
+                            parquet_path, reader.schema, compression=compression, use_dictionary=dim_columns
+                        )
+                    for batch in reader:
+                        writer.write_batch(batch, row_group_size=row_group_size)
+                        row_count += batch.num_rows
+            finally:
+                if writer is not None:
+                    writer.close()
+            if cache_key and not cached and writer is not None:
+                self.cache.put_file(cache_key, parquet_path)
+            if debug:
+                return row_count
         elif self.tool_name == "GitHub":
             self.df.astype(dtype=self.df.dtypes).to_parquet(parquet_path)
-        if debug:
-            return self.df.shape[0] or 0
+            if debug:
+                return self.df.shape[0] or 0
 
     def to_excel(
         self, input_excel_path, output_excel_path, sheet_name="", startrow=0, startcol=0, index=False, header=False,
@@ -121,70 +283,180 @@ def copy_df_to_excel(
 
 
 def to_csv(
-    columns, csv_path, sql, engine=None, sep="\t", chunksize=None, debug=False, cursor=None,
+    columns,
+    csv_path,
+    sql,
+    engine=None,
+    sep="\t",
+    chunksize=None,
+    debug=False,
+    cursor=None,
+    mode="w",
+    compression=None,
+    max_rows=None,
+    max_bytes=None,
 ):
     """
-    Writes table to csv file.
+    Writes table to csv file. Rows are always fetched with cursor.fetchmany, so only a single batch is kept in memory.
     Parameters
     ----------
     csv_path : string
         Path to csv file.
-    sql : string
-        SQL query.
+    sql : string or list
+        SQL query. If list, the queries are executed one after another and their rows are written to the same file.
     engine : str, optional
         Engine string. Required if cursor is not provided.
     sep : string, default '\t'
         Separtor/delimiter in csv file.
     chunksize : int, default None
-        If specified, return an iterator where chunksize is the number of rows to include in each chunk.
+        Number of rows fetched at once. If not specified it's adjusted to the size of the rows, so that a single batch
+        takes about 8 MB.
     cursor : Cursor, optional
         The cursor to be used to execute the SQL, by default None
+    mode : {'w', 'a'}, default 'w'
+        Whether to overwrite the file or to append the rows to it (without header).
+    compression : {None, 'gzip', 'zstd'}, default None
+        Compression of the file. 'zstd' requires zstandard package.
+    max_rows : int, default None
+        If specified, the rows are split into part files with at most max_rows rows each,
+        eg. data_0000.csv.gz, data_0001.csv.gz for csv_path data.csv.gz. Every part file has a header.
+    max_bytes : int, default None
+        If specified, the rows are split into part files (as with max_rows) once a file (after compression) exceeds
+        approximately max_bytes bytes. Checked after each fetched batch.
+
+    Returns
+    -------
+    int
+        Number of rows written
     """
+    sqls = [sql] if isinstance(sql, str) else sql
+
     if cursor:
-        cursor.execute(sql)
         close_cursor = False
 
     else:
-        engine = create_engine(engine, encoding="utf8", poolclass=NullPool)
+        pool = get_pool(engine)
 
+        con = None
         try:
-            con = engine.connect().connection
+            con = pool.connect()
             cursor = con.cursor()
-            cursor.execute(sql)
+            cursor.execute(sqls[0])
         except:
             try:
-                con = engine.connect().connection
+                # the pooled connection may be stale, don't let the pool hand it out again
+                if con is not None:
+                    con.invalidate()
+                con = pool.connect()
                 cursor = con.cursor()
-                cursor.execute(sql)
+                cursor.execute(sqls[0])
             except:
                 raise
 
         close_cursor = True
 
-    with open(csv_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile, delimiter=sep)
-        writer.writerow(columns)
-        cursor_row_count = 0
-        if isinstance(chunksize, int):
-            if chunksize == 1:
-                while True:
-                    row = cursor.fetchone()
-                    cursor_row_count += 1
-                    if not row:
-                        break
-                    writer.writerow(row)
-            else:
-                while True:
-                    rows = cursor.fetchmany(chunksize)
-                    cursor_row_count += len(rows)
-                    if not rows:
-                        break
-                    writer.writerows(rows)
+    writer = _CSVWriter(
+        csv_path, columns, sep=sep, compression=compression, max_rows=max_rows, max_bytes=max_bytes, mode=mode
+    )
+    try:
+        for i, sql in enumerate(sqls):
+            if i > 0 or not close_cursor:  # the first query on our own connection is already executed
+                cursor.execute(sql)
+            batch_rows = chunksize or 1000
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                if not chunksize:
+                    batch_rows = _get_batch_rows(rows)
+    finally:
+        writer.close()
+        if close_cursor:
+            cursor.close()
+            con.close()
+
+    return writer.row_count
+
+
+BATCH_BYTES = 8 * 2 ** 20
+
+
+def _get_batch_rows(rows):
+    """Returns number of rows taking about BATCH_BYTES, estimated from the size of up to 100 rows."""
+    sample = rows[:100]
+    row_bytes = sum(len(str(value)) + 1 for row in sample for value in row) / len(sample)
+    return max(100, min(100000, int(BATCH_BYTES / max(row_bytes, 1))))
+
+
+class _CSVWriter:
+    """Writes rows to csv file compressed with gzip or zstd, switching to the next part file after max_rows rows or
+    max_bytes bytes."""
+
+    def __init__(self, csv_path, columns, sep="\t", compression=None, max_rows=None, max_bytes=None, mode="w"):
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError("Invalid value in compression. Valid values: None, 'gzip', 'zstd'.")
+        self.csv_path = csv_path
+        self.columns = columns
+        self.sep = sep
+        self.compression = compression
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.paths = []
+        self.row_count = 0
+        self._file = None
+        self._open()
+
+    def _get_path(self):
+        if not (self.max_rows or self.max_bytes):
+            return self.csv_path
+        directory, name = os.path.split(self.csv_path)
+        root, _, extension = name.partition(".")
+        extension = "." + extension if extension else ""
+        return os.path.join(directory, f"{root}_{len(self.paths):04d}{extension}")
+
+    def _open(self):
+        path = self._get_path()
+        self._raw = open(path, self.mode + "b")
+        if self.compression == "gzip":
+            stream = gzip.GzipFile(fileobj=self._raw, mode=self.mode + "b")
+        elif self.compression == "zstd":
+            import zstandard
+
+            stream = zstandard.ZstdCompressor().stream_writer(self._raw)
         else:
-            writer.writerows(cursor.fetchall())
+            stream = self._raw
+        self._file = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file, delimiter=self.sep)
+        if self.mode == "w":
+            self._writer.writerow(self.columns)
+        self._part_rows = 0
+        self.paths.append(path)
+
+    def _is_full(self):
+        if self.max_rows and self._part_rows >= self.max_rows:
+            return True
+        if self.max_bytes:
+            self._file.flush()
+            return self._raw.tell() >= self.max_bytes
+        return False
 
-    if close_cursor:
-        cursor.close()
-        con.close()
+    def writerows(self, rows):
+        while rows:
+            if self._is_full():
+                self.close()
+                self.mode = "w"
+                self._open()
+            size = self.max_rows - self._part_rows if self.max_rows else len(rows)
+            part_rows = rows[:size]
+            self._writer.writerows(part_rows)
+            self._part_rows += len(part_rows)
+            self.row_count += len(part_rows)
+            rows = rows[size:]
 
-    return cursor_row_count
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = None
@@ -0,0 +1,753 @@
+"""Typed representation of QFrame.data used to generate SQL.
+
+QFrame.data stays the source of truth (it is what read_dict, save_json and from_json read and write).
+The nodes below are built from it once per change of the data and are never modified afterwards,
+so they can be cached and shared between QFrames.
+"""
+import hashlib
+import json
+import re
+
+
+AGGREGATIONS = {"SUM", "COUNT", "MAX", "MIN", "AVG"}
+
+
+class Field:
+    """Single field of a SELECT statement."""
+
+    __slots__ = ("name", "type", "alias", "expression", "group_by", "order_by", "custom_type", "selected")
+
+    def __init__(
+        self, name, type="dim", alias="", expression="", group_by="", order_by="", custom_type="", selected=True,
+    ):
+        self.name = name
+        self.type = type
+        self.alias = alias or name
+        self.expression = expression or name
+        self.group_by = group_by
+        self.order_by = order_by
+        self.custom_type = custom_type
+        self.selected = selected
+
+    @classmethod
+    def from_dict(cls, name, attrs):
+        return cls(
+            name,
+            type=attrs.get("type", ""),
+            alias=attrs.get("as") or "",
+            expression=attrs.get("expression") or "",
+            group_by=attrs.get("group_by") or "",
+            order_by=attrs.get("order_by") or "",
+            custom_type=attrs.get("custom_type") or "",
+            selected=attrs.get("select", "") == "",
+        )
+
+    def to_dict(self):
+        attrs = {"type": self.type}
+        if self.alias != self.name:
+            attrs["as"] = self.alias
+        if self.expression != self.name:
+            attrs["expression"] = self.expression
+        if self.group_by:
+            attrs["group_by"] = self.group_by
+        if self.order_by:
+            attrs["order_by"] = self.order_by
+        if self.custom_type:
+            attrs["custom_type"] = self.custom_type
+        if not self.selected:
+            attrs["select"] = 0
+        return attrs
+
+    @property
+    def sql_type(self):
+        if self.custom_type:
+            return self.custom_type.upper()
+        elif self.type == "num":
+            return "FLOAT(53)"
+        return "VARCHAR(500)"
+
+    @property
+    def sql_expression(self):
+        if self.group_by.upper() in AGGREGATIONS:
+            return f"{self.group_by}({self.expression})"
+        return self.expression
+
+
+class Subquery:
+    """Query used in the FROM clause, aliased as sq, sq1, sq2, ..."""
+
+    __slots__ = ("query", "alias")
+
+    def __init__(self, query, alias):
+        self.query = query
+        self.alias = alias
+
+
+class CommonTable:
+    """Query which appears several times in the query tree, defined once in the WITH clause as name.
+
+    CommonTable is used as the query of Subquery and the same object is shared by all its occurrences."""
+
+    __slots__ = ("name", "query")
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+
+
+class Join:
+    """Source of a SELECT made of joined subqueries."""
+
+    __slots__ = ("subqueries", "join_types", "on")
+
+    def __init__(self, subqueries, join_types, on):
+        self.subqueries = subqueries
+        self.join_types = join_types
+        self.on = on
+
+
+class _Query:
+    __slots__ = ("fields", "offset", "limit")
+
+    def sql_blocks(self):
+        """Returns the column strings of the query (see qframe._build_column_strings)."""
+        return column_strings(self.fields)
+
+    def _tail_sql(self, sql_blocks):
+        sql = ""
+        if sql_blocks["order_by"]:
+            sql += " ORDER BY {}".format(", ".join(sql_blocks["order_by"]))
+        if self.offset != "":
+            sql += f" OFFSET {self.offset}"
+        if self.limit != "":
+            sql += f" LIMIT {self.limit}"
+        return sql
+
+
+class Select(_Query):
+    """SELECT statement reading from a table, a subquery or joined subqueries."""
+
+    __slots__ = ("schema", "table", "source", "distinct", "where", "having")
+
+    def __init__(
+        self, fields, schema="", table="", source=None, distinct=False, where="", having="", offset="", limit="",
+    ):
+        self.fields = fields
+        self.schema = schema
+        self.table = table
+        self.source = source
+        self.distinct = distinct
+        self.where = where
+        self.having = having
+        self.offset = offset
+        self.limit = limit
+
+    def replace(self, **changes):
+        """Returns a copy of the statement with changed attributes."""
+        attrs = {attr: getattr(self, attr) for attr in ("fields", "offset", "limit") + Select.__slots__}
+        attrs.update(changes)
+        return Select(**attrs)
+
+    def to_sql(self):
+        sql_blocks = self.sql_blocks()
+        sql = "SELECT"
+        if self.distinct:
+            sql += " DISTINCT"
+        sql += " " + ", ".join(sql_blocks["select_names"])
+
+        if self.table:
+            sql += f" FROM {self.schema}.{self.table}" if self.schema else f" FROM {self.table}"
+        elif isinstance(self.source, Join):
+            first, *others = self.source.subqueries
+            sql += f" FROM {_subquery_sql(first)}"
+            for subquery, join_type, on in zip(others, self.source.join_types, self.source.on):
+                sql += f" {join_type.upper()} {_subquery_sql(subquery)}"
+                if on not in {0, "0"}:
+                    sql += f" ON {on}"
+        elif isinstance(self.source, Subquery):
+            sql += f" FROM {_subquery_sql(self.source)}"
+
+        if self.where:
+            sql += f" WHERE {self.where}"
+        if sql_blocks["group_dimensions"]:
+            sql += " GROUP BY {}".format(", ".join(sql_blocks["group_dimensions"]))
+        if self.having:
+            sql += f" HAVING {self.having}"
+
+        return sql + self._tail_sql(sql_blocks)
+
+
+class Union(_Query):
+    """Queries combined with UNION or UNION ALL."""
+
+    __slots__ = ("queries", "union_types")
+
+    def __init__(self, fields, queries, union_types, offset="", limit=""):
+        self.fields = fields
+        self.queries = queries
+        self.union_types = union_types
+        self.offset = offset
+        self.limit = limit
+
+    def to_sql(self):
+        sql_blocks = self.sql_blocks()
+        first, *others = self.queries
+        sql = first.to_sql()
+        for query, union_type in zip(others, self.union_types):
+            sql += f" {union_type.upper()} {query.to_sql()}"
+        return sql + self._tail_sql(sql_blocks)
+
+
+class With(_Query):
+    """Query preceded by the WITH clause which defines its common tables."""
+
+    __slots__ = ("tables", "query")
+
+    def __init__(self, tables, query):
+        self.tables = tables
+        self.query = query
+        self.fields = query.fields
+        self.offset = query.offset
+        self.limit = query.limit
+
+    def to_sql(self):
+        tables = ", ".join(f"{table.name} AS ({table.query.to_sql()})" for table in self.tables)
+        return f"WITH {tables} {self.query.to_sql()}"
+
+
+def _subquery_sql(subquery):
+    if isinstance(subquery.query, CommonTable):
+        return f"{subquery.query.name} {subquery.alias}"
+    return f"({subquery.query.to_sql()}) {subquery.alias}"
+
+
+def from_dict(data):
+    """Builds the query tree from QFrame.data.
+
+    Examples
+    --------
+    >>> data = {'select': {'fields': {'CustomerId': {'type': 'dim', 'as': 'Id'}}, 'schema': 'schema', 'table': 'table'}}
+    >>> from_dict(data).to_sql()
+    'SELECT CustomerId AS Id FROM schema.table'
+    """
+    select = data["select"]
+    fields = [Field.from_dict(name, attrs) for name, attrs in select["fields"].items()]
+    offset = str(select.get("offset", ""))
+    limit = str(select.get("limit", ""))
+
+    if "union" in select:
+        union_types = select["union"]["union_type"]
+        queries = [from_dict(data[f"sq{i}"]) for i in range(1, len(union_types) + 2)]
+        return Union(fields, queries, union_types, offset=offset, limit=limit)
+
+    source = None
+    if "table" not in select:
+        if "join" in select:
+            join_types = select["join"]["join_type"]
+            subqueries = [Subquery(from_dict(data[f"sq{i}"]), f"sq{i}") for i in range(1, len(join_types) + 2)]
+            source = Join(subqueries, join_types, select["join"]["on"])
+        elif "sq" in data:
+            source = Subquery(from_dict(data["sq"]), "sq")
+
+    return Select(
+        fields,
+        schema=select.get("schema", ""),
+        table=select.get("table", ""),
+        source=source,
+        distinct=str(select.get("distinct", "")) == "1",
+        where=select.get("where", ""),
+        having=select.get("having", ""),
+        offset=offset,
+        limit=limit,
+    )
+
+
+def to_dict(query):
+    """Converts the query tree back to QFrame.data format."""
+    select = {"fields": {field.name: field.to_dict() for field in query.fields}}
+    data = {"select": select}
+
+    if isinstance(query, Union):
+        select["union"] = {"union_type": list(query.union_types)}
+        for i, subquery in enumerate(query.queries, start=1):
+            data[f"sq{i}"] = to_dict(subquery)
+    else:
+        if query.table:
+            select["table"] = query.table
+            if query.schema:
+                select["schema"] = query.schema
+        elif isinstance(query.source, Join):
+            select["join"] = {"join_type": list(query.source.join_types), "on": list(query.source.on)}
+            for subquery in query.source.subqueries:
+                data[subquery.alias] = to_dict(subquery.query)
+        elif isinstance(query.source, Subquery):
+            data["sq"] = to_dict(query.source.query)
+        if query.distinct:
+            select["distinct"] = 1
+        if query.where:
+            select["where"] = query.where
+        if query.having:
+            select["having"] = query.having
+
+    if query.offset != "":
+        select["offset"] = query.offset
+    if query.limit != "":
+        select["limit"] = query.limit
+    return data
+
+
+def get_duplicated_columns(fields):
+    columns = {}
+    for field in fields:
+        columns.setdefault(field.alias, []).append(field.name)
+    return {alias: names for alias, names in columns.items() if len(names) > 1}
+
+
+def column_strings(fields):
+    duplicates = get_duplicated_columns(fields)
+    assert (
+        duplicates == {}
+    ), f"""Some of your fields have the same aliases {duplicates}. Use your_qframe.remove() to remove or your_qframe.rename() to rename columns."""
+
+    select_names = []
+    select_aliases = []
+    group_dimensions = []
+    group_values = []
+    order_by = []
+    types = []
+
+    for field in fields:
+        group_by = field.group_by.upper()
+        if group_by == "GROUP":
+            prefix = re.search(r"^sq\d*[.]", field.name)
+            group_dimensions.append(field.name[len(prefix.group(0)) :] if prefix else field.name)
+        elif group_by in AGGREGATIONS:
+            group_values.append(field.alias)
+
+        if field.selected:
+            expr = field.sql_expression
+            select_names.append(field.name if expr == field.alias else f"{expr} AS {field.alias}")
+            select_aliases.append(field.alias)
+            types.append(field.sql_type)
+            if field.order_by:
+                order = field.order_by if field.order_by.upper() == "DESC" else ""
+                order_by.append(f"{field.alias} {order}")
+
+    return {
+        "select_names": select_names,
+        "select_aliases": select_aliases,
+        "group_dimensions": group_dimensions,
+        "group_values": group_values,
+        "order_by": order_by,
+        "types": types,
+    }
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_IDENTIFIER = re.compile(r"[A-Za-z_][\w$]*")
+
+
+def _get_referenced_names(texts):
+    """Returns lower case identifiers used in SQL expressions, without the contents of string literals."""
+    names = set()
+    for text in texts:
+        names.update(name.lower() for name in _IDENTIFIER.findall(_STRING_LITERAL.sub("", str(text))))
+    return names
+
+
+def _get_outer_texts(query):
+    """Returns the parts of a SELECT which can reference the columns of its subqueries."""
+    texts = [query.where, query.having]
+    for field in query.fields:
+        if field.selected or field.group_by.upper() == "GROUP":
+            texts += [field.name, field.sql_expression]
+    if isinstance(query.source, Join):
+        texts += query.source.on
+    return texts
+
+
+def _is_used(field, names):
+    return field.alias.lower() in names or field.group_by.upper() == "GROUP" or bool(field.order_by)
+
+
+def prune_columns(query):
+    """Returns the query tree without the columns of joined subqueries and union branches which are not used
+    by the outer query.
+
+    A column of a subquery is kept if its alias is used in the select list, where, having or join conditions
+    of the outer query, if it's a GROUP BY dimension or if it's used in ORDER BY. DISTINCT subqueries and
+    UNION (without ALL) are never pruned as removing a column could change the number of rows. Subqueries
+    created with QFrame.select() keep all their columns. The nodes of the original tree are not modified.
+
+    Examples
+    --------
+    >>> data = {'select': {'fields': {'sq1.Id': {'type': 'dim', 'as': 'Id'}}, 'join': {'join_type': ['left join'], 'on': ['sq1.Id=sq2.Id']}},
+    ...         'sq1': {'select': {'fields': {'Id': {'type': 'dim'}, 'Name': {'type': 'dim'}}, 'table': 'table1'}},
+    ...         'sq2': {'select': {'fields': {'Id': {'type': 'dim'}, 'Value': {'type': 'num'}}, 'table': 'table2'}}}
+    >>> prune_columns(from_dict(data)).to_sql()
+    'SELECT sq1.Id AS Id FROM (SELECT Id FROM table1) sq1 LEFT JOIN (SELECT Id FROM table2) sq2 ON sq1.Id=sq2.Id'
+    """
+    if isinstance(query, Union):
+        queries = [prune_columns(subquery) for subquery in query.queries]
+        return Union(query.fields, queries, query.union_types, offset=query.offset, limit=query.limit)
+    if isinstance(query, CommonTable) or query.source is None:
+        # common tables are used by several subqueries, their columns are never pruned
+        return query
+
+    texts = _get_outer_texts(query)
+    names = _get_referenced_names(texts)
+    keep_all = any(text.strip() == "*" or text.strip().endswith(".*") for text in texts if isinstance(text, str))
+
+    if isinstance(query.source, Join):
+        subqueries = [
+            Subquery(_prune_subquery(subquery.query, names, keep_all), subquery.alias)
+            for subquery in query.source.subqueries
+        ]
+        source = Join(subqueries, query.source.join_types, query.source.on)
+    elif isinstance(query.source.query, Union):
+        source = Subquery(_prune_subquery(query.source.query, names, keep_all), query.source.alias)
+    else:
+        source = Subquery(prune_columns(query.source.query), query.source.alias)
+
+    return query.replace(source=source)
+
+
+def _prune_subquery(query, names, keep_all):
+    if keep_all or isinstance(query, CommonTable):
+        return prune_columns(query)
+    if isinstance(query, Union):
+        return prune_columns(_prune_union(query, names))
+    if query.distinct:
+        return prune_columns(query)
+
+    names = names | _get_referenced_names([query.having])
+    selected = [field for field in query.fields if field.selected]
+    used = [field for field in selected if _is_used(field, names)] or selected[:1]
+    fields = [field for field in query.fields if not field.selected or field in used]
+    if len(fields) == len(query.fields):
+        return prune_columns(query)
+
+    return prune_columns(query.replace(fields=fields))
+
+
+def _prune_union(query, names):
+    """Removes from every branch of UNION ALL the columns on positions of unused union columns."""
+    if any(union_type.upper() != "UNION ALL" for union_type in query.union_types):
+        return query
+    if not all(isinstance(branch, Select) and not branch.distinct for branch in query.queries):
+        return query
+
+    keep = [i for i, field in enumerate(query.fields) if _is_used(field, names)] or [0]
+    if len(keep) == len(query.fields):
+        return query
+
+    branches = []
+    for branch in query.queries:
+        selected = [field for field in branch.fields if field.selected]
+        if len(selected) != len(query.fields):
+            return query
+        removed = [field for i, field in enumerate(selected) if i not in keep]
+        if any(field.group_by.upper() == "GROUP" or field.order_by for field in removed):
+            return query
+        branches.append(branch.replace(fields=[field for field in branch.fields if field not in removed]))
+    fields = [field for i, field in enumerate(query.fields) if i in keep]
+    return Union(fields, branches, query.union_types, offset=query.offset, limit=query.limit)
+
+
+_QUALIFIED_NAME = re.compile(r"\b(sq\d*)\.([A-Za-z_][\w$]*)")
+# words which can appear in a condition without being column names
+_SQL_WORDS = {"and", "or", "not", "in", "is", "null", "like", "ilike", "between", "true", "false", "case", "when"}
+_SQL_WORDS |= {"then", "else", "end", "as", "escape", "date", "timestamp", "interval"}
+_AGGREGATE_CALL = re.compile(r"\b(?:" + "|".join(sorted(AGGREGATIONS)) + r")\s*\(", re.IGNORECASE)
+_WINDOW = re.compile(r"\bOVER\b", re.IGNORECASE)
+
+
+def _split_top_level(text, keyword):
+    """Splits text on keyword (eg. AND) which is outside of parentheses and string literals."""
+    pattern = re.compile(rf"\s+{keyword}\s+", re.IGNORECASE)
+    parts = []
+    depth = 0
+    in_string = False
+    start = i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            in_string = char != "'"
+        elif char == "'":
+            in_string = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and char.isspace():
+            match = pattern.match(text, i)
+            if match:
+                parts.append(text[start:i])
+                start = i = match.end()
+                continue
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _split_conjuncts(where):
+    if len(_split_top_level(where, "OR")) > 1:
+        return [where]
+    conjuncts = []
+    for part in _split_top_level(where, "AND"):
+        # AND of BETWEEN x AND y is not a conjunction
+        if conjuncts and re.search(r"\bbetween\s+\S+$", conjuncts[-1], re.IGNORECASE):
+            conjuncts[-1] += " AND " + part
+        else:
+            conjuncts.append(part)
+    return conjuncts
+
+
+def _and(*conditions):
+    conditions = [condition for condition in conditions if condition]
+    if len(conditions) == 1:
+        return conditions[0]
+    return " AND ".join(
+        f"({condition})" if len(_split_top_level(condition, "OR")) > 1 else condition for condition in conditions
+    )
+
+
+def _get_pushdown_target(conjunct):
+    """Returns the alias of the only subquery used in conjunct or None if conjunct can't be pushed down."""
+    text = _STRING_LITERAL.sub("''", conjunct)
+    aliases = {alias for alias, _ in _QUALIFIED_NAME.findall(text)}
+    if len(aliases) != 1:
+        return None
+    remaining = _QUALIFIED_NAME.sub("", text)
+    for match in _IDENTIFIER.finditer(remaining):
+        name = match.group(0).lower()
+        is_function = remaining[match.end() :].lstrip().startswith("(")
+        if name == "select" or not (name in _SQL_WORDS or is_function):
+            # unqualified column or a subquery
+            return None
+    return aliases.pop()
+
+
+def _substitute(conjunct, alias, expressions):
+    """Replaces alias.column in conjunct with the expressions of the columns, skipping string literals."""
+
+    def replace(match):
+        if match.group(1) != alias:
+            return match.group(0)
+        return expressions[match.group(2).lower()]
+
+    parts = re.split(r"('(?:[^']|'')*')", conjunct)
+    return "".join(part if part.startswith("'") else _QUALIFIED_NAME.sub(replace, part) for part in parts)
+
+
+def _is_aggregate(expression):
+    """Checks if expression contains an aggregate function or a window function (OVER), which can't be in WHERE."""
+    text = _STRING_LITERAL.sub("''", expression)
+    return bool(_AGGREGATE_CALL.search(text) or _WINDOW.search(text))
+
+
+def _get_pushdown_expressions(query, columns):
+    """Returns expressions which can replace the columns (aliases) of query in its WHERE clause or None."""
+    if not isinstance(query, Select) or query.limit != "" or query.offset != "":
+        return None
+    grouped = any(field.group_by.upper() in AGGREGATIONS | {"GROUP"} for field in query.fields)
+    fields = {field.alias.lower(): field for field in query.fields if field.selected}
+    expressions = {}
+    for column in columns:
+        field = fields.get(column)
+        if field is None or _is_aggregate(field.expression):
+            return None
+        # in a grouped query only the columns of GROUP BY can be filtered before grouping
+        if grouped and field.group_by.upper() != "GROUP":
+            return None
+        expression = field.expression
+        is_column = _IDENTIFIER.fullmatch(expression) or _QUALIFIED_NAME.fullmatch(expression)
+        expressions[column] = expression if is_column else f"({expression})"
+    return expressions
+
+
+def _push_into(query, alias, conjunct):
+    """Returns query with conjunct (referencing alias.column) added to its WHERE or None if it's not possible."""
+    columns = {column.lower() for name, column in _QUALIFIED_NAME.findall(conjunct) if name == alias}
+    if isinstance(query, Union):
+        if query.limit != "" or query.offset != "":
+            return None
+        positions = {field.alias.lower(): i for i, field in enumerate(query.fields)}
+        if not columns <= set(positions):
+            return None
+        branches = []
+        for branch in query.queries:
+            if not isinstance(branch, Select):
+                return None
+            selected = [field for field in branch.fields if field.selected]
+            # union columns are matched by position, rename them to the aliases of the branch
+            renamed = {column: selected[positions[column]].alias.lower() for column in columns}
+            branch_conjunct = _substitute(conjunct, alias, {column: f"{alias}.{renamed[column]}" for column in columns})
+            branch = _push_into(branch, alias, branch_conjunct)
+            if branch is None:
+                return None
+            branches.append(branch)
+        return Union(query.fields, branches, query.union_types, offset=query.offset, limit=query.limit)
+
+    expressions = _get_pushdown_expressions(query, columns)
+    if expressions is None:
+        return None
+    return query.replace(where=_and(query.where, _substitute(conjunct, alias, expressions)))
+
+
+def _get_null_supplying(join):
+    """Returns the aliases of subqueries whose columns can be NULL because of an outer join."""
+    aliases = [subquery.alias for subquery in join.subqueries]
+    null_supplying = set()
+    for i, join_type in enumerate(join.join_types, start=1):
+        join_type = join_type.upper()
+        if "LEFT" in join_type or "FULL" in join_type:
+            null_supplying.add(aliases[i])
+        if "RIGHT" in join_type or "FULL" in join_type:
+            null_supplying.update(aliases[:i])
+    return null_supplying
+
+
+def push_down_predicates(query):
+    """Returns the query tree with the conditions of WHERE moved to the subqueries they refer to.
+
+    A condition (a part of WHERE joined with AND) is moved if it references the columns of only one subquery,
+    all its columns are qualified (eg. sq1.Value), the subquery has no LIMIT or OFFSET, the expressions of the
+    columns have no aggregate or window (OVER) functions and, if the subquery is grouped, all the columns are in
+    its GROUP BY. Conditions on the columns of the null-supplying side of an outer join stay in the outer query.
+    Conditions on a union are added to every branch. The nodes of the original tree are not modified.
+
+    Examples
+    --------
+    >>> data = {'select': {'fields': {'sq.Id': {'type': 'dim', 'as': 'Id'}}, 'where': "sq.Name = 'A'"},
+    ...         'sq': {'select': {'fields': {'Id': {'type': 'dim'}, 'CustomerName': {'type': 'dim', 'as': 'Name'}}, 'table': 'table'}}}
+    >>> push_down_predicates(from_dict(data)).to_sql()
+    "SELECT sq.Id AS Id FROM (SELECT Id, CustomerName AS Name FROM table WHERE CustomerName = 'A') sq"
+    """
+    if isinstance(query, Union):
+        queries = [push_down_predicates(branch) for branch in query.queries]
+        return Union(query.fields, queries, query.union_types, offset=query.offset, limit=query.limit)
+    if isinstance(query, CommonTable) or query.source is None:
+        return query
+
+    if isinstance(query.source, Join):
+        subqueries = {subquery.alias: subquery.query for subquery in query.source.subqueries}
+        null_supplying = _get_null_supplying(query.source)
+    else:
+        subqueries = {query.source.alias: query.source.query}
+        null_supplying = set()
+
+    kept = []
+    for conjunct in _split_conjuncts(query.where) if query.where else []:
+        alias = _get_pushdown_target(conjunct)
+        subquery = None
+        if alias in subqueries and alias not in null_supplying:
+            subquery = _push_into(subqueries[alias], alias, conjunct)
+        if subquery is None:
+            kept.append(conjunct)
+        else:
+            subqueries[alias] = subquery
+
+    subqueries = {alias: push_down_predicates(subquery) for alias, subquery in subqueries.items()}
+    if isinstance(query.source, Join):
+        source = Join(
+            [Subquery(subqueries[subquery.alias], subquery.alias) for subquery in query.source.subqueries],
+            query.source.join_types,
+            query.source.on,
+        )
+    else:
+        source = Subquery(subqueries[query.source.alias], query.source.alias)
+    return query.replace(source=source, where=_and(*kept))
+
+
+def _get_subqueries(query):
+    if isinstance(query, Union):
+        return []
+    if isinstance(query.source, Join):
+        return query.source.subqueries
+    if isinstance(query.source, Subquery):
+        return [query.source]
+    return []
+
+
+def _fingerprint(query, fingerprints):
+    """Returns a hash of the query computed from the hashes of its subqueries, so the tree is hashed in one pass.
+
+    Hashes of all subqueries are stored in fingerprints under the id of their nodes."""
+    key = id(query)
+    if key in fingerprints:
+        return fingerprints[key]
+    parts = [type(query).__name__, query.offset, query.limit]
+    parts += [[getattr(field, attr) for attr in Field.__slots__] for field in query.fields]
+    if isinstance(query, Union):
+        parts += [query.union_types] + [_fingerprint(branch, fingerprints) for branch in query.queries]
+    else:
+        parts += [query.schema, query.table, query.distinct, query.where, query.having]
+        if isinstance(query.source, Join):
+            parts += [query.source.join_types, [str(on) for on in query.source.on]]
+        parts += [[subquery.alias, _fingerprint(subquery.query, fingerprints)] for subquery in _get_subqueries(query)]
+    fingerprint = hashlib.md5(json.dumps(parts).encode("utf-8")).hexdigest()
+    fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def _count_subqueries(query, fingerprints, counts):
+    """Counts the occurrences of every subquery (by its fingerprint); repeated subqueries are visited only once."""
+    branches = query.queries if isinstance(query, Union) else []
+    for branch in branches:
+        _count_subqueries(branch, fingerprints, counts)
+    for subquery in _get_subqueries(query):
+        key = fingerprints[id(subquery.query)]
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] == 1:
+            _count_subqueries(subquery.query, fingerprints, counts)
+
+
+def _replace_common(query, fingerprints, counts, tables):
+    if isinstance(query, Union):
+        queries = [_replace_common(branch, fingerprints, counts, tables) for branch in query.queries]
+        return Union(query.fields, queries, query.union_types, offset=query.offset, limit=query.limit)
+
+    def replace(subquery):
+        key = fingerprints[id(subquery.query)]
+        if counts[key] < 2:
+            return Subquery(_replace_common(subquery.query, fingerprints, counts, tables), subquery.alias)
+        if key not in tables:
+            # common tables used by this one are defined before it
+            body = _replace_common(subquery.query, fingerprints, counts, tables)
+            tables[key] = CommonTable(f"cte{len(tables) + 1}", body)
+        return Subquery(tables[key], subquery.alias)
+
+    if isinstance(query.source, Join):
+        subqueries = [replace(subquery) for subquery in query.source.subqueries]
+        return query.replace(source=Join(subqueries, query.source.join_types, query.source.on))
+    if isinstance(query.source, Subquery):
+        return query.replace(source=replace(query.source))
+    return query
+
+
+def extract_common_tables(query):
+    """Returns the query tree with the subqueries which appear more than once (eg. a QFrame joined with itself)
+    replaced with common tables, wrapped in With. If there are no such subqueries, the query is returned unchanged.
+
+    Subqueries are compared by a hash of their nodes, so they have to be structurally identical. Common tables should be
+    extracted before push_down_predicates and prune_columns, which treat them as opaque and would otherwise
+    make the occurrences differ. The nodes of the original tree are not modified.
+
+    Examples
+    --------
+    >>> data = {'select': {'fields': {'sq1.Id': {'type': 'dim', 'as': 'Id'}}, 'join': {'join_type': ['join'], 'on': ['sq1.Id=sq2.ParentId']}},
+    ...         'sq1': {'select': {'fields': {'Id': {'type': 'dim'}, 'ParentId': {'type': 'dim'}}, 'table': 'table'}},
+    ...         'sq2': {'select': {'fields': {'Id': {'type': 'dim'}, 'ParentId': {'type': 'dim'}}, 'table': 'table'}}}
+    >>> extract_common_tables(from_dict(data)).to_sql()
+    'WITH cte1 AS (SELECT Id, ParentId FROM table) SELECT sq1.Id AS Id FROM cte1 sq1 JOIN cte1 sq2 ON sq1.Id=sq2.ParentId'
+    """
+    fingerprints = {}
+    _fingerprint(query, fingerprints)
+    counts = {}
+    _count_subqueries(query, fingerprints, counts)
+    if all(count < 2 for count in counts.values()):
+        return query
+    tables = {}
+    query = _replace_common(query, fingerprints, counts, tables)
+    return With(list(tables.values()), query)
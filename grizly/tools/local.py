@@ -0,0 +1,742 @@
+"""Local execution of the query tree (see grizly.tools.ir) over Arrow tables, DataFrames and Parquet files.
+
+SQL expressions used in QFrame fields, where, having and join conditions are parsed into small syntax trees
+and evaluated with pyarrow.compute kernels, column by column. Only a subset of SQL is supported: column
+references, literals, arithmetic, comparisons, AND/OR/NOT, IS NULL, IN, BETWEEN, LIKE, CASE, CAST, EXTRACT,
+common scalar functions and the aggregations SUM, COUNT, MIN, MAX and AVG. Anything else raises
+NotImplementedError.
+"""
+import functools
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from . import ir
+
+
+def execute(query, tables):
+    """Executes the query tree over local data.
+
+    Parameters
+    ----------
+    query : ir.Select or ir.Union
+        Query tree, eg. from ir.from_dict(QFrame.data)
+    tables : dict
+        Data of the tables used in the query, keys are table names (with or without schema) and values are
+        pyarrow.Table, pandas.DataFrame or paths to Parquet files
+
+    Examples
+    --------
+    >>> data = {'select': {'fields': {'Customer': {'type': 'dim', 'group_by': 'group', 'order_by': 'ASC'},
+    ...                               'Value': {'type': 'num', 'group_by': 'sum'}},
+    ...                    'table': 'orders', 'where': "Value > 1"}}
+    >>> df = pd.DataFrame({"Customer": ["A", "A", "B"], "Value": [1, 2, 3]})
+    >>> execute(ir.from_dict(data), {"orders": df}).to_pydict()
+    {'Customer': ['A', 'B'], 'Value': [2, 3]}
+
+    Returns
+    -------
+    pyarrow.Table
+        Table with columns named by the aliases of the fields
+    """
+    return _execute(query, tables).table
+
+
+class _Relation:
+    """Table with the names which can be used to reference its columns (lower case, eg. 'sq1.id' and 'id').
+
+    Columns of a grouped table which hold group expressions and aggregates are found by their syntax trees (known).
+    """
+
+    __slots__ = ("table", "names", "known")
+
+    def __init__(self, table, names, known=None):
+        self.table = table
+        self.names = names
+        self.known = known or {}
+
+    @classmethod
+    def from_table(cls, table, alias=None):
+        names = {}
+        for column in table.column_names:
+            names.setdefault(column.lower(), column)
+            if alias:
+                names[f"{alias}.{column}".lower()] = column
+        return cls(table, names)
+
+    def column(self, name):
+        try:
+            return self.table.column(self.names[name])
+        except KeyError:
+            raise ValueError(f"Column {name} not found.")
+
+
+def _execute(query, tables):
+    if isinstance(query, (ir.With, ir.CommonTable)):
+        return _execute(query.query, tables)
+    if isinstance(query, ir.Union):
+        return _execute_union(query, tables)
+    relation = _get_source(query, tables)
+    if query.where:
+        mask = _Evaluator(relation).evaluate(_parse(query.where))
+        relation = _Relation(relation.table.filter(mask), relation.names, relation.known)
+
+    fields = [field for field in query.fields if field.selected]
+    group_fields = [field for field in query.fields if field.group_by.upper() == "GROUP"]
+    expressions = {field.alias: _parse(field.sql_expression) for field in fields}
+    having = _parse(query.having) if query.having else None
+    aggregates = _get_aggregates(list(expressions.values()) + [having])
+    if group_fields or aggregates:
+        relation = _group(relation, group_fields, aggregates)
+        if having is not None:
+            mask = _Evaluator(relation).evaluate(having)
+            relation = _Relation(relation.table.filter(mask), relation.names, relation.known)
+
+    evaluator = _Evaluator(relation)
+    num_rows = relation.table.num_rows
+    columns = [_to_array(evaluator.evaluate(expression), num_rows) for expression in expressions.values()]
+    table = pa.table(columns, names=list(expressions))
+    if query.distinct:
+        table = _distinct(table)
+    return _Relation.from_table(_sort_and_slice(table, query))
+
+
+def _execute_union(query, tables):
+    branches = [_execute(branch, tables).table for branch in query.queries]
+    names = [field.name for field in query.fields if field.selected]
+    schema = None
+    results = []
+    for branch in branches:
+        if branch.num_columns != len(names):
+            raise ValueError("Union branches have different number of columns.")
+        branch = branch.rename_columns(names)
+        if schema is None:
+            schema = branch.schema
+        results.append(branch.cast(schema))
+    table = pa.concat_tables(results)
+    for union_type in query.union_types:
+        if union_type.upper() != "UNION ALL":
+            table = _distinct(table)
+            break
+
+    relation = _Relation.from_table(table)
+    evaluator = _Evaluator(relation)
+    fields = [field for field in query.fields if field.selected]
+    columns = [_to_array(evaluator.evaluate(_parse(field.sql_expression)), table.num_rows) for field in fields]
+    table = pa.table(columns, names=[field.alias for field in fields])
+    return _Relation.from_table(_sort_and_slice(table, query))
+
+
+def _get_source(query, tables):
+    if query.table:
+        return _Relation.from_table(_read_table(query, tables), alias=query.table)
+    if isinstance(query.source, ir.Join):
+        return _join(query.source, tables)
+    if isinstance(query.source, ir.Subquery):
+        return _Relation.from_table(_execute(query.source.query, tables).table, alias=query.source.alias)
+    raise ValueError("Query has no source.")
+
+
+def _read_table(query, tables):
+    names = [f"{query.schema}.{query.table}", query.table] if query.schema else [query.table]
+    lower_tables = {name.lower(): value for name, value in tables.items()}
+    for name in names:
+        data = tables.get(name, lower_tables.get(name.lower()))
+        if data is not None:
+            break
+    else:
+        raise ValueError(f"Table {names[0]} not found in tables.")
+
+    # only the columns used by the query are read from Parquet files
+    used = ir._get_referenced_names(
+        [query.where, query.having] + [field.sql_expression for field in query.fields if field.selected]
+        + [field.name for field in query.fields if field.group_by.upper() == "GROUP"]
+    )
+    if isinstance(data, str):
+        columns = [name for name in pq.read_schema(data).names if name.lower() in used]
+        return pq.read_table(data, columns=columns)
+    if isinstance(data, pd.DataFrame):
+        data = pa.Table.from_pandas(data, preserve_index=False)
+    return data.select([name for name in data.column_names if name.lower() in used])
+
+
+_JOIN_TYPES = {
+    "join": "inner",
+    "inner join": "inner",
+    "left join": "left outer",
+    "left outer join": "left outer",
+    "right join": "right outer",
+    "right outer join": "right outer",
+    "full join": "full outer",
+    "full outer join": "full outer",
+}
+
+
+def _join(join, tables):
+    def qualified(subquery):
+        table = _execute(subquery.query, tables).table
+        return table.rename_columns([f"{subquery.alias}.{column}" for column in table.column_names])
+
+    first, *others = join.subqueries
+    table = qualified(first)
+    for subquery, join_type, on in zip(others, join.join_types, join.on):
+        right = qualified(subquery)
+        join_type = " ".join(join_type.lower().split())
+        if join_type == "cross join" or on in {0, "0"}:
+            table = _cross_join(table, right)
+            continue
+        if join_type not in _JOIN_TYPES:
+            raise NotImplementedError(f"{join_type.upper()} is not supported by the local engine.")
+        join_type = _JOIN_TYPES[join_type]
+
+        left_names = set(table.column_names)
+        right_names = set(right.column_names)
+        keys, right_keys, residual = [], [], []
+        for conjunct in ir._split_conjuncts(on):
+            node = _parse(conjunct)
+            if node[0] == "binary" and node[1] == "=" and node[2][0] == node[3][0] == "column":
+                left_column, right_column = _find_column(node[2][1], table), _find_column(node[3][1], right)
+                if left_column is None:
+                    left_column, right_column = _find_column(node[3][1], table), _find_column(node[2][1], right)
+                if left_column is not None and right_column is not None:
+                    keys.append(left_column)
+                    right_keys.append(right_column)
+                    continue
+            residual.append(node)
+        if residual and join_type != "inner":
+            raise NotImplementedError(
+                "Outer join conditions other than equality are not supported by the local engine."
+            )
+
+        if keys:
+            for key, right_key in zip(keys, right_keys):
+                key_type = table.schema.field(key).type
+                if right.schema.field(right_key).type != key_type:
+                    index = right.column_names.index(right_key)
+                    right = right.set_column(index, right_key, right.column(right_key).cast(key_type))
+            table = table.join(right, keys=keys, right_keys=right_keys, join_type=join_type, coalesce_keys=False)
+            table = table.select(
+                [name for name in table.column_names if name in left_names]
+                + [name for name in table.column_names if name in right_names]
+            )
+        else:
+            table = _cross_join(table, right)
+        for node in residual:
+            table = table.filter(_Evaluator(_get_join_relation(table)).evaluate(node))
+    return _get_join_relation(table)
+
+
+def _get_join_relation(table):
+    names = {column.lower(): column for column in table.column_names}
+    # unqualified names can be used if they are not ambiguous
+    unqualified = {}
+    for column in table.column_names:
+        unqualified.setdefault(column.split(".", 1)[1].lower(), []).append(column)
+    for name, columns in unqualified.items():
+        if len(columns) == 1:
+            names.setdefault(name, columns[0])
+    return _Relation(table, names)
+
+
+def _find_column(name, table):
+    for column in table.column_names:
+        if column.lower() == name:
+            return column
+    return None
+
+
+def _cross_join(left, right):
+    left_indices = np.repeat(np.arange(left.num_rows), right.num_rows)
+    right_indices = np.tile(np.arange(right.num_rows), left.num_rows)
+    left, right = left.take(left_indices), right.take(right_indices)
+    return pa.table(left.columns + right.columns, names=left.column_names + right.column_names)
+
+
+_AGGREGATIONS = {"SUM": "sum", "COUNT": "count", "MIN": "min", "MAX": "max", "AVG": "mean"}
+
+
+def _get_aggregates(nodes):
+    """Returns aggregation calls used in the nodes, in order of appearance."""
+    aggregates = []
+
+    def visit(node):
+        if not isinstance(node, tuple):
+            return
+        if node and node[0] == "call" and node[1] in _AGGREGATIONS:
+            if node not in aggregates:
+                aggregates.append(node)
+            return
+        for child in node:
+            visit(child)
+
+    for node in nodes:
+        visit(node)
+    return aggregates
+
+
+def _group(relation, group_fields, aggregates):
+    """Groups the relation by the expressions of group_fields and computes the aggregates. Group columns
+    can be referenced by the aliases and names of group_fields."""
+    evaluator = _Evaluator(relation)
+    num_rows = relation.table.num_rows
+    columns, names, known = [], [], {}
+    for i, field in enumerate(group_fields):
+        column = f"__key{i}"
+        columns.append(_to_array(evaluator.evaluate(_parse(field.expression)), num_rows))
+        names.append(column)
+        known[_parse(field.expression)] = column
+    aggregations = []
+    for i, (_, function, args, distinct) in enumerate(aggregates):
+        column = f"__arg{i}"
+        if args == (("star",),):
+            values = pa.array(np.ones(num_rows, dtype="int8"))
+        elif len(args) == 1:
+            values = _to_array(evaluator.evaluate(args[0]), num_rows)
+        else:
+            raise ValueError(f"{function} takes one argument.")
+        columns.append(values)
+        names.append(column)
+        aggregation = "count_distinct" if distinct and function == "COUNT" else _AGGREGATIONS[function]
+        aggregations.append((column, aggregation))
+    table = pa.table(columns, names=names) if columns else pa.table({"__row": pa.nulls(num_rows)})
+
+    keys = [f"__key{i}" for i in range(len(group_fields))]
+    grouped = table.group_by(keys).aggregate(aggregations)
+    for i, aggregate in enumerate(aggregates):
+        known[aggregate] = f"__arg{i}_{aggregations[i][1]}"
+
+    names = {}
+    for field, key in zip(group_fields, keys):
+        for name in (field.alias, field.name, field.name.split(".")[-1]):
+            names.setdefault(name.lower(), key)
+    return _Relation(grouped, names, known)
+
+
+def _distinct(table):
+    return table.group_by(table.column_names).aggregate([])
+
+
+def _sort_and_slice(table, query):
+    sort_keys = []
+    for field in query.fields:
+        if field.selected and field.order_by:
+            order = "descending" if field.order_by.upper() == "DESC" else "ascending"
+            sort_keys.append((field.alias, order))
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+    offset = int(query.offset) if query.offset != "" else 0
+    if query.limit != "":
+        return table.slice(offset, int(query.limit))
+    return table.slice(offset)
+
+
+def _to_array(value, num_rows):
+    if isinstance(value, pa.Scalar):
+        return pa.array([value.as_py()] * num_rows, type=value.type if value.is_valid else pa.null())
+    if isinstance(value, pa.ChunkedArray):
+        return value.combine_chunks()
+    return value
+
+
+_CAST_TYPES = {
+    "SMALLINT": pa.int16(),
+    "INT": pa.int32(),
+    "INTEGER": pa.int32(),
+    "BIGINT": pa.int64(),
+    "FLOAT": pa.float64(),
+    "DOUBLE": pa.float64(),
+    "REAL": pa.float32(),
+    "NUMERIC": pa.float64(),
+    "DECIMAL": pa.float64(),
+    "VARCHAR": pa.string(),
+    "CHAR": pa.string(),
+    "TEXT": pa.string(),
+    "DATE": pa.date32(),
+    "TIMESTAMP": pa.timestamp("us"),
+    "DATETIME": pa.timestamp("us"),
+    "BOOLEAN": pa.bool_(),
+    "BOOL": pa.bool_(),
+}
+
+_DATE_PARTS = {
+    "YEAR": pc.year,
+    "QUARTER": pc.quarter,
+    "MONTH": pc.month,
+    "DAY": pc.day,
+    "HOUR": pc.hour,
+    "MINUTE": pc.minute,
+    "SECOND": pc.second,
+    "DOW": pc.day_of_week,
+    "DOY": pc.day_of_year,
+}
+
+_COMPARISONS = {
+    "=": pc.equal,
+    "<>": pc.not_equal,
+    "!=": pc.not_equal,
+    "<": pc.less,
+    "<=": pc.less_equal,
+    ">": pc.greater,
+    ">=": pc.greater_equal,
+}
+
+
+class _Evaluator:
+    """Evaluates syntax trees returned by _parse over the columns of a relation."""
+
+    def __init__(self, relation):
+        self.relation = relation
+
+    def evaluate(self, node):
+        if node in self.relation.known:
+            return self.relation.table.column(self.relation.known[node])
+        return getattr(self, "_" + node[0])(*node[1:])
+
+    def _literal(self, value):
+        return pa.scalar(value)
+
+    def _column(self, name):
+        return self.relation.column(name)
+
+    def _star(self):
+        raise NotImplementedError("* can be used only in COUNT(*) by the local engine.")
+
+    def _unary(self, op, operand):
+        value = self.evaluate(operand)
+        if op == "NOT":
+            return pc.invert(value)
+        return pc.negate(value)
+
+    def _binary(self, op, left, right):
+        if op == "AND":
+            return pc.and_kleene(self.evaluate(left), self.evaluate(right))
+        if op == "OR":
+            return pc.or_kleene(self.evaluate(left), self.evaluate(right))
+        left, right = self.evaluate(left), self.evaluate(right)
+        if op in _COMPARISONS:
+            return _COMPARISONS[op](left, right)
+        if op == "+":
+            return pc.add(left, right)
+        if op == "-":
+            return pc.subtract(left, right)
+        if op == "*":
+            return pc.multiply(left, right)
+        if op == "/":
+            return pc.divide(left, right)
+        if op == "%":
+            quotient = pc.divide(left, right)
+            if pa.types.is_floating(quotient.type):
+                quotient = pc.trunc(quotient)
+            return pc.subtract(left, pc.multiply(quotient, right))
+        if op == "||":
+            return pc.binary_join_element_wise(pc.cast(left, pa.string()), pc.cast(right, pa.string()), "")
+        raise NotImplementedError(f"Operator {op} is not supported by the local engine.")
+
+    def _is_null(self, operand, negated):
+        value = self.evaluate(operand)
+        return pc.is_valid(value) if negated else pc.is_null(value)
+
+    def _in(self, operand, values, negated):
+        value_set = pa.array([self.evaluate(value).as_py() for value in values])
+        result = pc.is_in(self.evaluate(operand), value_set=value_set)
+        return pc.invert(result) if negated else result
+
+    def _between(self, operand, low, high, negated):
+        value = self.evaluate(operand)
+        result = pc.and_kleene(pc.greater_equal(value, self.evaluate(low)), pc.less_equal(value, self.evaluate(high)))
+        return pc.invert(result) if negated else result
+
+    def _like(self, operand, pattern, negated, ignore_case):
+        pattern = self.evaluate(pattern)
+        if not isinstance(pattern, pa.Scalar):
+            raise NotImplementedError("LIKE pattern has to be a literal in the local engine.")
+        result = pc.match_like(self.evaluate(operand), pattern.as_py(), ignore_case=ignore_case)
+        return pc.invert(result) if negated else result
+
+    def _case(self, whens, default):
+        result = self.evaluate(default) if default is not None else pa.scalar(None)
+        for condition, value in reversed(whens):
+            value = self.evaluate(value)
+            if isinstance(result, pa.Scalar) and not result.is_valid:
+                result = pa.scalar(None, type=value.type)
+            result = pc.if_else(pc.fill_null(self.evaluate(condition), False), value, result)
+        return result
+
+    def _cast(self, operand, type_name):
+        base_type = type_name.split("(")[0].strip().upper()
+        if base_type not in _CAST_TYPES:
+            raise NotImplementedError(f"CAST to {type_name} is not supported by the local engine.")
+        return pc.cast(self.evaluate(operand), _CAST_TYPES[base_type])
+
+    def _extract(self, part, operand):
+        if part not in _DATE_PARTS:
+            raise NotImplementedError(f"EXTRACT({part}) is not supported by the local engine.")
+        value = self.evaluate(operand)
+        if pa.types.is_string(value.type) or pa.types.is_large_string(value.type):
+            value = pc.cast(value, pa.timestamp("us"))
+        return _DATE_PARTS[part](value)
+
+    def _call(self, function, args, distinct):
+        if function in _AGGREGATIONS:
+            raise ValueError(f"Aggregation {function} is not allowed here.")
+        values = [self.evaluate(arg) for arg in args]
+        if function in ("UPPER", "UCASE"):
+            return pc.utf8_upper(*values)
+        if function in ("LOWER", "LCASE"):
+            return pc.utf8_lower(*values)
+        if function == "TRIM":
+            return pc.utf8_trim_whitespace(*values)
+        if function in ("LENGTH", "LEN", "CHAR_LENGTH"):
+            return pc.utf8_length(*values)
+        if function == "ABS":
+            return pc.abs(*values)
+        if function == "ROUND":
+            ndigits = values[1].as_py() if len(values) > 1 else 0
+            return pc.round(values[0], ndigits=ndigits)
+        if function in ("FLOOR", "CEIL", "CEILING"):
+            return pc.floor(values[0]) if function == "FLOOR" else pc.ceil(values[0])
+        if function == "COALESCE":
+            return pc.coalesce(*values)
+        if function == "NULLIF":
+            equal = pc.fill_null(pc.equal(values[0], values[1]), False)
+            return pc.if_else(equal, pa.scalar(None, values[0].type), values[0])
+        if function in ("SUBSTRING", "SUBSTR"):
+            start = values[1].as_py() - 1
+            stop = start + values[2].as_py() if len(values) > 2 else None
+            return pc.utf8_slice_codeunits(values[0], start, stop)
+        if function == "CONCAT":
+            return pc.binary_join_element_wise(*[pc.cast(value, pa.string()) for value in values], "")
+        raise NotImplementedError(f"Function {function} is not supported by the local engine.")
+
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*")
+    |(?P<name>[A-Za-z_][\w$]*)
+    |(?P<op><>|!=|<=|>=|\|\||[-+*/%=<>(),.])
+    )""",
+    re.VERBOSE,
+)
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match:
+            raise NotImplementedError(f"Can't parse '{text[position:]}' in the local engine.")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        elif kind == "quoted":
+            kind, value = "name", value[1:-1].replace('""', '"')
+        elif kind == "name":
+            kind = "keyword" if value.upper() in _KEYWORDS else "name"
+            value = value.upper() if kind == "keyword" else value
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+_KEYWORDS = {
+    "AND", "OR", "NOT", "IS", "NULL", "IN", "BETWEEN", "LIKE", "ILIKE", "CASE", "WHEN", "THEN", "ELSE", "END",
+    "CAST", "AS", "EXTRACT", "FROM", "TRUE", "FALSE", "DISTINCT",
+}
+
+
+def _parse(text):
+    """Parses SQL expression into a syntax tree made of tuples,
+    eg. ('binary', '>', ('column', 'value'), ('literal', 0)) for 'Value > 0'."""
+    return _parse_text(str(text))
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_text(text):
+    """Parsed expressions are cached, the same expressions are evaluated for every batch of rows."""
+    return _Parser(_tokenize(text)).parse()
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def parse(self):
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise NotImplementedError(f"Can't parse '{self.peek()[1]}' in the local engine.")
+        return node
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def accept(self, *values):
+        kind, value = self.peek()
+        if kind in ("keyword", "op") and value in values:
+            self.position += 1
+            return value
+        return None
+
+    def expect(self, value):
+        if not self.accept(value):
+            raise NotImplementedError(f"Expected {value}, got '{self.peek()[1]}' in the local engine.")
+
+    def expression(self):
+        node = self.conjunction()
+        while self.accept("OR"):
+            node = ("binary", "OR", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept("AND"):
+            node = ("binary", "AND", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept("NOT"):
+            return ("unary", "NOT", self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        node = self.additive()
+        op = self.accept(*_COMPARISONS)
+        if op:
+            return ("binary", op, node, self.additive())
+        if self.accept("IS"):
+            negated = bool(self.accept("NOT"))
+            self.expect("NULL")
+            return ("is_null", node, negated)
+        negated = bool(self.accept("NOT"))
+        if self.accept("IN"):
+            self.expect("(")
+            values = [self.additive()]
+            while self.accept(","):
+                values.append(self.additive())
+            self.expect(")")
+            return ("in", node, tuple(values), negated)
+        if self.accept("BETWEEN"):
+            low = self.additive()
+            self.expect("AND")
+            return ("between", node, low, self.additive(), negated)
+        like = self.accept("LIKE", "ILIKE")
+        if like:
+            return ("like", node, self.additive(), negated, like == "ILIKE")
+        if negated:
+            raise NotImplementedError("Expected IN, BETWEEN or LIKE after NOT in the local engine.")
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        while True:
+            op = self.accept("+", "-", "||")
+            if not op:
+                return node
+            node = ("binary", op, node, self.multiplicative())
+
+    def multiplicative(self):
+        node = self.unary()
+        while True:
+            op = self.accept("*", "/", "%")
+            if not op:
+                return node
+            node = ("binary", op, node, self.unary())
+
+    def unary(self):
+        if self.accept("-"):
+            return ("unary", "-", self.unary())
+        self.accept("+")
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.peek()
+        if kind == "number":
+            self.position += 1
+            return ("literal", float(value) if any(char in value for char in ".eE") else int(value))
+        if kind == "string":
+            self.position += 1
+            return ("literal", value)
+        if self.accept("NULL"):
+            return ("literal", None)
+        if self.accept("TRUE"):
+            return ("literal", True)
+        if self.accept("FALSE"):
+            return ("literal", False)
+        if self.accept("("):
+            node = self.expression()
+            self.expect(")")
+            return node
+        if self.accept("*"):
+            return ("star",)
+        if self.accept("CASE"):
+            return self.case()
+        if self.accept("CAST"):
+            self.expect("(")
+            operand = self.expression()
+            self.expect("AS")
+            type_name = self.type_name()
+            self.expect(")")
+            return ("cast", operand, type_name)
+        if self.accept("EXTRACT"):
+            self.expect("(")
+            part = self.peek()[1].upper()
+            self.position += 1
+            self.expect("FROM")
+            operand = self.expression()
+            self.expect(")")
+            return ("extract", part, operand)
+        if kind == "name":
+            self.position += 1
+            if self.accept("("):
+                distinct = bool(self.accept("DISTINCT"))
+                args = []
+                if not self.accept(")"):
+                    args.append(self.expression())
+                    while self.accept(","):
+                        args.append(self.expression())
+                    self.expect(")")
+                return ("call", value.upper(), tuple(args), distinct)
+            name = value
+            while self.accept("."):
+                name += "." + self.tokens[self.position][1]
+                self.position += 1
+            return ("column", name.lower())
+        raise NotImplementedError(f"Can't parse '{value}' in the local engine.")
+
+    def case(self):
+        operand = None
+        if self.peek()[1] != "WHEN":
+            operand = self.expression()
+        whens = []
+        while self.accept("WHEN"):
+            condition = self.expression()
+            if operand is not None:
+                condition = ("binary", "=", operand, condition)
+            self.expect("THEN")
+            whens.append((condition, self.expression()))
+        default = self.expression() if self.accept("ELSE") else None
+        self.expect("END")
+        return ("case", tuple(whens), default)
+
+    def type_name(self):
+        parts = []
+        depth = 0
+        while self.position < len(self.tokens):
+            kind, value = self.peek()
+            if value == ")" and depth == 0:
+                break
+            depth += {"(": 1, ")": -1}.get(value, 0)
+            parts.append(str(value))
+            self.position += 1
+        return " ".join(parts)
@@ -0,0 +1,221 @@
+"""Process-wide registry of connection pools.
+
+Connections opened by SQLDB, to_csv(), Listener and Workflow are taken from a pool shared by every object using
+the same engine string and interface, so the ODBC handshake is paid once per connection instead of once per query.
+Closing a pooled connection returns it to the pool.
+"""
+import logging
+import threading
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# settings of the pools created after the last call of configure_pools()
+pool_settings = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "timeout": 30,
+    "max_age": 3600,
+    "pre_ping": True,
+}
+
+_pools = {}
+_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+class _Metrics:
+    """Counters of pool events."""
+
+    __slots__ = ("connects", "checkouts", "checkins", "invalidations", "_lock")
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def listen(self, pool):
+        for name in ("connect", "checkout", "checkin", "invalidate"):
+            event.listen(pool, name, self._get_counter(name))
+
+    def _get_counter(self, name):
+        attr = {"connect": "connects", "checkout": "checkouts", "checkin": "checkins"}.get(name, "invalidations")
+
+        def count(*args):
+            with self._lock:
+                setattr(self, attr, getattr(self, attr) + 1)
+
+        return count
+
+
+def configure_pools(
+    pool_size: int = None, max_overflow: int = None, timeout: int = None, max_age: int = None, pre_ping: bool = None
+):
+    """Changes the settings of connection pools. Existing pools are disposed, so the settings apply to all
+    connections opened afterwards.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Number of connections kept open in every pool, by default 5
+    max_overflow : int, optional
+        Number of connections which can be opened above pool_size when all are in use, by default 10
+    timeout : int, optional
+        Number of seconds to wait for a connection when pool_size + max_overflow connections are in use,
+        by default 30
+    max_age : int, optional
+        Number of seconds after which a connection is closed and replaced with a new one, by default 3600
+    pre_ping : bool, optional
+        Whether connections are tested with a simple query before they're taken from the pool, by default True
+
+    Examples
+    --------
+    >>> configure_pools(pool_size=2, max_overflow=0)
+    >>> pool_settings["pool_size"], pool_settings["max_overflow"]
+    (2, 0)
+    >>> configure_pools(pool_size=5, max_overflow=10)
+    """
+    settings = dict(pool_size=pool_size, max_overflow=max_overflow, timeout=timeout, max_age=max_age, pre_ping=pre_ping)
+    pool_settings.update({key: value for key, value in settings.items() if value is not None})
+    dispose_pools()
+
+
+def get_pool(engine_str: str, interface: str = "sqlalchemy"):
+    """Returns the pool of connections with engine_str and interface, creating it on the first call.
+
+    Examples
+    --------
+    >>> pool = get_pool("sqlite://")
+    >>> con = pool.connect()
+    >>> con.cursor().execute("SELECT 1").fetchall()
+    [(1,)]
+    >>> con.close()
+    >>> get_pool("sqlite://") is pool
+    True
+    >>> dispose_pools()
+    """
+    key = (engine_str, interface)
+    pool = _pools.get(key)
+    if pool is None:
+        with _lock:
+            if key not in _pools:
+                _pools[key] = _create_pool(engine_str, interface)
+            pool = _pools[key]
+    return pool[0]
+
+
+def get_pool_metrics():
+    """Returns the state and the event counters of every pool.
+
+    Returns
+    -------
+    list
+        List of dicts with keys: engine (with hidden password), interface, size, checked_in, checked_out, overflow,
+        connects, checkouts, checkins and invalidations
+    """
+    metrics = []
+    for (engine_str, interface), (pool, counters) in list(_pools.items()):
+        metrics.append(
+            {
+                "engine": _hide_password(engine_str),
+                "interface": interface,
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "connects": counters.connects,
+                "checkouts": counters.checkouts,
+                "checkins": counters.checkins,
+                "invalidations": counters.invalidations,
+            }
+        )
+    return metrics
+
+
+def dispose_pools():
+    """Closes the connections of all pools and removes them from the registry. Connections which are in use are
+    closed when they're returned."""
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool, _ in pools:
+        pool.dispose()
+
+
+def _create_pool(engine_str, interface):
+    settings = dict(pool_settings)
+    recycle = settings["max_age"] if settings["max_age"] is not None else -1
+    if interface == "sqlalchemy":
+        # connections of a pool are used by many threads, eg. by workers of QFrame.to_df
+        connect_args = {"check_same_thread": False} if engine_str.startswith("sqlite") else {}
+        engine = create_engine(
+            engine_str,
+            encoding="utf8",
+            poolclass=QueuePool,
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            pool_timeout=settings["timeout"],
+            pool_recycle=recycle,
+            pool_pre_ping=settings["pre_ping"],
+            connect_args=connect_args,
+        )
+        pool = engine.pool
+    else:
+        pool = QueuePool(
+            _get_creator(engine_str, interface),
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            timeout=settings["timeout"],
+            recycle=recycle,
+        )
+        if settings["pre_ping"]:
+            event.listen(pool, "checkout", _ping)
+    counters = _Metrics()
+    counters.listen(pool)
+    logger.debug(f"Created connection pool for {_hide_password(engine_str)} ({interface}).")
+    return pool, counters
+
+
+def _get_creator(engine_str, interface):
+    dsn = engine_str.split("/")[-1]
+    if interface == "turbodbc":
+
+        def connect():
+            import turbodbc
+
+            return turbodbc.connect(dsn=dsn)
+
+    elif interface == "pyodbc":
+
+        def connect():
+            import pyodbc
+
+            try:
+                return pyodbc.connect(DSN=dsn)
+            except pyodbc.InterfaceError:
+                raise OSError(f"Data source name '{dsn}' not found")
+
+    else:
+        raise ValueError(f"Interface {interface} is not supported. Choose one of: 'sqlalchemy', 'turbodbc', 'pyodbc'")
+    return connect
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    """Tests the connection before it's taken from the pool, raising DisconnectionError makes the pool replace it."""
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+    except Exception:
+        raise exc.DisconnectionError()
+
+
+def _hide_password(engine_str):
+    try:
+        return repr(make_url(engine_str))
+    except exc.ArgumentError:
+        return engine_str
@@ -7,19 +7,32 @@ from copy import deepcopy
 import json
 import logging
 import pyarrow as pa
+import pyarrow.compute as pc
 import math
+import numbers
+import queue
+import hashlib
+import itertools
 
 from .s3 import S3
 from .sqldb import SQLDB, check_if_valid_type
 from ..ui.qframe import SubqueryUI, FieldUI
 from ..utils import get_path
 from .extract import Extract
+from .cache import ResultCache
+from .pool import pool_settings
+from . import ir
+from . import local
 
 import deprecation
-from functools import partial
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 
 deprecation.deprecated = partial(deprecation.deprecated, deprecated_in="0.3", removed_in="0.4")
 
+logger = logging.getLogger(__name__)
+
 
 def prepend_table(data, expression):
     field_regex = r"\w+[a-z]"
@@ -36,6 +49,54 @@ def prepend_table(data, expression):
     return expression
 
 
+def _modifies_data(f):
+    """Prepares QFrame.data["select"] to be modified by the decorated method.
+
+    Drops the compiled SQL cache and, if the data is shared with a copy or a joined/unioned QFrame,
+    detaches the top level of the data first so the other QFrames are not affected."""
+
+    @wraps(f)
+    def wrapped(self, *args, **kwargs):
+        self._sql_cache = {}
+        if self._shared:
+            self._unshare()
+        return f(self, *args, **kwargs)
+
+    return wrapped
+
+
+def _incremental(f):
+    """Runs the decorated output method only on the rows of QFrame above the high-water mark saved by the previous
+    run (see QFrame.incremental) and saves the new high-water mark when the output has been written."""
+
+    @wraps(f)
+    def wrapped(self, *args, **kwargs):
+        if not self.watermark:
+            return f(self, *args, **kwargs)
+        qf, high_water_mark = self._get_increment()
+        result = f(qf, *args, **kwargs)
+        if high_water_mark is not None:
+            self._save_high_water_mark(high_water_mark)
+        return self if result is qf else result
+
+    return wrapped
+
+
+def _modifies_fields(f):
+    """Same as _modifies_data, for methods which also modify QFrame.data["select"]["fields"]"""
+
+    @wraps(f)
+    def wrapped(self, *args, **kwargs):
+        self._sql_cache = {}
+        if self._shared:
+            self._unshare()
+        if self._shared_fields:
+            self._unshare_fields()
+        return f(self, *args, **kwargs)
+
+    return wrapped
+
+
 class QFrame(Extract):
     """Class which genearates a SQL statement.
 
@@ -51,11 +112,50 @@ class QFrame(Extract):
         * DenodoPROD: "mssql+pyodbc://DenodoPROD",
         * Redshift: "mssql+pyodbc://redshift_acoe",
         * MariaDB: "mssql+pyodbc://retool_dev_db"
+
+    cache : ResultCache, optional
+        Cache of the results of to_df(), to_arrow() and to_parquet(), by default None (results are not cached)
+    hints : dict, optional
+        Execution hints, see set_hints(), by default None
+    cte : {'with', 'temp', None}, optional
+        How subqueries which appear several times in the query (eg. QFrame joined with itself) are generated,
+        by default None
+
+        * 'with': defined once in the WITH clause
+        * 'temp': materialized as temporary tables created on the connection of the query (of every worker with
+          workers) and dropped after it, for engines which evaluate WITH clause every time it's referenced.
+          Auxiliary queries (eg. COUNT(*) of cut()) and the INSERT of to_table() use the WITH clause
+        * None: repeated in the query
     """
 
+    # hints used by every QFrame with the engine of given dialect ('denodo', 'redshift'), see set_hints()
+    default_hints = {
+        "denodo": {
+            "swap": "ON",
+            "swapsize": "400",
+            "swapblocksize": "1000",
+            "maxresultsize": "100",
+            "i18n": "us_est",
+            "queryTimeout": "9000000000",
+            "simplify": "off",
+        },
+        "redshift": {},
+    }
+
     # KM: can we delete sql argument?
     def __init__(
-        self, data={}, engine: str = None, sql=None, getfields=[], chunksize=None, interface: str = None, logger=None
+        self,
+        data={},
+        engine: str = None,
+        sql=None,
+        getfields=[],
+        chunksize=None,
+        interface: str = None,
+        logger=None,
+        pushdown: bool = True,
+        cache: ResultCache = None,
+        hints: dict = None,
+        cte: str = None,
     ):
         self.tool_name = "QFrame"
         self.engine = engine if engine else "mssql+pyodbc://DenodoODBC"
@@ -69,6 +169,16 @@ class QFrame(Extract):
         self.chunksize = chunksize
         self.interface = interface or "sqlalchemy"
         self.logger = logger or logging.getLogger(__name__)
+        self.pushdown = pushdown
+        self.cache = cache
+        self.watermark = None
+        self.hints = dict(hints or {})
+        if cte not in {"with", "temp", None}:
+            raise ValueError("Parameter cte must be one of 'with', 'temp' or None.")
+        self.cte = cte
+        self._sql_cache = {}
+        self._shared = False
+        self._shared_fields = False
         super().__init__()
 
     def create_sql_blocks(self):
@@ -80,6 +190,51 @@ class QFrame(Extract):
             self.data["select"]["sql_blocks"] = _build_column_strings(self.data)
             return self
 
+    def _compile(self):
+        """Returns the query tree, SQL and sql_blocks of QFrame.data.
+
+        The result is cached under a fingerprint of QFrame.data, so the query tree is built only once
+        for every version of the data."""
+        fingerprint = _fingerprint(self.data) + ("" if self.pushdown else "-no-pushdown") + f"-cte-{self.cte}"
+        if self._sql_cache.get("fingerprint") != fingerprint:
+            query = _optimize(ir.from_dict(self.data), pushdown=self.pushdown, cte=self.cte)
+            temp_tables = []
+            drop_temp_tables = []
+            standalone_sql = sql = query.to_sql()
+            if self.cte == "temp" and isinstance(query, ir.With):
+                temp_tables = [
+                    f"CREATE TEMPORARY TABLE {table.name} AS {table.query.to_sql()}" for table in query.tables
+                ]
+                drop_temp_tables = [f"DROP TABLE {table.name}" for table in reversed(query.tables)]
+                sql = query.query.to_sql()
+            self._sql_cache = {
+                "fingerprint": fingerprint,
+                "query": query,
+                "sql": sql,
+                "standalone_sql": standalone_sql,
+                "sql_blocks": query.sql_blocks(),
+                "temp_tables": temp_tables,
+                "drop_temp_tables": drop_temp_tables,
+            }
+        return self._sql_cache
+
+    def _share(self):
+        """Marks QFrame.data as used by another QFrame, so it's copied before it's modified.
+
+        Only the parts which QFrame methods modify in place are copied - QFrame.data, QFrame.data["select"]
+        and the fields. Subqueries (sq, sq1, sq2, ...) are never modified in place, so they stay shared."""
+        self._shared = True
+        self._shared_fields = True
+
+    def _unshare(self):
+        self.data = {**self.data, "select": dict(self.data["select"])}
+        self._shared = False
+
+    def _unshare_fields(self):
+        fields = self.data["select"]["fields"]
+        self.data["select"]["fields"] = {field: dict(attrs) for field, attrs in fields.items()}
+        self._shared_fields = False
+
     def validate_data(self, data):
         """Validates loaded data.
 
@@ -145,6 +300,7 @@ class QFrame(Extract):
     def build_subquery(self, store_path, subquery, database):
         return SubqueryUI(store_path=store_path).build_subquery(self, subquery, database)
 
+    @_modifies_data
     def from_json(self, json_path, subquery=""):
         """Reads QFrame.data from json file.
 
@@ -168,6 +324,7 @@ class QFrame(Extract):
                     self.data = self.validate_data(data[subquery])
             else:
                 self.data = data
+        self._shared_fields = False
         for field in self.data["select"]["fields"]:
             _type = self.data["select"]["fields"][field]["type"]
             dtype = "object"
@@ -197,6 +354,7 @@ class QFrame(Extract):
         self.from_json(json_path, subquery)
         return self
 
+    @_modifies_data
     def read_dict(self, data):
         """Reads QFrame.data from dictionary.
 
@@ -219,8 +377,10 @@ class QFrame(Extract):
         QFrame
         """
         self.data = self.validate_data(deepcopy(data))
+        self._shared_fields = False
         return self
 
+    @_modifies_data
     def select(self, fields):
         """Creates a subquery that looks like "SELECT sq.col1, sq.col2 FROM (some sql) sq".
 
@@ -255,7 +415,7 @@ class QFrame(Extract):
         QFrame
         """
         self.create_sql_blocks()
-        sq_fields = deepcopy(self.data["select"]["fields"])
+        sq_fields = self.data["select"]["fields"]
         new_fields = {}
 
         if isinstance(fields, str):
@@ -286,9 +446,11 @@ class QFrame(Extract):
         if new_fields:
             data = {"select": {"fields": new_fields}, "sq": self.data}
             self.data = data
+            self._shared_fields = False
 
         return self
 
+    @_modifies_fields
     def rename(self, fields):
         """Renames columns (changes the field alias).
 
@@ -316,6 +478,7 @@ class QFrame(Extract):
                 self.data["select"]["fields"][field]["as"] = fields[field].replace(" ", "_")
         return self
 
+    @_modifies_fields
     def remove(self, fields):
         """Removes fields.
 
@@ -345,6 +508,7 @@ class QFrame(Extract):
 
         return self
 
+    @_modifies_data
     def distinct(self):
         """Adds DISTINCT statement.
 
@@ -366,6 +530,7 @@ class QFrame(Extract):
 
         return self
 
+    @_modifies_data
     def query(self, query, if_exists="append", operator="and"):
         """Adds WHERE statement.
 
@@ -407,6 +572,7 @@ class QFrame(Extract):
                 self.data["select"]["where"] += f" {operator} {query}"
         return self
 
+    @_modifies_data
     def having(self, having, if_exists="append", operator="and"):
         """Adds HAVING statement.
 
@@ -457,6 +623,7 @@ class QFrame(Extract):
                     self.data["select"]["having"] = having
         return self
 
+    @_modifies_fields
     def assign(self, type="dim", group_by="", order_by="", custom_type="", **kwargs):
         """Assigns expressions.
 
@@ -533,6 +700,7 @@ class QFrame(Extract):
                     }
         return self
 
+    @_modifies_fields
     def groupby(self, fields):
         """Adds GROUP BY statement.
 
@@ -566,6 +734,7 @@ class QFrame(Extract):
 
         return self
 
+    @_modifies_fields
     def agg(self, aggtype):
         """Aggregates fields.
 
@@ -640,6 +809,7 @@ class QFrame(Extract):
                 fields.append(field)
         return self[fields].agg("sum")
 
+    @_modifies_fields
     def orderby(self, fields, ascending=True):
         """Adds ORDER BY statement.
 
@@ -691,6 +861,7 @@ class QFrame(Extract):
 
         return self
 
+    @_modifies_data
     def limit(self, limit):
         """Adds LIMIT statement.
 
@@ -717,6 +888,7 @@ class QFrame(Extract):
 
         return self
 
+    @_modifies_data
     def offset(self, offset):
         """Adds OFFSET statement.
 
@@ -782,7 +954,72 @@ class QFrame(Extract):
             qf.limit(limit)
         return qf
 
-    def cut(self, chunksize: int, deterministic: bool = True):
+    def seek(self, keys, last_seen: list = None, limit: int = None):
+        """Creates a chunk of QFrame starting right after the row with key values last_seen (keyset pagination).
+
+        Unlike window(), the database doesn't have to read and sort the rows preceding the chunk. Rows with NULL
+        in any of the keys can't be compared with last_seen, so they're not selected by any chunk, they're
+        retrieved by the chunk from _seek_nulls() (cut(), to_df(), to_csv() and to_parquet() with keys add it).
+
+        Parameters
+        ----------
+        keys : list or str
+            Aliases of the columns which uniquely identify and sort the rows. The rows are sorted by the keys
+            in the order of the columns in the QFrame
+        last_seen : list, optional
+            Values of the keys in the last row of the previous chunk, by default None (first chunk)
+        limit : int, optional
+            Number of rows to select, by default None
+
+        Examples
+        --------
+        >>> data = {'select': {'fields': {'CustomerId': {'type': 'dim'}, 'Sales': {'type': 'num'}}, 'schema': 'schema', 'table': 'table'}}
+        >>> qf = QFrame().read_dict(data)
+        >>> qf = qf.seek("CustomerId", last_seen=["C100"], limit=10)
+        >>> print(qf)
+        SELECT sq.CustomerId AS CustomerId,
+               sq.Sales AS Sales
+        FROM
+          (SELECT CustomerId,
+                  Sales
+           FROM schema.table
+           WHERE CustomerId IS NOT NULL
+             AND CustomerId > 'C100') sq
+        ORDER BY CustomerId
+        LIMIT 10
+
+        Returns
+        -------
+        QFrame
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        sorted_keys = self._get_keys(keys)
+
+        qf = self.copy().select("*")
+        conditions = [f"sq.{key} IS NOT NULL" for key in keys]
+        if last_seen is not None:
+            if len(last_seen) != len(keys):
+                raise ValueError("Number of values in last_seen does not match the number of keys.")
+            last_seen = [last_seen[keys.index(key)] for key in sorted_keys]
+            conditions.append(_keyset_condition([f"sq.{key}" for key in sorted_keys], last_seen))
+        qf.query(" AND ".join(conditions))
+        qf.orderby([f"sq.{key}" for key in sorted_keys])
+        if limit:
+            qf.limit(limit)
+        return qf
+
+    def _get_keys(self, keys):
+        """Returns the keys in the order of the columns, which is the order of ORDER BY created by seek()."""
+        if isinstance(keys, str):
+            keys = [keys]
+        columns = self.get_fields(aliased=True)
+        for key in keys:
+            if key not in columns:
+                raise ValueError(f"Key {key} not found.")
+        return [column for column in columns if column in keys]
+
+    def cut(self, chunksize: int, deterministic: bool = True, keys=None, estimate: bool = False):
         """Divides a QFrame into multiple smaller QFrames, each containing chunksize rows.
 
         Examples
@@ -800,6 +1037,14 @@ class QFrame(Extract):
             Size of a single chunk
         deterministic : bool, optional
             Whether the result should be deterministic, by default True
+        keys : list or str, optional
+            Aliases of the columns which uniquely identify the rows. If specified, the chunks are created
+            with seek() instead of OFFSET and the rows with NULL keys are retrieved by an additional last
+            chunk, by default None
+        estimate : bool, optional
+            Whether to use the number of rows estimated by the engine (see explain()) instead of running
+            SELECT COUNT(*), by default False. The last chunk has no LIMIT, so no rows are missed if the estimate
+            is too low. If the engine doesn't estimate the number of rows (eg. Denodo), COUNT(*) is used.
 
         Returns
         -------
@@ -807,20 +1052,323 @@ class QFrame(Extract):
             List of QFrames
         """
         db = "denodo" if "denodo" in self.engine else "redshift"
-        con = SQLDB(db=db, engine_str=self.engine, interface=self.interface).get_connection()
-        query = f"SELECT COUNT(*) FROM ({self.get_sql()})"
-        try:
-            no_rows = con.execute(query).fetchval()
-        except:
-            no_rows = con.execute(query).fetchone()[0]
-        con.close()
+        if keys:
+            return self._cut_by_keys(chunksize, keys=keys, db=db)
+        no_rows = self._estimate_rows() if estimate else None
+        if no_rows is None:
+            estimate = False
+            con = self._get_sqldb(db).get_connection()
+            query = f"SELECT COUNT(*) FROM ({self._get_standalone_sql()})"
+            try:
+                no_rows = con.execute(query).fetchval()
+            except:
+                no_rows = con.execute(query).fetchone()[0]
+            con.close()
         self.logger.debug(f"Retrieving {no_rows} rows...")
+        # sort once, the chunks share the sorted fields and differ only in offset and limit
+        sorted_qf = self.window(deterministic=deterministic)
         qfs = []
-        for chunk in range(1, no_rows, chunksize):  # may need to use no_rows+1
-            qf = self.window(offset=chunk, limit=chunksize, deterministic=deterministic)
+        for chunk in range(0, no_rows, chunksize):
+            qf = sorted_qf.window(offset=chunk, limit=chunksize, deterministic=False)
             qfs.append(qf)
+        if estimate:
+            # the last chunk retrieves all remaining rows, the estimate can be too low
+            offset = len(qfs[:-1]) * chunksize
+            qfs[-1:] = [sorted_qf.window(offset=offset, deterministic=False)]
+        return qfs
+
+    def explain(self):
+        """Runs EXPLAIN of the query and returns the nodes of the execution plan with the estimates of the engine.
+
+        Plans in the format of PostgreSQL and Redshift (EXPLAIN) and SQLite (EXPLAIN QUERY PLAN) are parsed.
+        For Denodo DESC QUERYPLAN is used and every row of its output is returned as a node without estimates.
+
+        Examples
+        --------
+        >>> playlists = {"select": {"fields": {"PlaylistId": {"type": "dim"}, "Name": {"type": "dim"}}, "table": "Playlist",}}
+        >>> engine = "sqlite:///" + get_path("grizly_dev", "tests", "Chinook.sqlite")
+        >>> qf = QFrame(engine=engine).read_dict(playlists)
+        >>> qf.explain()[0]["operation"], qf.explain()[0]["relation"]
+        ('SCAN', 'Playlist')
+
+        Returns
+        -------
+        list
+            Nodes of the plan starting from the root, dicts with keys:
+
+            * operation: eg. 'Seq Scan', 'Hash Join', 'SCAN'
+            * relation: scanned table or None
+            * rows, startup_cost, total_cost, width: estimates of the engine or None
+            * depth: level of the node in the plan, 0 for the root
+            * details: other lines of the node, eg. filters and join conditions
+        """
+        sql = self._get_standalone_sql()
+        if self.engine.startswith("sqlite"):
+            query = f"EXPLAIN QUERY PLAN {sql}"
+        elif "denodo" in self.engine.lower():
+            query = f"DESC QUERYPLAN {sql}"
+        else:
+            query = f"EXPLAIN {sql}"
+        db = "denodo" if "denodo" in self.engine else "redshift"
+        con = self._get_sqldb(db).get_connection()
+        cursor = con.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        con.close()
+        if self.engine.startswith("sqlite"):
+            return _parse_sqlite_plan(rows)
+        if db == "denodo":
+            return _parse_denodo_plan(rows)
+        return _parse_plan(" ".join(str(value) for value in row if value is not None) for row in rows)
+
+    def _estimate_rows(self):
+        """Returns the number of rows estimated by the engine or None."""
+        if "denodo" in self.engine:
+            self.logger.info("Denodo doesn't provide row estimates in query plans, COUNT(*) is used instead.")
+            return None
+        try:
+            plan = self.explain()
+        except Exception:
+            self.logger.warning("Number of rows could not be estimated.", exc_info=True)
+            return None
+        if plan and plan[0]["rows"] is not None:
+            return plan[0]["rows"]
+        return None
+
+    def _cut_by_keys(self, chunksize, keys, db):
+        """Retrieves the keys of every chunksize-th row in a single query and creates a seek() chunk after each of them.
+        If some rows have NULL keys, the query returns also the first of them and the chunk from _seek_nulls() is
+        added at the end."""
+        keys = self._get_keys(keys)
+        key_columns = ", ".join(keys)
+        null_key = " OR ".join(f"{key} IS NULL" for key in keys)
+        query = (
+            f"SELECT {key_columns}, null_key FROM (SELECT {key_columns}, null_key, ROW_NUMBER() OVER"
+            f" (PARTITION BY null_key ORDER BY {key_columns}) AS row_no FROM (SELECT {key_columns},"
+            f" CASE WHEN {null_key} THEN 1 ELSE 0 END AS null_key FROM ({self._get_standalone_sql()}) sq) sq) sq"
+            f" WHERE (null_key = 0 AND row_no % {chunksize} = 0) OR (null_key = 1 AND row_no = 1) ORDER BY null_key, row_no"
+        )
+        con = self._get_sqldb(db).get_connection()
+        cursor = con.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        con.close()
+        boundaries = [list(row[:-1]) for row in rows if row[-1] == 0]
+        qfs = [self.seek(keys, last_seen=last_seen, limit=chunksize) for last_seen in [None] + boundaries]
+        if len(boundaries) < len(rows):
+            qfs.append(self._seek_nulls(keys))
+        self.logger.debug(f"Retrieving {len(qfs)} chunks...")
         return qfs
 
+    def _seek_nulls(self, keys):
+        """Returns the chunk with the rows which have NULL in any of the keys, they're not selected by seek()."""
+        if isinstance(keys, str):
+            keys = [keys]
+        return self.copy().select("*").query(" OR ".join(f"sq.{key} IS NULL" for key in keys))
+
+    def partition(self, n: int, key: str, method: str = "range"):
+        """Divides a QFrame into n QFrames by the values of key. Rows with NULL key are placed in the first partition.
+
+        Parameters
+        ----------
+        n : int
+            Number of partitions
+        key : str
+            Alias of a column or an expression using the aliases, eg. "FNV_HASH(Customer)"
+        method : {'range', 'hash'}, optional
+            How to partition the rows, by default 'range'
+
+            * range: key has to be numeric, the range between its minimum and maximum is divided into n equal intervals
+            * hash: key has to be an integer, rows are assigned with ABS(key) % n
+
+        Examples
+        --------
+        >>> data = {'select': {'fields': {'CustomerId': {'type': 'dim'}, 'Sales': {'type': 'num'}}, 'schema': 'schema', 'table': 'table'}}
+        >>> qf = QFrame().read_dict(data)
+        >>> qfs = qf.partition(4, "CustomerId", method="hash")
+        >>> print(qfs[1])
+        SELECT sq.CustomerId AS CustomerId,
+               sq.Sales AS Sales
+        FROM
+          (SELECT CustomerId,
+                  Sales
+           FROM schema.table) sq
+        WHERE ABS(CustomerId) % 4 = 1
+
+        Returns
+        -------
+        list
+            List of QFrames
+        """
+        if method == "hash":
+            conditions = [f"ABS({key}) % {n} = {i}" for i in range(n)]
+        elif method == "range":
+            db = "denodo" if "denodo" in self.engine else "redshift"
+            con = self._get_sqldb(db).get_connection()
+            cursor = con.cursor()
+            cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM ({self._get_standalone_sql()}) sq")
+            min_value, max_value = cursor.fetchone()
+            cursor.close()
+            con.close()
+            if min_value is None:
+                conditions = [f"{key} IS NULL"] + ["1 = 0"] * (n - 1)
+            elif not isinstance(min_value, numbers.Number):
+                raise ValueError(f"Range partitioning requires numeric key, got {type(min_value).__name__}.")
+            else:
+                step = (max_value - min_value) / n
+                bounds = [min_value + i * step for i in range(n)]
+                conditions = [f"{key} >= {lower} AND {key} < {upper}" for lower, upper in zip(bounds, bounds[1:])]
+                conditions.append(f"{key} >= {bounds[-1]} AND {key} <= {max_value}")
+        else:
+            raise ValueError("Invalid value in method. Valid values: 'range', 'hash'.")
+        conditions[0] = f"({conditions[0]} OR {key} IS NULL)"
+        return [self.copy().select("*").query(condition) for condition in conditions]
+
+    def _get_chunks(
+        self, chunksize=None, keys=None, workers=None, partition_by=None, partition_method="range", estimate=False
+    ):
+        if partition_by:
+            return self.partition(workers, partition_by, method=partition_method)
+        if chunksize:
+            return self.cut(chunksize, keys=keys, estimate=estimate)
+        raise ValueError("To use workers specify chunksize or partition_by.")
+
+    def _run_chunks(self, func, chunks, workers, db="redshift", interface=None):
+        """Calls func(chunk, con) for every chunk (eg. QFrame from cut()) on a pool of workers, each with its
+        own connection. With cte='temp' the temporary tables are created once on the connection of every worker.
+        Workers hold their connections until all chunks are retrieved, so if there are more workers than
+        connections kept in the pool (see grizly.tools.pool.configure_pools) they open their own connections.
+
+        Returns results in the order of chunks.
+        """
+        sqldb = self._get_sqldb(db, interface=interface)
+        pooled = min(workers, len(chunks)) <= pool_settings["pool_size"]
+        results = [None] * len(chunks)
+        tasks = queue.Queue()
+        for i, chunk in enumerate(chunks):
+            tasks.put((i, chunk))
+
+        def worker():
+            con = sqldb.get_connection(pooled=pooled)
+            try:
+                with self._temp_tables(con):
+                    while True:
+                        try:
+                            i, chunk = tasks.get_nowait()
+                        except queue.Empty:
+                            return
+                        results[i] = func(chunk, con)
+            finally:
+                con.close()
+
+        self.logger.debug(f"Retrieving {len(chunks)} chunks with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(worker) for _ in range(min(workers, len(chunks)))]
+            for future in futures:
+                future.result()
+        return results
+
+    def set_hints(self, **hints):
+        """Sets execution hints which are sent with every query of QFrame (to_df, iter_df, to_arrow, to_csv,
+        to_parquet, to_table, cut etc.). They override QFrame.default_hints of the engine, None removes a hint.
+
+        * timeout: statement timeout in seconds, on Denodo 'queryTimeout' and on Redshift 'statement_timeout'
+        * Denodo: other hints are added to the CONTEXT clause of the query, eg. swapsize=800
+        * Redshift and PostgreSQL: other hints are session parameters set with SET before the query,
+          eg. query_group='etl' routes the queries to the WLM queue of the 'etl' query group
+
+        Other engines ignore the hints.
+
+        Examples
+        --------
+        >>> data = {'select': {'fields': {'CustomerId': {'type': 'dim'}, 'Sales': {'type': 'num'}}, 'schema': 'schema', 'table': 'table'}}
+        >>> qf = QFrame(engine="mssql+pyodbc://redshift_acoe").read_dict(data)
+        >>> qf = qf.set_hints(query_group="etl", timeout=600)
+        >>> qf.get_hints()
+        {'query_group': 'etl', 'timeout': 600}
+
+        Returns
+        -------
+        QFrame
+        """
+        self.hints.update(hints)
+        return self
+
+    def get_hints(self):
+        """Returns the execution hints of QFrame together with the default hints of its engine."""
+        hints = dict(QFrame.default_hints.get(_get_dialect(self.engine), {}), **self.hints)
+        return {hint: value for hint, value in hints.items() if value is not None}
+
+    def incremental(self, watermark: str, state_path: str):
+        """Turns on incremental extraction.
+
+        to_df(), to_csv(), to_parquet() and to_table() retrieve only the rows with watermark greater than the
+        high-water mark saved in state_path by the previous run (all rows in the first run) and not greater than
+        the current maximum of watermark. The maximum is saved in state_path as the new high-water mark after the
+        output has been written. Use to_table() with if_exists='append' or 'merge' to add the rows to a table.
+
+        Parameters
+        ----------
+        watermark : str
+            Alias of a column whose values only increase, eg. an id or a timestamp of the last modification
+        state_path : str
+            Path to json file with the high-water mark
+
+        Returns
+        -------
+        QFrame
+        """
+        if watermark not in self.get_fields(aliased=True):
+            raise ValueError(f"Field {watermark} not found.")
+        self.watermark = {"column": watermark, "state_path": state_path}
+        return self
+
+    def get_high_water_mark(self):
+        """Returns the high-water mark saved by the last incremental run or None."""
+        if not self.watermark or not os.path.exists(self.watermark["state_path"]):
+            return None
+        with open(self.watermark["state_path"], "r") as f:
+            state = json.load(f)
+        if state.get("column") != self.watermark["column"]:
+            raise ValueError(
+                f"High-water mark in {self.watermark['state_path']} was saved for column {state.get('column')}."
+            )
+        return state["value"]
+
+    def _save_high_water_mark(self, value):
+        state_path = self.watermark["state_path"]
+        # the state is replaced in one step, so an interrupted run doesn't leave it incomplete
+        with open(state_path + ".tmp", "w") as f:
+            json.dump({"column": self.watermark["column"], "value": value}, f, default=str)
+        os.replace(state_path + ".tmp", state_path)
+        self.logger.info(f"High-water mark {value} saved in {state_path}")
+
+    def _get_increment(self):
+        """Returns QFrame limited to the rows between the saved high-water mark and the current maximum of
+        watermark and the maximum."""
+        column = self.watermark["column"]
+        last_value = self.get_high_water_mark()
+        db = "denodo" if "denodo" in self.engine else "redshift"
+        con = self._get_sqldb(db).get_connection()
+        cursor = con.cursor()
+        cursor.execute(f"SELECT MAX({column}) FROM ({self._get_standalone_sql()}) sq")
+        max_value = cursor.fetchone()[0]
+        cursor.close()
+        con.close()
+        if max_value is None:
+            condition = "1 = 0"
+        else:
+            condition = f"sq.{column} <= {_sql_literal(max_value)}"
+            if last_value is not None:
+                condition = f"sq.{column} > {_sql_literal(last_value)} AND {condition}"
+        self.logger.debug(f"Retrieving rows with {column} above {last_value}...")
+        qf = self.copy().select("*").query(condition)
+        qf.watermark = None
+        return qf, max_value
+
+    @_modifies_data
     def rearrange(self, fields):
         """Changes order of the columns.
 
@@ -913,6 +1461,15 @@ class QFrame(Extract):
     def get_sql(self, print_sql=True):
         """Overwrites the SQL statement inside the class and prints saved string.
 
+        The compiled SQL is cached under a fingerprint of QFrame.data, so repeated calls on an unchanged
+        QFrame don't rebuild the statement.
+
+        Parameters
+        ----------
+        print_sql : bool, optional
+            Whether to return the SQL reindented for reading, by default True. If False the SQL is returned
+            on a single line without passing it through sqlparse, which is much faster for big queries.
+
         Examples
         --------
         >>> data = {'select': {'fields': {'CustomerId': {'type': 'dim'}, 'Sales': {'type': 'num'}}, 'schema': 'schema', 'table': 'table'}}
@@ -921,13 +1478,26 @@ class QFrame(Extract):
         SELECT CustomerId,
                Sales
         FROM schema.table
+        >>> print(qf.get_sql(print_sql=False))
+        SELECT CustomerId, Sales FROM schema.table
 
         Returns
         -------
         QFrame
         """
-        self.create_sql_blocks()
-        self.sql = _get_sql(self.data)
+        if self.data == {}:
+            self.create_sql_blocks()
+            self.sql = ""
+            return self.sql
+
+        compiled = self._compile()
+        self.data["select"]["sql_blocks"] = compiled["sql_blocks"]
+        if print_sql:
+            if "pretty_sql" not in self._sql_cache:
+                self._sql_cache["pretty_sql"] = _format_sql(self._sql_cache["sql"])
+            self.sql = self._sql_cache["pretty_sql"]
+        else:
+            self.sql = self._sql_cache["sql"]
         return self.sql
 
     @deprecation.deprecated(details="Use SQLDB.create_table instead",)
@@ -947,7 +1517,9 @@ class QFrame(Extract):
         """
         engine_str = engine_str or self.engine
         self.create_sql_blocks()
-        sqldb = SQLDB(db="redshift", engine_str=engine_str, interface=self.interface)
+        sqldb = SQLDB(
+            db="redshift", engine_str=engine_str, interface=self.interface, session_sql=self._get_session_sql()
+        )
         sqldb.create_table(
             columns=self.get_fields(aliased=True),
             types=self.get_dtypes(),
@@ -1032,7 +1604,8 @@ class QFrame(Extract):
         )
         return self
 
-    def to_table(self, table, schema="", if_exists="fail", char_size=500):
+    @_incremental
+    def to_table(self, table, schema="", if_exists="fail", char_size=500, keys=None, replace_method="delete"):
         """Inserts values from QFrame object into given table. Name of columns in qf and table have to match each other.
 
         Parameters
@@ -1047,13 +1620,20 @@ class QFrame(Extract):
             * fail: Raise a ValueError.
             * replace: Clean table before inserting new values.
             * append: Insert new values to the existing table.
+            * merge: Delete the rows with the same keys from the table and insert new values.
+
+        keys : list or str, optional
+            Aliases of the columns which uniquely identify the rows, required with if_exists='merge'
+        replace_method : {'delete', 'swap', 'truncate'}, optional
+            How the table is cleaned with if_exists='replace', by default 'delete'. With 'swap' the rows are
+            written to a staging table which replaces the table in one transaction, see SQLDB.write_to
 
         Returns
         -------
         QFrame
         """
         self.create_sql_blocks()
-        sqldb = SQLDB(db="redshift", engine_str=self.engine, interface=self.interface)
+        sqldb = self._get_sqldb()
         sqldb.create_table(
             columns=self.get_fields(aliased=True),
             types=self.get_dtypes(),
@@ -1062,43 +1642,168 @@ class QFrame(Extract):
             char_size=char_size,
         )
         sqldb.write_to(
-            table=table, columns=self.get_fields(aliased=True), sql=self.get_sql(), schema=schema, if_exists=if_exists,
+            table=table, columns=self.get_fields(aliased=True), sql=self._get_standalone_sql(), schema=schema, if_exists=if_exists, keys=keys,
+            replace_method=replace_method,
         )
         return self
 
-    def to_df(self, db="redshift", chunksize: int = None):
+    # to_csv() and to_parquet() of incremental QFrame write only the rows above the high-water mark
+    to_csv = _incremental(Extract.to_csv)
+    to_parquet = _incremental(Extract.to_parquet)
+
+    @_incremental
+    def to_df(
+        self,
+        db="redshift",
+        chunksize: int = None,
+        keys=None,
+        workers: int = None,
+        partition_by=None,
+        partition_method="range",
+        estimate: bool = False,
+        dtypes: bool = False,
+        category_threshold: float = 0.5,
+    ):
         """Writes QFrame to DataFrame. Uses pandas.read_sql.
 
-        TODO: DataFarme types should correspond to types defined in QFrame data.
+        With dtypes=True the rows are fetched with cursor.fetchmany in batches of chunksize rows (by default
+        100000) and every batch is converted to Arrow arrays, so the rows are never kept as Python objects.
+        The columns get dtypes corresponding to the types of QFrame fields (see get_dtypes):
+
+            * INTEGER, BIGINT etc. -> nullable Int32, Int64 etc.
+            * DATE, TIMESTAMP -> datetime64[ns]
+            * BOOL -> nullable boolean
+            * string columns -> category if the number of unique values is at most category_threshold times
+              the number of rows, otherwise Arrow-backed string[pyarrow]
+
+        Numeric columns are never converted to float64 to avoid losing precision of integers. The chunks
+        of chunksize rows are retrieved as with dtypes=False, each in batches of chunksize rows.
 
         Parameters
         ---------
         db : not really used but has to be provided
-        
+        chunksize : int, optional
+            Number of rows retrieved with a single query, by default None
+        keys : list or str, optional
+            Aliases of the columns which uniquely identify the rows. If specified together with chunksize,
+            the chunks are retrieved with seek() instead of OFFSET, by default None
+        workers : int, optional
+            Number of chunks retrieved concurrently, each worker uses its own connection, by default None
+        partition_by : str, optional
+            If specified, QFrame is divided into workers partitions with partition() instead of chunks with cut(),
+            by default None
+        partition_method : {'range', 'hash'}, optional
+            Method used by partition(), by default 'range'
+        estimate : bool, optional
+            Whether workers' chunks are sized from the number of rows estimated by the engine instead of
+            SELECT COUNT(*), see cut(), by default False
+        dtypes : bool, optional
+            Whether column dtypes are derived from the types of QFrame fields, by default False (dtypes inferred
+            by pandas.read_sql are kept)
+        category_threshold : float, optional
+            Maximum ratio of unique values to rows of string columns converted to category, by default 0.5
+
+        Examples
+        --------
+        >>> playlists = {"select": {"fields": {"PlaylistId": {"type": "dim", "custom_type": "INTEGER"}, "Name": {"type": "dim"}}, "table": "Playlist",}}
+        >>> engine = "sqlite:///" + get_path("grizly_dev", "tests", "Chinook.sqlite")
+        >>> qf = QFrame(engine=engine).read_dict(playlists)
+        >>> qf.to_df(dtypes=True).dtypes.tolist()
+        [Int32Dtype(), string[pyarrow]]
+
         Returns
         -------
         DataFrame
             Data generated from sql.
         """
-        sql = self.get_sql()
-        sqldb = SQLDB(db=db, engine_str=self.engine, interface=self.interface, logger=self.logger)
+        if dtypes:
+            key = self._get_cache_key("df", dtypes=True) if self.cache is not None else None
+            table = self.cache.get(key) if key else None
+            if table is None:
+                table = self._fetch_columns(db, chunksize, keys, workers, partition_by, partition_method, estimate)
+                if key:
+                    self.cache.put(key, table)
+            return self._to_typed_df(table, category_threshold)
+        if self.cache is None:
+            return self._to_df(db, chunksize, keys, workers, partition_by, partition_method, estimate)
+        key = self._get_cache_key("df", dtypes=False)
+        table = self.cache.get(key)
+        if table is not None:
+            return table.to_pandas()
+        df = self._to_df(db, chunksize, keys, workers, partition_by, partition_method, estimate)
+        try:
+            self.cache.put(key, pa.Table.from_pandas(df, preserve_index=False))
+        except pa.ArrowException:
+            self.logger.warning("DataFrame could not be converted to Arrow and was not cached.")
+        return df
+
+    def _to_df(
+        self,
+        db="redshift",
+        chunksize: int = None,
+        keys=None,
+        workers: int = None,
+        partition_by=None,
+        partition_method="range",
+        estimate: bool = False,
+    ):
+        if workers:
+            qfs = self._get_chunks(
+                chunksize,
+                keys=keys,
+                workers=workers,
+                partition_by=partition_by,
+                partition_method=partition_method,
+                estimate=estimate,
+            )
+
+            def read_chunk(qf, con):
+                return pd.read_sql(qf._add_hints(qf.get_sql(print_sql=False)), con)
+
+            return pd.concat(self._run_chunks(read_chunk, qfs, workers, db=db), ignore_index=True)
+
+        sql = self.get_sql(print_sql=False)
+        sqldb = self._get_sqldb(db)
         con = sqldb.get_connection()
+        with self._temp_tables(con):
+            df = self._read_df(sql, con, chunksize=chunksize, keys=keys)
+        con.close()
+        del sqldb
+        return df
+
+    def _read_df(self, sql, con, chunksize=None, keys=None):
         offset = 0
         dfs = []
         if chunksize:
             if not "limit" in sql.lower():  # respect existing LIMIT
-                while True:
-                    chunk_sql = sql + f"\nOFFSET {offset} LIMIT {self.chunksize}"
-                    chunk_df = pd.read_sql(chunk_sql, con)
-                    dfs.append(chunk_df)
-                    offset += chunksize
-                    if len(dfs[-1]) < chunksize:
-                        break
+                if keys:
+                    keys = self._get_keys(keys)
+                    last_seen = None
+                    while True:
+                        chunk_sql = self.seek(keys, last_seen=last_seen, limit=chunksize).get_sql(print_sql=False)
+                        chunk_df = pd.read_sql(self._add_hints(chunk_sql), con)
+                        dfs.append(chunk_df)
+                        if len(chunk_df) < chunksize:
+                            break
+                        last_seen = chunk_df[keys].iloc[-1].tolist()
+                    # rows with NULL keys are not selected by seek()
+                    null_sql = self._seek_nulls(keys).get_sql(print_sql=False)
+                    null_df = pd.read_sql(self._add_hints(null_sql), con)
+                    if not null_df.empty:
+                        dfs.append(null_df)
+                else:
+                    while True:
+                        chunk_sql = sql + f"\nOFFSET {offset} LIMIT {chunksize}"
+                        chunk_df = pd.read_sql(self._add_hints(chunk_sql), con)
+                        dfs.append(chunk_df)
+                        offset += chunksize
+                        if len(dfs[-1]) < chunksize:
+                            break
                 df = pd.concat(dfs)
             else:
                 self.logger.warning(f"LIMIT already exists in query. Chunksize will not be applied")
         else:
-            df = pd.read_sql(sql, con)
+            df = pd.read_sql(self._add_hints(sql), con)
 
         # df = read_sql(sql=sql, con=con)
         # import io
@@ -1113,25 +1818,362 @@ class QFrame(Extract):
         # store.seek(0)
         # df = read_csv(store)
         # self.df = df
-        con.close()
-        del sqldb
         return df
 
-    def to_arrow(self, db="redshift", debug=False):
-        sql = self.get_sql()
-        sqldb = SQLDB(db=db, engine_str=self.engine, interface="turbodbc", logger=self.logger)
+    def iter_df(self, batch_rows: int = 100000, db="redshift"):
+        """Executes the query once and yields DataFrames with at most batch_rows rows, fetched with cursor.fetchmany.
+
+        Columns get dtypes corresponding to the types of QFrame fields (see get_dtypes), eg. 'num' -> float64,
+        custom_type BIGINT -> Int64, DATE -> datetime64[ns].
+
+        Parameters
+        ----------
+        batch_rows : int, optional
+            Maximum number of rows in a single DataFrame, by default 100000
+        db : not really used but has to be provided
+
+        Examples
+        --------
+        >>> playlists = {"select": {"fields": {"PlaylistId": {"type": "dim", "custom_type": "INTEGER"}, "Name": {"type": "dim"}}, "table": "Playlist",}}
+        >>> engine = "sqlite:///" + get_path("grizly_dev", "tests", "Chinook.sqlite")
+        >>> qf = QFrame(engine=engine).read_dict(playlists)
+        >>> [len(df) for df in qf.iter_df(10)]
+        [10, 8]
+
+        Yields
+        ------
+        DataFrame
+        """
+        sql = self._add_hints(self.get_sql(print_sql=False))
+        columns = self.get_fields(aliased=True)
+        dtypes = {column: _get_pandas_dtype(sql_type) for column, sql_type in zip(columns, self.get_dtypes())}
+        sqldb = self._get_sqldb(db)
         con = sqldb.get_connection()
-        cursor = con.cursor()
-        cursor.execute(sql)
-        rowcount = cursor.rowcount
-        batches = cursor.fetcharrowbatches(strings_as_dictionary=True)  # string_as.. - similar to pd.Categorical
-        arrow_table = pa.concat_tables(batches)
-        cursor.close()
-        con.close()
+        try:
+            with self._temp_tables(con):
+                cursor = con.cursor()
+                try:
+                    cursor.execute(sql)
+                    while True:
+                        rows = cursor.fetchmany(batch_rows)
+                        if not rows:
+                            break
+                        df = pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+                        yield self._set_dtypes(df, dtypes)
+                finally:
+                    cursor.close()
+        finally:
+            con.close()
+
+    def _fetch_columns(self, db, chunksize, keys, workers, partition_by, partition_method, estimate):
+        """Fetches the rows into pyarrow.Table for to_df(dtypes=True). Columns of integer, boolean and date
+        fields get the Arrow types of the fields, the types of other columns are inferred from the values."""
+        columns = self.get_fields(aliased=True)
+        arrow_types = []
+        for sql_type in self.get_dtypes():
+            explicit = _get_pandas_dtype(sql_type) not in ("object", "float64")
+            arrow_types.append(_get_arrow_type(sql_type) if explicit else None)
+        batch_rows = chunksize or 100000
+
+        def read_chunk(qf, con):
+            return _fetch_arrow_columns(qf._add_hints(qf.get_sql(print_sql=False)), con, arrow_types, batch_rows)
+
+        if workers:
+            qfs = self._get_chunks(
+                chunksize,
+                keys=keys,
+                workers=workers,
+                partition_by=partition_by,
+                partition_method=partition_method,
+                estimate=estimate,
+            )
+            results = self._run_chunks(read_chunk, qfs, workers, db=db)
+        else:
+            # the same chunks as in _read_df(), one query per chunk with the same connection
+            qfs = [self]
+            if chunksize and "limit" not in self.get_sql(print_sql=False).lower():
+                qfs = self.cut(chunksize, keys=keys)
+            con = self._get_sqldb(db).get_connection()
+            try:
+                with self._temp_tables(con):
+                    results = [read_chunk(qf, con) for qf in qfs]
+            finally:
+                con.close()
+        arrays = [_concat_arrays([array for result in results for array in result[i]]) for i in range(len(columns))]
+        return pa.Table.from_arrays(arrays, names=columns)
+
+    def _to_typed_df(self, table, category_threshold=0.5):
+        """Converts pyarrow.Table to DataFrame with dtypes corresponding to the types of QFrame fields, see to_df().
+        String columns are converted from Arrow buffers, without creating Python objects."""
+        data = {}
+        for column, sql_type in zip(self.get_fields(aliased=True), self.get_dtypes()):
+            if column not in table.column_names:
+                continue
+            values = table.column(column)
+            dtype = _get_pandas_dtype(sql_type)
+            # inferred integers keep numpy dtypes as in pandas.read_sql
+            types_mapper = None
+            if dtype not in ("object", "float64"):
+                try:
+                    values = values.cast(_get_arrow_type(sql_type))
+                    types_mapper = _PANDAS_TYPES.get
+                except pa.ArrowException:
+                    self.logger.warning(f"Column {column} could not be converted to {dtype}.")
+            elif dtype == "float64" and not (pa.types.is_integer(values.type) or pa.types.is_floating(values.type)):
+                try:
+                    values = values.cast(pa.float64())
+                except pa.ArrowException:
+                    pass
+            elif pa.types.is_string(values.type):
+                if pc.count_distinct(values).as_py() <= category_threshold * len(values):
+                    values = values.dictionary_encode()
+                types_mapper = _PANDAS_TYPES.get
+            data[column] = values.to_pandas(types_mapper=types_mapper, date_as_object=False)
+        return pd.DataFrame(data)
+
+    def _set_dtypes(self, df, dtypes):
+        for column, dtype in dtypes.items():
+            if str(df[column].dtype) == dtype:
+                continue
+            try:
+                df[column] = df[column].astype(dtype)
+            except (ValueError, TypeError):
+                self.logger.warning(f"Column {column} could not be converted to {dtype}.")
+        return df
+
+    def to_arrow(
+        self,
+        db="redshift",
+        debug=False,
+        chunksize=None,
+        keys=None,
+        workers=None,
+        partition_by=None,
+        partition_method="range",
+        stream=False,
+        interface="turbodbc",
+        batch_rows=100000,
+        estimate=False,
+    ):
+        """Writes QFrame to pyarrow.Table or, with stream=True, to pyarrow.RecordBatchReader.
+
+        With turbodbc interface batches are fetched with fetcharrowbatches. With other interfaces they are built
+        from cursor.fetchmany rows with types corresponding to the types of QFrame fields (see get_dtypes).
+
+        Parameters
+        ----------
+        db : not really used but has to be provided
+        debug : bool, optional
+            Whether to return also the number of rows, by default False
+        chunksize, keys, workers, partition_by, partition_method, estimate : optional
+            See to_df()
+        stream : bool, optional
+            Whether to return RecordBatchReader which fetches the batches while being read, by default False
+        interface : {'turbodbc', 'sqlalchemy', 'pyodbc'}, optional
+            Interface used to retrieve the data, by default 'turbodbc'
+        batch_rows : int, optional
+            Maximum number of rows in a single batch, not used with turbodbc, by default 100000
+
+        Returns
+        -------
+        pyarrow.Table or pyarrow.RecordBatchReader
+        """
+        fetch = partial(
+            self._to_arrow,
+            db=db,
+            chunksize=chunksize,
+            keys=keys,
+            workers=workers,
+            partition_by=partition_by,
+            partition_method=partition_method,
+            stream=stream,
+            interface=interface,
+            batch_rows=batch_rows,
+            estimate=estimate,
+        )
+        if self.cache is None:
+            return fetch(debug=debug)
+        key = self._get_cache_key("arrow", interface=interface)
+        table = self.cache.get(key)
+        if table is None:
+            if stream:
+                # the batches are not kept, so a streamed result can't be cached
+                return fetch(debug=debug)
+            table, _ = fetch(debug=True)
+            self.cache.put(key, table)
+        if stream:
+            return pa.RecordBatchReader.from_batches(table.schema, table.to_batches(batch_rows))
+        if debug:
+            return table, table.num_rows
+        return table
+
+    def _to_arrow(
+        self,
+        db="redshift",
+        debug=False,
+        chunksize=None,
+        keys=None,
+        workers=None,
+        partition_by=None,
+        partition_method="range",
+        stream=False,
+        interface="turbodbc",
+        batch_rows=100000,
+        estimate=False,
+    ):
+        schema = self._get_arrow_schema()
+        if stream:
+            if workers:
+                raise ValueError("Parameter stream can't be used with workers.")
+            return self._arrow_reader(db=db, interface=interface, schema=schema, batch_rows=batch_rows)
+
+        if workers:
+            qfs = self._get_chunks(
+                chunksize,
+                keys=keys,
+                workers=workers,
+                partition_by=partition_by,
+                partition_method=partition_method,
+                estimate=estimate,
+            )
+
+            def read_chunk(qf, con):
+                return _fetch_arrow(qf._add_hints(qf.get_sql(print_sql=False)), con, interface, schema, batch_rows)
+
+            results = self._run_chunks(read_chunk, qfs, workers, db=db, interface=interface)
+            arrow_table = pa.concat_tables([table for table, _ in results])
+            rowcount = sum(rowcount for _, rowcount in results)
+        else:
+            sql = self._add_hints(self.get_sql(print_sql=False))
+            sqldb = self._get_sqldb(db, interface=interface)
+            con = sqldb.get_connection()
+            with self._temp_tables(con):
+                arrow_table, rowcount = _fetch_arrow(sql, con, interface, schema, batch_rows)
+            con.close()
         if debug:
             return arrow_table, rowcount
         return arrow_table
 
+    def run_local(self, tables):
+        """Executes QFrame over local data instead of the database, with pyarrow.compute kernels.
+        Supports a subset of SQL, see grizly.tools.local.
+
+        Parameters
+        ----------
+        tables : dict
+            Data of the tables used by QFrame, keys are table names (with or without schema) and values are
+            pyarrow.Table, pandas.DataFrame or paths to Parquet files
+
+        Examples
+        --------
+        >>> orders = pd.DataFrame({"Customer": ["A", "A", "B"], "Value": [1, 2, 3]})
+        >>> data = {"select": {"fields": {"Customer": {"type": "dim"}, "Value": {"type": "num"}}, "table": "orders"}}
+        >>> qf = QFrame().read_dict(data).query("Value > 1")
+        >>> qf.run_local({"orders": orders}).to_pandas()
+          Customer  Value
+        0        A      2
+        1        B      3
+
+        Returns
+        -------
+        pyarrow.Table
+        """
+        return local.execute(self._compile()["query"], tables)
+
+    def _get_sqldb(self, db="redshift", interface=None):
+        """Returns SQLDB whose connections execute the session statements of the hints, eg. SET query_group."""
+        return SQLDB(
+            db=db,
+            engine_str=self.engine,
+            interface=interface or self.interface,
+            logger=self.logger,
+            session_sql=self._get_session_sql(),
+        )
+
+    def _add_hints(self, sql):
+        """Appends query hints, eg. Denodo CONTEXT clause, to sql."""
+        return sql + self._compile_hints()[0]
+
+    def _compile_hints(self):
+        return _compile_hints(_get_dialect(self.engine), self.get_hints(), logger=self.logger)
+
+    def _get_session_sql(self):
+        """Returns the statements executed on every new connection, SET statements of the hints."""
+        return self._compile_hints()[1]
+
+    def _get_standalone_sql(self):
+        """Returns SQL which doesn't use the temporary tables of cte='temp', the common tables are defined in
+        WITH clause instead. Used by the queries executed on connections without the temporary tables, eg. COUNT(*)
+        of cut() or INSERT of to_table()."""
+        return self._compile()["standalone_sql"]
+
+    @contextmanager
+    def _temp_tables(self, con=None, cursor=None):
+        """Creates the temporary tables of cte='temp' on con, the connection of the final query, and drops them
+        at the end of the block, so pooled connections are returned without them. If cursor is given, eg. by
+        the user, the tables are created with it and the cursor is left open."""
+        compiled = self._compile() if self.data else {"temp_tables": [], "drop_temp_tables": []}
+        if not compiled["temp_tables"]:
+            yield
+            return
+        own_cursor = cursor is None
+        if own_cursor:
+            cursor = con.cursor()
+        for sql in compiled["temp_tables"]:
+            cursor.execute(sql)
+        try:
+            yield
+        finally:
+            for sql in compiled["drop_temp_tables"]:
+                cursor.execute(sql)
+            if own_cursor:
+                cursor.close()
+
+    def _get_cache_key(self, output, **options):
+        """Returns the key of the result of output ('df', 'arrow' or 'parquet') with options, eg. dtypes or interface.
+        The results of different outputs and options have different types, so they're cached separately."""
+        # with cte='temp' the query references the temporary tables only by name (cte1, cte2, ...)
+        statements = self._get_session_sql() + self._compile()["temp_tables"]
+        sql = ";\n".join(statements + [self._add_hints(self.get_sql(print_sql=False))])
+        return self.cache.get_key(self.engine, sql, dict(options, output=output))
+
+    def _get_arrow_schema(self):
+        columns = self.get_fields(aliased=True)
+        return pa.schema([(column, _get_arrow_type(sql_type)) for column, sql_type in zip(columns, self.get_dtypes())])
+
+    def _get_dim_columns(self):
+        fields = self.data["select"]["fields"]
+        fields = [ir.Field.from_dict(field, attrs) for field, attrs in fields.items()]
+        return [field.alias for field in fields if field.selected and field.type == "dim"]
+
+    def _arrow_reader(self, db, interface, schema, batch_rows):
+        sqldb = self._get_sqldb(db, interface=interface)
+        con = sqldb.get_connection()
+        # closed in reverse order when the reader is exhausted: cursor, temporary tables, connection
+        resources = ExitStack()
+        resources.callback(con.close)
+        try:
+            resources.enter_context(self._temp_tables(con))
+            cursor = con.cursor()
+            resources.callback(cursor.close)
+            cursor.execute(self._add_hints(self.get_sql(print_sql=False)))
+            batches = _iter_arrow_batches(cursor, interface, schema, batch_rows)
+            if interface == "turbodbc":
+                # turbodbc decides the types itself, the schema is known after fetching the first batch
+                first_batch = next(batches, None)
+                if first_batch is not None:
+                    schema = first_batch.schema
+                    batches = itertools.chain([first_batch], batches)
+        except:
+            resources.close()
+            raise
+
+        def closing(batches):
+            with resources:
+                yield from batches
+
+        return pa.RecordBatchReader.from_batches(schema, closing(batches))
+
     def to_sql(
         self,
         table,
@@ -1146,6 +2188,8 @@ class QFrame(Extract):
     ):
         """Writes QFrame to DataFarme and then DataFarme to SQL database. Uses pandas.to_sql.
 
+        pandas inserts rows one by one by default, use SQLDB.insert_df() to insert into an existing table faster.
+
         Parameters
         ----------
         table : str
@@ -1181,7 +2225,7 @@ class QFrame(Extract):
             * callable with signature ``(pd_table, conn, keys, data_iter)``.
         """
         df = self.to_df()
-        sqldb = SQLDB(db="redshift", engine_str=self.engine, interface=self.interface)
+        sqldb = self._get_sqldb()
         con = sqldb.get_connection()
 
         df.to_sql(
@@ -1267,16 +2311,33 @@ class QFrame(Extract):
     def copy(self):
         """Makes a copy of QFrame.
 
+        The copy shares QFrame.data with the original QFrame until one of them is modified with
+        QFrame methods - only then the modified part (e.g. the fields or the limit) is copied.
+        Changing QFrame.data directly (eg. qf.data["select"]["limit"] = 10) affects both QFrames.
+
         Returns
         -------
         QFrame
         """
-        data = deepcopy(self.data)
-        engine = deepcopy(self.engine)
-        sql = deepcopy(self.sql)
-        getfields = deepcopy(self.getfields)
-        logger = self.logger
-        return QFrame(data=data, engine=engine, sql=sql, getfields=getfields, logger=self.logger)
+        qf = QFrame(
+            data=self.data,
+            engine=self.engine,
+            sql=self.sql,
+            getfields=list(self.getfields),
+            chunksize=self.chunksize,
+            interface=self.interface,
+            logger=self.logger,
+            pushdown=self.pushdown,
+            cache=self.cache,
+            hints=self.hints,
+            cte=self.cte,
+        )
+        qf.watermark = self.watermark
+        qf._sql_cache = self._sql_cache
+        if self.data:
+            self._share()
+            qf._share()
+        return qf
 
     def __str__(self):
         sql = self.get_sql()
@@ -1370,8 +2431,9 @@ def join(qframes=[], join_type=None, on=None, unique_col=True):
             assert first_engine == q.engine, "QFrames have different engine strings."
         q.create_sql_blocks()
         iterator += 1
-        data[f"sq{iterator}"] = deepcopy(q.data)
-        sq = deepcopy(q.data["select"])
+        data[f"sq{iterator}"] = q.data
+        q._share()
+        sq = q.data["select"]
 
         for alias in sq["sql_blocks"]["select_aliases"]:
             if unique_col and alias in aliases:
@@ -1461,10 +2523,11 @@ def union(qframes=[], union_type=None, union_by="position"):
 
     main_qf = qframes[0]
     main_qf.create_sql_blocks()
-    data["sq1"] = deepcopy(main_qf.data)
-    old_fields = deepcopy(main_qf.data["select"]["fields"])
-    new_fields = deepcopy(main_qf.data["select"]["sql_blocks"]["select_aliases"])
-    new_types = deepcopy(main_qf.data["select"]["sql_blocks"]["types"])
+    data["sq1"] = main_qf.data
+    main_qf._share()
+    old_fields = main_qf.data["select"]["fields"]
+    new_fields = main_qf.data["select"]["sql_blocks"]["select_aliases"]
+    new_types = main_qf.data["select"]["sql_blocks"]["types"]
     qframes.pop(0)
 
     iterator = 2
@@ -1484,7 +2547,7 @@ def union(qframes=[], union_type=None, union_by="position"):
             ), f"""Aliases {field_diff_2} not found in 1. QFrame, aliases {field_diff_1} not found in {iterator}. QFrame. Use qf.rename() to rename fields or set option union_by='position'"""
             ordered_fields = []
             for new_field in new_fields:
-                fields = deepcopy(qf.data["select"]["fields"])
+                fields = qf.data["select"]["fields"]
                 for field in fields:
                     if field == new_field or "as" in fields[field] and fields[field]["as"] == new_field:
                         ordered_fields.append(field)
@@ -1501,7 +2564,8 @@ def union(qframes=[], union_type=None, union_by="position"):
                 qf_type == new_type
             ), f"Types don't match. 1. QFrame alias: {new_field} type: {new_type}, {iterator}. QFrame alias: {qf_alias} type: {qf_type}."
 
-        data[f"sq{iterator}"] = deepcopy(qf.data)
+        data[f"sq{iterator}"] = qf.data
+        qf._share()
         iterator += 1
 
     for field in old_fields:
@@ -1715,6 +2779,297 @@ def initiate(columns, schema, table, json_path, engine_str="", subquery="", col_
     print(f"Data saved in {json_path}")
 
 
+def _fingerprint(data):
+    """Returns a hash of QFrame.data which ignores generated sql_blocks"""
+
+    def _strip_sql_blocks(obj):
+        if isinstance(obj, dict):
+            return {key: _strip_sql_blocks(value) for key, value in obj.items() if key != "sql_blocks"}
+        return obj
+
+    data_str = json.dumps(_strip_sql_blocks(data), default=str)
+    return hashlib.md5(data_str.encode("utf-8")).hexdigest()
+
+
+def _get_pandas_dtype(sql_type):
+    """Returns pandas dtype corresponding to SQL type. Integers and booleans get nullable dtypes."""
+    sql_type = sql_type.upper()
+    dtypes = {
+        "SMALLINT": "Int16",
+        "INT2": "Int16",
+        "INTEGER": "Int32",
+        "INT4": "Int32",
+        "BIGINT": "Int64",
+        "INT8": "Int64",
+        "INT": "Int32",
+        "DECIMAL": "float64",
+        "NUMERIC": "float64",
+        "REAL": "float64",
+        "FLOAT": "float64",
+        "DOUBLE PRECISION": "float64",
+        "BOOL": "boolean",
+        "DATE": "datetime64[ns]",
+        "TIMESTAMP": "datetime64[ns]",
+    }
+    for type_prefix, dtype in dtypes.items():
+        if sql_type.startswith(type_prefix):
+            return dtype
+    return "object"
+
+
+def _get_arrow_type(sql_type):
+    """Returns pyarrow type corresponding to SQL type."""
+    sql_type = sql_type.upper()
+    types = {
+        "SMALLINT": pa.int16(),
+        "INT2": pa.int16(),
+        "INTEGER": pa.int32(),
+        "INT4": pa.int32(),
+        "BIGINT": pa.int64(),
+        "INT8": pa.int64(),
+        "INT": pa.int32(),
+        "DECIMAL": pa.float64(),
+        "NUMERIC": pa.float64(),
+        "REAL": pa.float64(),
+        "FLOAT": pa.float64(),
+        "DOUBLE PRECISION": pa.float64(),
+        "BOOL": pa.bool_(),
+        "DATE": pa.date32(),
+        "TIMESTAMP": pa.timestamp("us"),
+    }
+    for type_prefix, arrow_type in types.items():
+        if sql_type.startswith(type_prefix):
+            return arrow_type
+    return pa.string()
+
+
+def _to_arrow_array(values, arrow_type):
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # eg. Decimal -> float64, str -> timestamp
+        return pa.array(values).cast(arrow_type)
+
+
+def _iter_arrow_batches(cursor, interface, schema, batch_rows):
+    if interface == "turbodbc":
+        for table in cursor.fetcharrowbatches(strings_as_dictionary=True):  # string_as.. - similar to pd.Categorical
+            yield from table.to_batches()
+        return
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        columns = zip(*rows)
+        arrays = [_to_arrow_array(list(values), field.type) for values, field in zip(columns, schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _fetch_arrow_columns(sql, con, arrow_types, batch_rows=100000):
+    """Fetches the rows of sql in batches and returns a list of Arrow arrays (one per batch) for every column.
+    Columns with arrow type None get the type inferred from the values."""
+    columns = [[] for _ in arrow_types]
+    cursor = con.cursor()
+    cursor.execute(sql)
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        for arrays, values, arrow_type in zip(columns, zip(*rows), arrow_types):
+            if arrow_type is None:
+                arrays.append(_infer_arrow_array(list(values)))
+            else:
+                arrays.append(_to_arrow_array(list(values), arrow_type))
+    cursor.close()
+    return columns
+
+
+def _infer_arrow_array(values):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed types
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+    if pa.types.is_decimal(array.type):
+        return array.cast(pa.float64())
+    return array
+
+
+def _concat_arrays(arrays):
+    """Returns ChunkedArray of arrays with types inferred from different batches unified, eg. null and int64."""
+    types = {array.type for array in arrays if array.type != pa.null()}
+    if not types:
+        arrow_type = pa.null()
+    elif len(types) == 1:
+        arrow_type = types.pop()
+    elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        arrow_type = pa.float64()
+    else:
+        arrow_type = pa.string()
+    return pa.chunked_array([array.cast(arrow_type) for array in arrays], type=arrow_type)
+
+
+# pandas dtypes of Arrow types in to_df(dtypes=True), other types are converted by pyarrow
+_PANDAS_TYPES = {
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.string(): pd.StringDtype("pyarrow"),
+}
+
+
+def _fetch_arrow(sql, con, interface="turbodbc", schema=None, batch_rows=100000):
+    cursor = con.cursor()
+    cursor.execute(sql)
+    if interface == "turbodbc":
+        rowcount = cursor.rowcount
+        batches = cursor.fetcharrowbatches(strings_as_dictionary=True)
+        arrow_table = pa.concat_tables(batches)
+    else:
+        batches = list(_iter_arrow_batches(cursor, interface, schema, batch_rows))
+        arrow_table = pa.Table.from_batches(batches, schema=schema)
+        rowcount = arrow_table.num_rows
+    cursor.close()
+    return arrow_table, rowcount
+
+
+def _get_dialect(engine):
+    engine = engine.lower()
+    if "denodo" in engine:
+        return "denodo"
+    if "redshift" in engine or engine.startswith("postgres"):
+        return "redshift"
+    return engine.split(":")[0].split("+")[0]
+
+
+def _compile_hints(dialect, hints, logger=None):
+    """Compiles hints into a suffix of the query and a list of statements executed before the query.
+
+    Examples
+    --------
+    >>> _compile_hints("denodo", {"swapsize": 800, "timeout": 60})
+    (" CONTEXT('swapsize' = '800', 'queryTimeout' = '60000')", [])
+    >>> _compile_hints("redshift", {"query_group": "etl", "timeout": 60})
+    ('', ["SET query_group TO 'etl'", 'SET statement_timeout TO 60000'])
+    """
+    hints = dict(hints)
+    timeout = hints.pop("timeout", None)
+    if dialect == "denodo":
+        if timeout is not None:
+            hints["queryTimeout"] = int(timeout * 1000)
+        if not hints:
+            return "", []
+        context = ", ".join(f"{_sql_literal(str(hint))} = {_sql_literal(str(value))}" for hint, value in hints.items())
+        return f" CONTEXT({context})", []
+    if dialect == "redshift":
+        if timeout is not None:
+            hints["statement_timeout"] = int(timeout * 1000)
+        return "", [f"SET {hint} TO {_sql_literal(value)}" for hint, value in hints.items()]
+    if (hints or timeout is not None) and logger:
+        logger.warning(f"Hints are not supported for {dialect} and will be ignored.")
+    return "", []
+
+
+_PLAN_NODE = re.compile(
+    r"^(?P<indent>\s*)(?P<arrow>->\s*)?(?P<operation>.+?)\s+\(cost=(?P<startup_cost>[\d.]+)\.\.(?P<total_cost>[\d.]+)"
+    r"\s+rows=(?P<rows>\d+)\s+width=(?P<width>\d+)\)"
+)
+
+
+def _parse_plan(lines):
+    """Parses EXPLAIN output in the format of PostgreSQL and Redshift, eg.
+    "XN Seq Scan on sales  (cost=0.00..1.72 rows=172 width=8)", lines without estimates are added to the details
+    of the preceding node."""
+    nodes = []
+    for line in lines:
+        match = _PLAN_NODE.match(line)
+        if match:
+            operation, _, relation = match.group("operation").partition(" on ")
+            # child nodes are indented by 6 characters, starting with "  ->  "
+            depth = (len(match.group("indent")) + 4) // 6 if match.group("arrow") else 0
+            nodes.append(
+                {
+                    "operation": operation.strip(),
+                    "relation": relation.split()[0] if relation else None,
+                    "rows": int(match.group("rows")),
+                    "startup_cost": float(match.group("startup_cost")),
+                    "total_cost": float(match.group("total_cost")),
+                    "width": int(match.group("width")),
+                    "depth": depth,
+                    "details": [],
+                }
+            )
+        elif nodes and line.strip().strip("-"):
+            nodes[-1]["details"].append(line.strip())
+    return nodes
+
+
+def _parse_denodo_plan(rows):
+    """Returns the rows of Denodo DESC QUERYPLAN as nodes. The plan has no row or cost estimates."""
+    nodes = []
+    for row in rows:
+        text = " ".join(str(value) for value in row if value is not None)
+        nodes.append(
+            {
+                "operation": text,
+                "relation": None,
+                "rows": None,
+                "startup_cost": None,
+                "total_cost": None,
+                "width": None,
+                "depth": 0,
+                "details": [],
+            }
+        )
+    return nodes
+
+
+def _parse_sqlite_plan(rows):
+    """Parses rows (id, parent, notused, detail) of SQLite EXPLAIN QUERY PLAN, eg. "SCAN Track"."""
+    depths = {0: -1}
+    nodes = []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        words = detail.split()
+        scan = words[0] in ("SCAN", "SEARCH") and len(words) > 1
+        nodes.append(
+            {
+                "operation": words[0] if scan else detail,
+                "relation": words[1] if scan else None,
+                "rows": None,
+                "startup_cost": None,
+                "total_cost": None,
+                "width": None,
+                "depth": depths[node_id],
+                "details": [" ".join(words[2:])] if scan and len(words) > 2 else [],
+            }
+        )
+    return nodes
+
+
+def _sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return str(value)
+    value = str(value).replace("'", "''")
+    return f"'{value}'"
+
+
+def _keyset_condition(keys, values):
+    """Generates condition selecting the rows which come after values in the order of keys, eg.
+    "(a > 1 OR (a = 1 AND b > 2))" for keys ['a', 'b'] and values [1, 2]"""
+    literals = [_sql_literal(value) for value in values]
+    conditions = []
+    for i, key in enumerate(keys):
+        condition = [f"{keys[j]} = {literals[j]}" for j in range(i)] + [f"{key} > {literals[i]}"]
+        conditions.append(" AND ".join(condition))
+    if len(conditions) == 1:
+        return conditions[0]
+    return "(" + " OR ".join(f"({condition})" if " AND " in condition else condition for condition in conditions) + ")"
+
+
 def _get_duplicated_columns(data):
     columns = {}
     fields = data["select"]["fields"]
@@ -1738,163 +3093,42 @@ def _build_column_strings(data):
     if data == {}:
         return {}
 
-    duplicates = _get_duplicated_columns(data)
-    assert (
-        duplicates == {}
-    ), f"""Some of your fields have the same aliases {duplicates}. Use your_qframe.remove() to remove or your_qframe.rename() to rename columns."""
-    select_names = []
-    select_aliases = []
-    group_dimensions = []
-    group_values = []
-    order_by = []
-    types = []
-
-    fields = data["select"]["fields"]
-
-    for field in fields:
-        expr = (
-            field
-            if "expression" not in fields[field] or fields[field]["expression"] == ""
-            else fields[field]["expression"]
-        )
-        alias = field if "as" not in fields[field] or fields[field]["as"] == "" else fields[field]["as"]
-
-        if "group_by" in fields[field]:
-            if fields[field]["group_by"].upper() == "GROUP":
-                prefix = re.search(r"^sq\d*[.]", field)
-                if prefix is not None:
-                    group_dimensions.append(field[len(prefix.group(0)) :])
-                else:
-                    group_dimensions.append(field)
-
-            elif fields[field]["group_by"] == "":
-                pass
+    fields = [ir.Field.from_dict(field, attrs) for field, attrs in data["select"]["fields"].items()]
+    return ir.column_strings(fields)
 
-            elif fields[field]["group_by"].upper() in [
-                "SUM",
-                "COUNT",
-                "MAX",
-                "MIN",
-                "AVG",
-            ]:
-                agg = fields[field]["group_by"]
-                expr = f"{agg}({expr})"
-                group_values.append(alias)
-
-        if "select" not in fields[field] or "select" in fields[field] and fields[field]["select"] == "":
-            select_name = field if expr == alias else f"{expr} as {alias}"
-
-            if "custom_type" in fields[field] and fields[field]["custom_type"] != "":
-                type = fields[field]["custom_type"].upper()
-            elif fields[field]["type"] == "dim":
-                type = "VARCHAR(500)"
-            elif fields[field]["type"] == "num":
-                type = "FLOAT(53)"
-
-            if "order_by" in fields[field] and fields[field]["order_by"] != "":
-                if fields[field]["order_by"].upper() == "DESC":
-                    order = fields[field]["order_by"]
-                elif fields[field]["order_by"].upper() == "ASC":
-                    order = ""
-                order_by.append(f"{alias} {order}")
-
-            select_names.append(select_name)
-            select_aliases.append(alias)
-            types.append(type)
-        else:
-            pass
-
-    sql_blocks = {
-        "select_names": select_names,
-        "select_aliases": select_aliases,
-        "group_dimensions": group_dimensions,
-        "group_values": group_values,
-        "order_by": order_by,
-        "types": types,
-    }
 
-    return sql_blocks
+def _get_sql(data, pretty=True, pushdown=True):
+    """Generates SQL from QFrame.data.
 
-
-def _get_sql(data):
+    The statement is built in a single pass over the query tree with upper case keywords. Subqueries are
+    read in place, without copying or modifying them. Columns of joined subqueries and union branches which
+    are not used by the outer query are left out (see ir.prune_columns) and, if pushdown is True, conditions
+    are moved to the subqueries they refer to (see ir.push_down_predicates). If pretty is True the final
+    statement is reindented with sqlparse (once, not for every subquery)."""
     if data == {}:
         return ""
 
-    data["select"]["sql_blocks"] = _build_column_strings(data)
-    sql = ""
-
-    if "union" in data["select"]:
-        iterator = 1
-        sq_data = deepcopy(data[f"sq{iterator}"])
-        sql += _get_sql(sq_data)
-
-        for union in data["select"]["union"]["union_type"]:
-            union_type = data["select"]["union"]["union_type"][iterator - 1]
-            sq_data = deepcopy(data[f"sq{iterator+1}"])
-            right_table = _get_sql(sq_data)
-
-            sql += f" {union_type} {right_table}"
-            iterator += 1
-
-    elif "union" not in data["select"]:
-        sql += "SELECT"
-
-        if "distinct" in data["select"] and str(data["select"]["distinct"]) == "1":
-            sql += " DISTINCT"
-
-        selects = ", ".join(data["select"]["sql_blocks"]["select_names"])
-        sql += f" {selects}"
-
-        if "table" in data["select"]:
-            if "schema" in data["select"] and data["select"]["schema"] != "":
-                sql += " FROM {}.{}".format(data["select"]["schema"], data["select"]["table"])
-            else:
-                sql += " FROM {}".format(data["select"]["table"])
-
-        elif "join" in data["select"]:
-            iterator = 1
-            sq_data = deepcopy(data[f"sq{iterator}"])
-            left_table = _get_sql(sq_data)
-            sql += f" FROM ({left_table}) sq{iterator}"
-
-            for join in data["select"]["join"]["join_type"]:
-                join_type = data["select"]["join"]["join_type"][iterator - 1]
-                sq_data = deepcopy(data[f"sq{iterator+1}"])
-                right_table = _get_sql(sq_data)
-                on = data["select"]["join"]["on"][iterator - 1]
-
-                sql += f" {join_type} ({right_table}) sq{iterator+1}"
-                if not on in {0, "0"}:
-                    sql += f" ON {on}"
-                iterator += 1
-
-        elif "table" not in data["select"] and "join" not in data["select"] and "sq" in data:
-            sq_data = deepcopy(data["sq"])
-            sq = _get_sql(sq_data)
-            sql += f" FROM ({sq}) sq"
-
-        if "where" in data["select"] and data["select"]["where"] != "":
-            sql += " WHERE {}".format(data["select"]["where"])
-
-        if data["select"]["sql_blocks"]["group_dimensions"] != []:
-            group_names = ", ".join(data["select"]["sql_blocks"]["group_dimensions"])
-            sql += f" GROUP BY {group_names}"
-
-        if "having" in data["select"] and data["select"]["having"] != "":
-            sql += " HAVING {}".format(data["select"]["having"])
+    sql = _optimize(ir.from_dict(data), pushdown=pushdown).to_sql()
+    if pretty:
+        sql = _format_sql(sql)
+    return sql
 
-    if data["select"]["sql_blocks"]["order_by"] != []:
-        order_by = ", ".join(data["select"]["sql_blocks"]["order_by"])
-        sql += f" ORDER BY {order_by}"
 
-    if "offset" in data["select"] and data["select"]["offset"] != "":
-        sql += " OFFSET {}".format(data["select"]["offset"])
+def _optimize(query, pushdown=True, cte=None):
+    if cte:
+        query = ir.extract_common_tables(query)
+        if isinstance(query, ir.With):
+            # common tables are new nodes which are not shared yet, so they can be optimized in place
+            for table in query.tables:
+                table.query = _optimize(table.query, pushdown=pushdown, cte=None)
+            return ir.With(query.tables, _optimize(query.query, pushdown=pushdown, cte=None))
+    if pushdown:
+        query = ir.push_down_predicates(query)
+    return ir.prune_columns(query)
 
-    if "limit" in data["select"] and data["select"]["limit"] != "":
-        sql += " LIMIT {}".format(data["select"]["limit"])
 
-    sql = sqlparse.format(sql, reindent=True, keyword_case="upper")
-    return sql
+def _format_sql(sql):
+    return sqlparse.format(sql, reindent=True, keyword_case="upper")
 
 
 if __name__ == "__main__":
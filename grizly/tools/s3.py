@@ -443,6 +443,7 @@ class S3:
         remove_inside_quotes: bool = False,
         time_format: str = None,
         execute_on_skip: bool = False,
+        replace_method: {"delete", "swap", "truncate"} = "delete",
     ):
         """Writes S3 to Redshift table.
 
@@ -467,9 +468,19 @@ class S3:
             List of column names in other order than default (more info https://docs.aws.amazon.com/redshift/latest/dg/copy-parameters-column-mapping.html)
         remove_inside_quotes : bool, optional
             Whether to add REMOVEQUOTES to copy statement, by default False
+        replace_method : {'delete', 'swap', 'truncate'}, optional
+            How the table is cleaned with if_exists='replace', by default 'delete'
+
+            * delete: DELETE FROM the table before COPY
+            * swap: COPY into a staging table created with CREATE TABLE ... (LIKE table) and replace the table
+              with it after COPY succeeds, readers never see an empty table. Privileges granted on the table are
+              not copied to the staging table. If views depend on the table (see SQLDB.write_to) DELETE is used
+            * truncate: TRUNCATE the table before COPY
         """
         if if_exists not in ("fail", "replace", "append"):
             raise ValueError(f"'{if_exists}' is not valid for if_exists")
+        if replace_method not in ("delete", "swap", "truncate"):
+            raise ValueError(f"'{replace_method}' is not valid for replace_method")
 
         if not execute_on_skip:
             if self.status == "skipped":
@@ -479,13 +490,26 @@ class S3:
 
         sqldb = SQLDB(db="redshift", engine_str=self.redshift_str, interface=self.interface)
         table_name = f"{schema}.{table}" if schema else table
+        staging = None
 
         if sqldb.check_if_exists(table, schema):
             if if_exists == "fail":
                 raise AssertionError(f"Table {table_name} already exists")
             elif if_exists == "replace":
-                sqldb.delete_from(table=table, schema=schema)
-                self.logger.info("SQL table has been cleaned up successfully.")
+                if replace_method == "swap" and sqldb._get_dependent_views(table=table, schema=schema):
+                    self.logger.warning(f"Views depend on {table_name}, it will be cleaned up with DELETE.")
+                    replace_method = "delete"
+                if replace_method == "swap":
+                    staging, create_sql = sqldb._get_staging_sql(table=table, schema=schema)
+                    sqldb._execute_in_transaction([create_sql])
+                    table_name = f"{schema}.{staging}" if schema else staging
+                    self.logger.info(f"Staging table {table_name} has been created successfully.")
+                elif replace_method == "truncate":
+                    sqldb._execute_in_transaction([f"TRUNCATE {table_name}"])
+                    self.logger.info("SQL table has been truncated successfully.")
+                else:
+                    sqldb.delete_from(table=table, schema=schema)
+                    self.logger.info("SQL table has been cleaned up successfully.")
             else:
                 pass
         else:
@@ -545,6 +569,13 @@ class S3:
             self.status = "failed"
         finally:
             con.close()
+        if staging is not None:
+            if self.status == "failed":
+                sqldb._execute_in_transaction([f"DROP TABLE {table_name}"])
+                return None
+            sqldb._execute_in_transaction(sqldb._get_swap_sql(table=table, staging=staging, schema=schema))
+            sqldb._invalidate_metadata(table=table, schema=schema)
+            table_name = f"{schema}.{table}" if schema else table
         self.status = "success"
         self.logger.info(f"Successfully inserted '{self.file_name}' into Redshift")
         self.logger.debug(f"'{self.file_name}''s Redshift location: {table_name}")
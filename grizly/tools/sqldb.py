@@ -1,14 +1,19 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.pool import NullPool
 import pyodbc
-from pandas import read_sql_query
+import pyarrow as pa
 import os
 import sqlparse
 import logging
 from logging import Logger
 import re
+import time
+import uuid
 
 from ..config import Config
+from .cache import MetadataCache
+from .pool import get_pool
 from ..utils import get_sfdc_columns
 
 from functools import partial
@@ -17,8 +22,14 @@ import deprecation
 deprecation.deprecated = partial(deprecation.deprecated, deprecated_in="0.3", removed_in="0.4")
 
 
+# maximum number of parameters of a single statement, used to size the batches of SQLDB.insert_df(method="values")
+parameter_limits = {"redshift": 32767, "sqlite": 999, "mssql": 2099, "postgresql": 32767, "mysql": 65535}
+
+
 class SQLDB:
     last_commit = ""
+    # cache of table metadata used by all SQLDBs without their own metadata_cache, eg. MetadataCache(ttl=300)
+    metadata_cache = None
 
     def __init__(
         self,
@@ -27,6 +38,8 @@ class SQLDB:
         interface: str = "sqlalchemy",
         config_key: str = None,
         logger: Logger = None,
+        session_sql: list = None,
+        metadata_cache: MetadataCache = None,
     ):
         if config_key:
             config = Config().get_service(config_key=config_key, service="sqldb")
@@ -46,10 +59,20 @@ class SQLDB:
         self.interface = interface
         self.dsn = self.engine_str.split("/")[-1]
         self.logger = logger or logging.getLogger(__name__)
+        self.session_sql = session_sql or []
+        # statistics of the last insert_df() call, None until the first call
+        self.insert_stats = None
+        if metadata_cache is not None:
+            self.metadata_cache = metadata_cache
+
+    def get_connection(self, pooled: bool = True):
+        """Returns connection taken from the pool shared by all SQLDBs with the same engine string and interface
+        (see grizly.tools.pool). con.close() returns the connection to the pool.
+
+        Connections of SQLDB with session_sql are not pooled, they're opened on every call so that the state
+        of the session doesn't leak to other users of the pool. With pooled=False a new connection is opened,
+        eg. for workers which would exhaust the pool.
 
-    def get_connection(self):
-        """Returns sqlalchemy connection.
-        
         Examples
         --------
         >>> sqldb = SQLDB(db="redshift")
@@ -58,6 +81,27 @@ class SQLDB:
         [('item1', 1.3, None, 3.5), ('item2', 0.0, None, None)]
         >>> con.close()
         """
+        if self.session_sql or not pooled:
+            con = self._connect()
+            # eg. SET statements which configure the session for the following queries
+            cursor = con.cursor()
+            for sql in self.session_sql:
+                cursor.execute(sql)
+            cursor.close()
+            return con
+
+        pool = get_pool(self.engine_str, self.interface)
+        try:
+            return pool.connect()
+        except Exception:
+            if self.interface != "sqlalchemy":
+                self.logger.exception(f"Error connectig to {self.engine_str}.")
+                raise
+            self.logger.exception(f"Error connectig to {self.engine_str}. Retrying...")
+            return pool.connect()
+
+    def _connect(self):
+        """Opens a new connection, without the pool."""
         engine = create_engine(self.engine_str, encoding="utf8", poolclass=NullPool)
         if self.interface == "sqlalchemy":
             try:
@@ -94,15 +138,10 @@ class SQLDB:
         True
         """
         if self.db == "redshift":
-            con = self.get_connection()
-            sql_exists = f"select * from information_schema.columns where table_name='{table}'"
-            if schema:
-                sql_exists += f" and table_schema='{schema}'"
+            rows = self._get_table_metadata(table=table, schema=schema)
             if column:
-                sql_exists += f" and column_name='{column}'"
-            exists = not read_sql_query(sql=sql_exists, con=con).empty
-            con.close()
-            return exists
+                return any(row[0] == column for row in rows)
+            return rows != []
         else:
             print("Works only with db='redshift'")
 
@@ -150,6 +189,7 @@ class SQLDB:
                         """
                 SQLDB.last_commit = sqlparse.format(sql, reindent=True, keyword_case="upper")
                 con.execute(sql).commit()
+                self._invalidate_metadata(table=out_table, schema=out_schema)
             con.close()
         return self
 
@@ -191,6 +231,7 @@ class SQLDB:
             con = self.get_connection()
             con.execute(sql).commit()
             con.close()
+            self._invalidate_metadata(table=table, schema=schema)
 
             self.logger.info(f"Table {sql} has been created successfully.")
         return self
@@ -270,23 +311,38 @@ class SQLDB:
                 sql = f"DROP TABLE {table_name}"
                 SQLDB.last_commit = sqlparse.format(sql, reindent=True, keyword_case="upper")
                 con.execute(sql).commit()
+                self._invalidate_metadata(table=table, schema=schema)
                 self.logger.info(f"Table {table_name} has been dropped successfully.")
             else:
                 self.logger.info(f"Table {table_name} doesn't exist.")
             con.close()
         return self
 
-    def write_to(self, table, columns, sql, schema=None, if_exists="fail"):
+    def write_to(self, table, columns, sql, schema=None, if_exists="fail", keys=None, replace_method="delete"):
         """Performs DELETE FROM (if table exists) and INSERT INTO queries in Redshift directly.
         
         Parameters
         ----------
-        if_exists : {'fail', 'replace', 'append'}, optional
+        if_exists : {'fail', 'replace', 'append', 'merge'}, optional
             How to behave if the table already exists, by default 'fail'
 
             * fail: Raise a ValueError
             * replace: Clean table before inserting new values.
             * append: Insert new values to the existing table
+            * merge: Delete the records with the same keys as the new values and insert new values in one transaction
+
+        keys : list or str, optional
+            Columns which uniquely identify the records, required with if_exists='merge'
+        replace_method : {'delete', 'swap', 'truncate'}, optional
+            How the table is cleaned with if_exists='replace', by default 'delete'
+
+            * delete: DELETE FROM the table and INSERT INTO it, in Redshift deleted rows stay on disk until VACUUM
+            * swap: INSERT INTO a staging table created with CREATE TABLE ... (LIKE table) and replace the table
+              with it in one transaction, readers never see an empty or partially written table. Privileges
+              granted on the table are not copied to the staging table. The old table can't be dropped if views
+              depend on it (except late-binding views created WITH NO SCHEMA BINDING), so for such tables DELETE
+              and INSERT are executed in one transaction instead
+            * truncate: TRUNCATE the table and INSERT INTO it (in Redshift TRUNCATE commits immediately)
 
         Examples
         --------
@@ -301,18 +357,307 @@ class SQLDB:
         if self.db == "redshift":
             if self.check_if_exists(table=table, schema=schema):
                 if if_exists == "replace":
-                    self.delete_from(table=table, schema=schema)
-                    self.insert_into(table=table, columns=columns, sql=sql, schema=schema)
+                    self._replace(table=table, columns=columns, sql=sql, schema=schema, method=replace_method)
                     self.logger.info(f"Data has been owerwritten into {schema}.{table}")
                 elif if_exists == "fail":
                     raise ValueError("Table already exists")
                 elif if_exists == "append":
                     self.insert_into(table=table, columns=columns, sql=sql, schema=schema)
                     self.logger.info(f"Data has been appended to {schema}.{table}")
+                elif if_exists == "merge":
+                    if not keys:
+                        raise ValueError("Parameter keys is required with if_exists='merge'")
+                    keys = [keys] if isinstance(keys, str) else keys
+                    self._merge(table=table, columns=columns, sql=sql, keys=keys, schema=schema)
+                    self.logger.info(f"Data has been merged into {schema}.{table}")
             else:
                 raise ValueError("Table doesn't exist. Use create_table first")
         return self
 
+    def _merge(self, table, columns, sql, keys, schema=None):
+        """Loads the result of sql into a temporary staging table, so the source is executed once, and replaces
+        the rows of table with the same keys in one transaction."""
+        table_name = f"{schema}.{table}" if schema else table
+        staging = f"{table}_merge_{uuid.uuid4().hex[:8]}"
+        on = " AND ".join(f"sq.{key} = {table_name}.{key}" for key in keys)
+        columns = ", ".join(columns)
+        statements = [
+            f"CREATE TEMPORARY TABLE {staging} AS {sql}",
+            f"DELETE FROM {table_name} WHERE EXISTS (SELECT 1 FROM {staging} sq WHERE {on})",
+            f"INSERT INTO {table_name} ({columns}) SELECT * FROM {staging}",
+            f"DROP TABLE {staging}",
+        ]
+        self._execute_in_transaction(statements)
+
+    def _replace(self, table, columns, sql, schema=None, method="delete"):
+        table_name = f"{schema}.{table}" if schema else table
+        insert_sql = "INSERT INTO {} ({}) {}"
+        if method == "delete":
+            self.delete_from(table=table, schema=schema)
+            self.insert_into(table=table, columns=columns, sql=sql, schema=schema)
+        elif method == "truncate":
+            statements = [f"TRUNCATE {table_name}", insert_sql.format(table_name, ", ".join(columns), sql)]
+            self._execute_in_transaction(statements)
+        elif method == "swap":
+            views = self._get_dependent_views(table=table, schema=schema)
+            if views:
+                self.logger.warning(
+                    f"Table {table_name} can't be swapped because views {', '.join(views)} depend on it. "
+                    "Rows will be deleted and inserted in one transaction."
+                )
+                statements = [f"DELETE FROM {table_name}", insert_sql.format(table_name, ", ".join(columns), sql)]
+                self._execute_in_transaction(statements)
+                return
+            staging, create_sql = self._get_staging_sql(table=table, schema=schema)
+            staging_name = f"{schema}.{staging}" if schema else staging
+            statements = [create_sql, insert_sql.format(staging_name, ", ".join(columns), sql)]
+            statements += self._get_swap_sql(table=table, staging=staging, schema=schema)
+            self._execute_in_transaction(statements)
+            self._invalidate_metadata(table=table, schema=schema)
+        else:
+            raise ValueError("Parameter replace_method must be one of 'delete', 'swap' or 'truncate'.")
+
+    def _get_dependent_views(self, table, schema=None):
+        """Returns the views which depend on table and would prevent it from being dropped. Late-binding views
+        have no dependencies in pg_depend."""
+        con = self.get_connection()
+        cursor = con.cursor()
+        cursor.execute(self._get_dependent_views_sql(table=table, schema=schema))
+        views = [f"{view_schema}.{view}" for view_schema, view in cursor.fetchall()]
+        cursor.close()
+        con.close()
+        return views
+
+    def _get_dependent_views_sql(self, table, schema=None):
+        where = f"t.relname = '{table}'"
+        where += f" AND tn.nspname = '{schema}'" if schema else " AND tn.nspname = current_schema()"
+        return (
+            "SELECT DISTINCT vn.nspname, v.relname FROM pg_depend d"
+            " JOIN pg_rewrite r ON r.oid = d.objid"
+            " JOIN pg_class v ON v.oid = r.ev_class"
+            " JOIN pg_namespace vn ON vn.oid = v.relnamespace"
+            " JOIN pg_class t ON t.oid = d.refobjid"
+            " JOIN pg_namespace tn ON tn.oid = t.relnamespace"
+            f" WHERE {where} AND v.oid <> t.oid"
+        )
+
+    def _get_staging_sql(self, table, schema=None):
+        """Returns the name of a new staging table and the statement which creates it with the structure of table."""
+        table_name = f"{schema}.{table}" if schema else table
+        staging = f"{table}_staging_{uuid.uuid4().hex[:8]}"
+        staging_name = f"{schema}.{staging}" if schema else staging
+        return staging, f"CREATE TABLE {staging_name} (LIKE {table_name})"
+
+    def _get_swap_sql(self, table, staging, schema=None):
+        """Returns the statements which replace table with staging table, to be executed in one transaction."""
+        table_name = f"{schema}.{table}" if schema else table
+        staging_name = f"{schema}.{staging}" if schema else staging
+        old = f"{table}_old_{uuid.uuid4().hex[:8]}"
+        old_name = f"{schema}.{old}" if schema else old
+        return [
+            f"ALTER TABLE {table_name} RENAME TO {old}",
+            f"ALTER TABLE {staging_name} RENAME TO {table}",
+            f"DROP TABLE {old_name}",
+        ]
+
+    def _execute_in_transaction(self, statements):
+        """Executes the statements on one connection and commits them together, rolls back if any of them fails."""
+        SQLDB.last_commit = sqlparse.format(";\n".join(statements), reindent=True, keyword_case="upper")
+        con = self.get_connection()
+        cursor = con.cursor()
+        try:
+            for sql in statements:
+                cursor.execute(sql)
+            con.commit()
+        except:
+            con.rollback()
+            raise
+        finally:
+            cursor.close()
+            con.close()
+
+    def insert_df(
+        self,
+        table: str,
+        df,
+        schema: str = None,
+        columns: list = None,
+        method: str = None,
+        batch_rows: int = None,
+        s3_threshold: int = 1000000,
+        bucket: str = None,
+        s3_key: str = "bulk_inserts/",
+    ):
+        """Inserts rows of DataFrame or pyarrow Table into existing table, all rows in one transaction.
+
+        Parameters
+        ----------
+        table : str
+            Name of SQL table
+        df : DataFrame or pyarrow.Table
+            Rows to insert, columns are matched to the columns of the table by name
+        schema : str, optional
+            Specify the schema
+        columns : list, optional
+            Columns of df to insert, by default all
+        method : {'fast_executemany', 'executemany', 'values', 's3'}, optional
+            How the rows are sent to the database, by default the fastest available:
+
+            * s3: Redshift with at least s3_threshold rows, df is saved in S3 and loaded with COPY (S3.to_rds)
+            * fast_executemany: pyodbc interface, parameters are sent in arrays instead of one row at a time
+            * executemany: SQLite and turbodbc interface, cursor.executemany() with one INSERT statement
+            * values: other engines, multi-row INSERT ... VALUES (...), (...) statements with as many rows as fit
+              in the parameter limit of the engine (see parameter_limits)
+
+        batch_rows : int, optional
+            Number of rows per statement (method='values') or per executemany() call, by default based on
+            the parameter limit of the engine
+        s3_threshold : int, optional
+            Number of rows from which Redshift loads go through S3, by default 1000000, None disables it
+        bucket : str, optional
+            Bucket used by method='s3', by default S3's default
+        s3_key : str, optional
+            Key used by method='s3', by default 'bulk_inserts/'
+
+        Returns
+        -------
+        SQLDB
+            The number of rows, seconds, rows per second and method are saved in `self.insert_stats`
+
+        Examples
+        --------
+        >>> from pandas import DataFrame
+        >>> sqldb = SQLDB(db="redshift")
+        >>> sqldb = sqldb.create_table(table="test_k", columns=["col1", "col2"], types=["VARCHAR(10)", "INT"], schema="sandbox")
+        >>> df = DataFrame({"col1": ["item1", None], "col2": [1, 2]})
+        >>> sqldb = sqldb.insert_df(table="test_k", df=df, schema="sandbox")
+        >>> sqldb.insert_stats["rows"], sqldb.insert_stats["method"]
+        (2, 'values')
+        >>> sqldb = sqldb.drop_table(table="test_k", schema="sandbox")
+        """
+        if not isinstance(df, pa.Table):
+            df = pa.Table.from_pandas(df, preserve_index=False)
+        columns = columns or df.column_names
+        table_name = f"{schema}.{table}" if schema else table
+        method = method or self._get_insert_method(df.num_rows, s3_threshold)
+        if method not in ("fast_executemany", "executemany", "values", "s3"):
+            raise ValueError("Parameter method must be one of 'fast_executemany', 'executemany', 'values' or 's3'.")
+
+        start = time.time()
+        if method == "s3":
+            self._insert_s3(table=table, df=df.select(columns).to_pandas(), schema=schema, bucket=bucket, s3_key=s3_key)
+        else:
+            # arrow converts NaN and NaT to None and values to Python objects accepted by the drivers
+            rows = list(zip(*(self._to_pylist(df.column(column)) for column in columns)))
+            batch_rows = batch_rows or max(1, self._get_parameter_limit() // max(1, len(columns)))
+            statements = self._get_insert_statements(table_name, columns, rows, method, batch_rows)
+            SQLDB.last_commit = statements[0][0] if statements else ""
+            con = self.get_connection()
+            cursor = con.cursor()
+            if method == "fast_executemany":
+                cursor.fast_executemany = True
+            try:
+                for sql, params in statements:
+                    if method == "values":
+                        cursor.execute(sql, params)
+                    else:
+                        cursor.executemany(sql, params)
+                con.commit()
+            except:
+                con.rollback()
+                self.logger.exception(f"Failed to insert rows into {table_name}")
+                raise
+            finally:
+                cursor.close()
+                con.close()
+
+        seconds = time.time() - start
+        rows_per_second = df.num_rows / seconds if seconds else float(df.num_rows)
+        self.insert_stats = {
+            "rows": df.num_rows,
+            "seconds": seconds,
+            "rows_per_second": rows_per_second,
+            "method": method,
+        }
+        self.logger.info(
+            f"{df.num_rows} rows have been inserted into {table_name} in {seconds:.2f} s "
+            f"({rows_per_second:.0f} rows/s, method '{method}')"
+        )
+        return self
+
+    @staticmethod
+    def _to_pylist(column):
+        # nanosecond timestamps are converted to pandas.Timestamp which is not supported by the drivers
+        if pa.types.is_timestamp(column.type) and column.type.unit == "ns":
+            column = column.cast(pa.timestamp("us", tz=column.type.tz), safe=False)
+        return column.to_pylist()
+
+    def _get_insert_method(self, num_rows, s3_threshold=None):
+        if self.db == "redshift" and s3_threshold is not None and num_rows >= s3_threshold:
+            return "s3"
+        elif self.interface == "pyodbc":
+            return "fast_executemany"
+        elif self.interface == "turbodbc" or self.engine_str.startswith("sqlite"):
+            return "executemany"
+        return "values"
+
+    def _get_parameter_limit(self):
+        if self.engine_str.startswith("sqlite"):
+            return parameter_limits["sqlite"]
+        elif self.db in parameter_limits:
+            return parameter_limits[self.db]
+        return parameter_limits.get(self.engine_str.split(":")[0].split("+")[0], 2000)
+
+    def _get_paramstyle(self):
+        if self.interface != "sqlalchemy":
+            return "qmark"
+        dialect = make_url(self.engine_str).get_dialect()
+        try:
+            return dialect.dbapi().paramstyle
+        except Exception:
+            return dialect.default_paramstyle
+
+    def _get_insert_statements(self, table_name, columns, rows, method, batch_rows):
+        """Returns list of (sql, params) tuples. With method='values' params are the values of one statement,
+        otherwise the rows of one executemany() call."""
+        paramstyle = self._get_paramstyle()
+        if paramstyle in ("format", "pyformat"):
+            placeholder = lambda i: "%s"
+        elif paramstyle == "numeric":
+            placeholder = lambda i: f":{i + 1}"
+        elif paramstyle == "qmark":
+            placeholder = lambda i: "?"
+        else:
+            raise NotImplementedError(f"Paramstyle '{paramstyle}' is not supported.")
+
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+        n = len(columns)
+        statements = []
+        for offset in range(0, len(rows), batch_rows):
+            batch = rows[offset : offset + batch_rows]
+            if method == "values":
+                values = (
+                    "(" + ", ".join(placeholder(i * n + j) for j in range(n)) + ")" for i in range(len(batch))
+                )
+                statements.append((insert_sql + ", ".join(values), [value for row in batch for value in row]))
+            else:
+                statements.append((insert_sql + "(" + ", ".join(placeholder(j) for j in range(n)) + ")", batch))
+        return statements
+
+    def _insert_s3(self, table, df, schema=None, bucket=None, s3_key=None):
+        from .s3 import S3
+
+        s3 = S3(
+            file_name=f"{table}_{uuid.uuid4().hex[:8]}.csv",
+            s3_key=s3_key,
+            bucket=bucket,
+            redshift_str=self.engine_str,
+            interface=self.interface,
+            logger=self.logger,
+        )
+        s3.from_df(df, keep_file=False)
+        s3.to_rds(table=table, schema=schema, if_exists="append", column_order=list(df.columns))
+
     def get_columns(
         self, table, schema=None, column_types=False, date_format="DATE", columns=None,
     ):
@@ -362,56 +707,26 @@ class SQLDB:
         date_format: str
             Denodo date format differs from those from other databases. User can choose which format is desired.
         """
-        where = f"view_name = '{table}' AND database_name = '{schema}' " if schema else f"view_name = '{table}' "
+        rows = self._get_table_metadata(table=table, schema=schema)
+        col_names = [row[0] for row in rows]
         if column_types == False:
-            sql = f"""
-                SELECT column_name
-                FROM get_view_columns()
-                WHERE {where}
-                """
-        else:
-            sql = f"""
-                SELECT distinct column_name,  column_sql_type, column_size
-                FROM get_view_columns()
-                WHERE {where}
-        """
-        con = self.get_connection()
-        cursor = con.cursor()
-        SQLDB.last_commit = sqlparse.format(sql, reindent=True, keyword_case="upper")
-        cursor.execute(sql)
-        col_names = []
-
-        if column_types == False:
-            while True:
-                column = cursor.fetchone()
-                if not column:
-                    break
-                col_names.append(column[0])
-            cursor.close()
-            con.close()
             return col_names
-        else:
-            col_types = []
-            while True:
-                column = cursor.fetchone()
-                if not column:
-                    break
-                col_names.append(column[0])
-                if column[1] in ("VARCHAR", "NVARCHAR"):
-                    col_types.append(column[1] + "(" + str(min(column[2], 1000)) + ")")
-                elif column[1] == "DATE":
-                    col_types.append(date_format)
-                else:
-                    col_types.append(column[1])
-            cursor.close()
-            con.close()
-            if columns:
-                col_names_and_types = {
-                    col_name: col_type for col_name, col_type in zip(col_names, col_types) if col_name in columns
-                }
-                col_names = [col for col in col_names_and_types]
-                col_types = [type for type in col_names_and_types.values()]
-            return col_names, col_types
+
+        col_types = []
+        for _, col_type, col_size in rows:
+            if col_type in ("VARCHAR", "NVARCHAR"):
+                col_types.append(col_type + "(" + str(min(col_size, 1000)) + ")")
+            elif col_type == "DATE":
+                col_types.append(date_format)
+            else:
+                col_types.append(col_type)
+        if columns:
+            col_names_and_types = {
+                col_name: col_type for col_name, col_type in zip(col_names, col_types) if col_name in columns
+            }
+            col_names = [col for col in col_names_and_types]
+            col_types = [type for type in col_names_and_types.values()]
+        return col_names, col_types
 
     def _get_redshift_columns(
         self, table, schema: str = None, column_types: bool = False, columns: list = None,
@@ -429,33 +744,11 @@ class SQLDB:
         columns: list
             List of column names to retrive.
         """
-        con = self.get_connection()
-        cursor = con.cursor()
-        where = f"table_name = '{table}' AND table_schema = '{schema}' " if schema else f"table_name = '{table}' "
-        sql = f"""
-            SELECT ordinal_position AS position, column_name, data_type,
-            CASE WHEN character_maximum_length IS NOT NULL
-            THEN character_maximum_length
-            ELSE numeric_precision END AS max_length
-            FROM information_schema.columns
-            WHERE {where}
-            ORDER BY ordinal_position;
-            """
-        SQLDB.last_commit = sqlparse.format(sql, reindent=True, keyword_case="upper")
-        cursor.execute(sql)
-
-        col_names = []
+        rows = self._get_table_metadata(table=table, schema=schema)
+        col_names = [row[0] for row in rows]
 
         if column_types:
-            col_types = []
-            while True:
-                column = cursor.fetchone()
-                if not column:
-                    break
-                col_name = column[1]
-                col_type = column[2]
-                col_names.append(col_name)
-                col_types.append(col_type)
+            col_types = [row[1] for row in rows]
             # leave only the cols provided in the columns argument
             if columns:
                 col_names_and_types = {
@@ -463,23 +756,117 @@ class SQLDB:
                 }
                 col_names = [col for col in col_names_and_types]
                 col_types = [type for type in col_names_and_types.values()]
-            to_return = (col_names, col_types)
-        else:
-            while True:
-                column = cursor.fetchone()
-                if not column:
-                    break
-                col_name = column[1]
-                col_names.append(col_name)
-            # leave only the cols provided in the columns argument
-            if columns:
-                col_names = [col for col in col_names if col in columns]
-            to_return = col_names
+            return col_names, col_types
+
+        # leave only the cols provided in the columns argument
+        if columns:
+            col_names = [col for col in col_names if col in columns]
+        return col_names
+
+    def get_schemas(self, tables: list):
+        """Retrieves column names, types and max lengths of many tables with a single query.
 
+        Tables which are in metadata_cache are not queried, the others are added to the cache.
+
+        Parameters
+        ----------
+        tables : list
+            Names of tables, eg. ['schema.table', 'table']. Tables without schema are searched in all schemas.
+
+        Examples
+        --------
+        >>> sqldb = SQLDB(db="redshift")
+        >>> schemas = sqldb.get_schemas(["administration.table_tutorial"])
+        >>> schemas["administration.table_tutorial"]["columns"]
+        ['col1', 'col2', 'col3', 'col4']
+
+        Returns
+        -------
+        dict
+            Dictionary {table: {"columns": [...], "types": [...], "max_lengths": [...]}}, the lists are empty if the
+            table doesn't exist
+        """
+        keys = {}
+        for name in tables:
+            schema, _, table = name.rpartition(".")
+            keys[name] = (schema or None, table)
+        metadata = self._get_tables_metadata(list(keys.values()))
+        schemas = {}
+        for name, key in keys.items():
+            rows = metadata[key]
+            schemas[name] = {
+                "columns": [row[0] for row in rows],
+                "types": [row[1] for row in rows],
+                "max_lengths": [row[2] for row in rows],
+            }
+        return schemas
+
+    def _get_table_metadata(self, table, schema=None):
+        """Returns rows of (column name, type, max length) of the table, empty list if the table doesn't exist."""
+        key = (schema or None, table)
+        return self._get_tables_metadata([key])[key]
+
+    def _get_tables_metadata(self, keys):
+        """Returns dictionary {(schema, table): rows of (column name, type, max length)}. The rows are taken from
+        metadata_cache if it's set, the tables which are not in the cache are retrieved with a single query."""
+        metadata = {}
+        for schema, table in keys:
+            if self.metadata_cache is not None:
+                rows = self.metadata_cache.get(self.engine_str, schema, table)
+                if rows is not None:
+                    metadata[(schema, table)] = rows
+        missing = [key for key in keys if key not in metadata]
+        if not missing:
+            return metadata
+
+        tables = ", ".join(f"'{table}'" for table in sorted({table for _, table in missing}))
+        schemas = {schema for schema, _ in missing}
+        if self.db == "denodo":
+            where = f"view_name IN ({tables})"
+            if None not in schemas:
+                where += " AND database_name IN ({})".format(", ".join(f"'{schema}'" for schema in sorted(schemas)))
+            sql = f"""
+                SELECT database_name, view_name, column_name, column_sql_type, column_size
+                FROM get_view_columns()
+                WHERE {where}
+                """
+        else:
+            where = f"table_name IN ({tables})"
+            if None not in schemas:
+                where += " AND table_schema IN ({})".format(", ".join(f"'{schema}'" for schema in sorted(schemas)))
+            sql = f"""
+                SELECT table_schema, table_name, column_name, data_type,
+                CASE WHEN character_maximum_length IS NOT NULL
+                THEN character_maximum_length
+                ELSE numeric_precision END AS max_length
+                FROM information_schema.columns
+                WHERE {where}
+                ORDER BY table_schema, table_name, ordinal_position;
+                """
+        con = self.get_connection()
+        cursor = con.cursor()
+        SQLDB.last_commit = sqlparse.format(sql, reindent=True, keyword_case="upper")
+        cursor.execute(sql)
+        fetched = {key: [] for key in missing}
+        seen = {key: set() for key in missing}
+        for schema, table, *row in cursor.fetchall():
+            for key in ((schema, table), (None, table)):
+                # get_view_columns() can return the same column more than once
+                if key in fetched and tuple(row) not in seen[key]:
+                    seen[key].add(tuple(row))
+                    fetched[key].append(list(row))
         cursor.close()
         con.close()
 
-        return to_return
+        for (schema, table), rows in fetched.items():
+            if self.metadata_cache is not None:
+                self.metadata_cache.put(self.engine_str, schema, table, rows)
+        metadata.update(fetched)
+        return metadata
+
+    def _invalidate_metadata(self, table, schema=None):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(self.engine_str, schema, table)
 
 
 def check_if_valid_type(type: str):
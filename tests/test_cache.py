@@ -0,0 +1,60 @@
+import os
+import time
+import pyarrow as pa
+from ..grizly.utils import get_path
+from ..grizly.tools.cache import ResultCache, MetadataCache
+
+
+def test_result_cache():
+    cache = ResultCache(path=get_path("cache_test", from_where="here"), ttl=3600)
+    cache.clear()
+    key1 = cache.get_key("sqlite://", "SELECT 1 AS one")
+    key2 = cache.get_key("sqlite://", "SELECT 2 AS two")
+    assert key1 != key2 != cache.get_key("mssql+pyodbc://DenodoODBC", "SELECT 1 AS one")
+
+    assert cache.get(key1) is None
+    cache.put(key1, pa.table({"one": [1] * 1000}))
+    assert cache.get(key1).to_pydict() == {"one": [1] * 1000}
+
+    cache.put(key2, pa.table({"two": [2]}), ttl=0)
+    assert cache.get(key2) is None
+    assert cache.stats()["entries"] == 1
+
+    # key1 is the least recently used
+    cache.put(key2, pa.table({"two": [2]}))
+    past = time.time() - 60
+    os.utime(os.path.join(cache.path, key1 + ".json"), (past, past))
+    cache.max_size = cache.stats()["size"] - 1
+    cache.evict()
+    assert cache.get(key1) is None
+    assert cache.get(key2) is not None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 3, 1)
+    cache.clear()
+    assert cache.stats() == {"hits": 0, "misses": 0, "entries": 0, "size": 0}
+    os.rmdir(cache.path)
+
+
+def test_metadata_cache():
+    path = get_path("metadata_cache_test", from_where="here")
+    cache = MetadataCache(ttl=3600, path=path)
+    cache.clear()
+    assert cache.get("sqlite://", "sales", "orders") is None
+    cache.put("sqlite://", "sales", "orders", [("id", "integer", 32)])
+    cache.put("sqlite://", None, "orders", [("id", "integer", 32)])
+    assert cache.get("sqlite://", "sales", "orders") == [["id", "integer", 32]]
+    assert cache.get("sqlite://", "sales", "customers") is None
+
+    # entries on disk are shared with other instances
+    other_cache = MetadataCache(ttl=3600, path=path)
+    assert other_cache.get("sqlite://", "sales", "orders") == [["id", "integer", 32]]
+    assert MetadataCache(ttl=0, path=path).get("sqlite://", "sales", "orders") is None
+
+    cache.invalidate("sqlite://", "sales", "orders")
+    assert cache.get("sqlite://", "sales", "orders") is None
+    assert cache.get("sqlite://", None, "orders") is None
+    assert other_cache.get("sqlite://", "sales", "orders") == [["id", "integer", 32]]
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.clear()
+    os.rmdir(path)
@@ -0,0 +1,236 @@
+import math
+import os
+import sqlite3
+from copy import deepcopy
+
+from ..grizly.utils import get_path
+
+from ..grizly.tools.cache import ResultCache
+from ..grizly.tools.ir import Field, Select, Join, Union, from_dict, to_dict
+from ..grizly.tools.qframe import QFrame, join, union, _get_sql
+
+
+orders = {
+    "select": {
+        "fields": {
+            "Order": {"type": "dim", "as": "Bookings"},
+            "Part": {"type": "dim", "as": "Part"},
+            "Customer": {"type": "dim", "as": "Customer", "group_by": "group"},
+            "Value": {"type": "num", "group_by": "sum", "order_by": "DESC"},
+        },
+        "table": "Orders",
+        "where": "Value > 0",
+    }
+}
+
+
+def test_from_dict():
+    query = from_dict(orders)
+    assert isinstance(query, Select)
+    assert [field.alias for field in query.fields] == ["Bookings", "Part", "Customer", "Value"]
+    assert query.fields[3].sql_expression == "sum(Value)"
+    assert not hasattr(query.fields[0], "__dict__")
+    assert query.to_sql() == (
+        "SELECT Order AS Bookings, Part, Customer, sum(Value) AS Value FROM Orders "
+        "WHERE Value > 0 GROUP BY Customer ORDER BY Value DESC"
+    )
+
+
+def test_to_dict():
+    data = to_dict(from_dict(orders))
+    assert data["select"]["fields"]["Order"] == {"type": "dim", "as": "Bookings"}
+    assert data["select"]["fields"]["Part"] == {"type": "dim"}
+    assert data["select"]["where"] == "Value > 0"
+    assert _get_sql(data) == _get_sql(orders)
+
+
+def test_join_and_union():
+    qf1 = QFrame().read_dict(deepcopy(orders))
+    qf2 = QFrame().read_dict(deepcopy(orders))
+    joined_qf = join([qf1, qf2], join_type="left join", on="sq1.Part=sq2.Part")
+    query = from_dict(joined_qf.data)
+    assert isinstance(query.source, Join)
+    assert [subquery.alias for subquery in query.source.subqueries] == ["sq1", "sq2"]
+    assert _get_sql(to_dict(query)) == joined_qf.get_sql()
+
+    unioned_qf = union([qf1, qf2], union_type="union all")
+    query = from_dict(unioned_qf.data)
+    assert isinstance(query, Union) and len(query.queries) == 2
+    assert _get_sql(to_dict(query)) == unioned_qf.get_sql()
+
+
+def test_field():
+    field = Field.from_dict("Value", {"type": "num", "custom_type": "bigint", "select": 0})
+    assert field.alias == "Value" and field.sql_type == "BIGINT" and not field.selected
+    assert field.to_dict() == {"type": "num", "custom_type": "bigint", "select": 0}
+
+
+def test_prune_columns():
+    customers = {"select": {"fields": {"Customer": {"type": "dim"}, "Country": {"type": "dim"}}, "table": "Customers"}}
+    items = {"select": {"fields": {"Order": {"type": "dim"}, "Part": {"type": "dim"}, "Qty": {"type": "num"}}, "table": "Items"}}
+    qf1 = QFrame().read_dict(deepcopy(orders))
+    qf2 = QFrame().read_dict(deepcopy(customers))
+    qf3 = QFrame().read_dict(deepcopy(items)).distinct()
+    joined_qf = join(
+        [qf1, qf2, qf3],
+        join_type=["left join", "left join"],
+        on=["sq1.Customer=sq2.Customer", "sq1.Bookings=sq3.Order"],
+        unique_col=False,
+    )
+    joined_qf.remove(["sq1.Part", "sq2.Customer", "sq3.Order", "sq3.Part", "sq3.Qty"])
+    joined_qf.query("sq2.Country = 'Italy'")
+    sql = joined_qf.get_sql(print_sql=False)
+    # Part is not used, Customer is a GROUP BY dimension and Value is sorted
+    assert "(SELECT Order AS Bookings, Customer, sum(Value) AS Value FROM Orders" in sql
+    assert "(SELECT Customer, Country FROM Customers) sq2" in sql
+    # removing columns from DISTINCT subquery would change the number of rows
+    assert "(SELECT DISTINCT Order, Part, Qty FROM Items) sq3" in sql
+
+    qf1 = QFrame().read_dict(deepcopy(items))
+    qf2 = QFrame().read_dict(deepcopy(items))
+    unioned_qf = union([qf1, qf2], union_type="union all").select(["Order", "Qty"])
+    sql = unioned_qf.get_sql(print_sql=False)
+    assert "(SELECT Order, Qty FROM Items UNION ALL SELECT Order, Qty FROM Items) sq" in sql
+
+    qf1 = QFrame().read_dict(deepcopy(items))
+    qf2 = QFrame().read_dict(deepcopy(items))
+    unioned_qf = union([qf1, qf2], union_type="union").select(["Order", "Qty"])
+    sql = unioned_qf.get_sql(print_sql=False)
+    assert "(SELECT Order, Part, Qty FROM Items UNION SELECT Order, Part, Qty FROM Items) sq" in sql
+
+
+def test_push_down_predicates():
+    customers = {"select": {"fields": {"Customer": {"type": "dim"}, "Country": {"type": "dim"}}, "table": "Customers"}}
+    qf1 = QFrame().read_dict(deepcopy(orders))
+    qf2 = QFrame().read_dict(deepcopy(customers))
+    qf1.assign(Year="EXTRACT(year FROM Date)", type="num", group_by="group")
+    joined_qf = join([qf1, qf2], join_type="left join", on="sq1.Customer=sq2.Customer", unique_col=True)
+    joined_qf.query("sq1.Customer = 'A AND B' AND sq1.Year BETWEEN 2018 AND 2019")
+    joined_qf.query("sq1.Value > 10 AND sq2.Country = 'Italy' AND sq1.Part = sq2.Country")
+    sql = joined_qf.get_sql(print_sql=False)
+    # sq1.Value is aggregated and sq2 is null-supplying
+    assert sql.endswith("WHERE sq1.Value > 10 AND sq2.Country = 'Italy' AND sq1.Part = sq2.Country")
+    assert "WHERE Value > 0 AND Customer = 'A AND B' AND (EXTRACT(year FROM Date)) BETWEEN 2018 AND 2019 GROUP BY" in sql
+
+    joined_qf.pushdown = False
+    sql = joined_qf.get_sql(print_sql=False)
+    assert "WHERE sq1.Customer = 'A AND B' AND sq1.Year BETWEEN 2018 AND 2019 and sq1.Value > 10" in sql
+
+    qf1 = QFrame().read_dict(deepcopy(customers))
+    qf2 = QFrame().read_dict(deepcopy(customers)).rename({"Country": "Region"})
+    unioned_qf = union([qf1, qf2], union_type="union", union_by="position").select("*")
+    unioned_qf.query("(sq.Country = 'Italy' OR sq.Country = 'Spain')")
+    sql = unioned_qf.get_sql(print_sql=False)
+    assert "FROM Customers WHERE (Country = 'Italy' OR Country = 'Spain') UNION SELECT" in sql
+    assert "FROM Customers WHERE (Country = 'Italy' OR Country = 'Spain')) sq" in sql
+
+    unioned_qf.limit(10).select("*").query("sq.Country = 'Poland' OR Customer = 'A'")
+    sql = unioned_qf.get_sql(print_sql=False)
+    # LIMIT in the subquery and unqualified column
+    assert sql.endswith("LIMIT 10) sq WHERE sq.Country = 'Poland' OR Customer = 'A'")
+
+
+def test_push_down_predicates_result():
+    engine_string = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    playlists = {"select": {"fields": {"PlaylistId": {"type": "dim"}, "Name": {"type": "dim"}}, "table": "Playlist"}}
+    playlist_track = {"select": {"fields": {"PlaylistId": {"type": "dim"}, "TrackId": {"type": "dim"}}, "table": "PlaylistTrack"}}
+    qf1 = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    qf2 = QFrame(engine=engine_string).read_dict(deepcopy(playlists))
+    joined_qf = join([qf1, qf2], join_type="left join", on="sq1.PlaylistId=sq2.PlaylistId", unique_col=True)
+    joined_qf.query("sq1.TrackId < 100 AND sq2.Name = 'Music'")
+    assert "FROM PlaylistTrack WHERE TrackId < 100" in joined_qf.get_sql(print_sql=False)
+    df = joined_qf.to_df()
+
+    joined_qf.pushdown = False
+    assert df.equals(joined_qf.to_df())
+    assert len(df) > 0
+
+
+def test_push_down_predicates_aggregates():
+    engine_string = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    tracks = {"select": {"fields": {"TrackId": {"type": "dim"}, "AlbumId": {"type": "dim"}}, "table": "Track"}}
+
+    # window function can't be moved to WHERE
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(rn="ROW_NUMBER() OVER (PARTITION BY AlbumId ORDER BY TrackId)", type="num")
+    qf.select("*").query("sq.rn = 1")
+    assert qf.get_sql(print_sql=False).endswith(") sq WHERE sq.rn = 1")
+    df = qf.to_df()
+    qf.pushdown = False
+    assert df.equals(qf.to_df())
+    assert len(df) == 347
+
+    # aggregate written as expression and a column which is not in GROUP BY
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(tracks="COUNT(TrackId)", type="num")
+    qf.groupby(["AlbumId"])
+    qf.select("*").query("sq.tracks > 20 AND sq.AlbumId < 100")
+    sql = qf.get_sql(print_sql=False)
+    assert "FROM Track WHERE AlbumId < 100 GROUP BY" in sql
+    assert sql.endswith(") sq WHERE sq.tracks > 20")
+    df = qf.to_df()
+    qf.pushdown = False
+    assert df.equals(qf.to_df())
+    assert len(df) > 0
+
+
+def test_extract_common_tables():
+    engine_string = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    playlist_track = {"select": {"fields": {"PlaylistId": {"type": "dim"}, "TrackId": {"type": "dim"}}, "table": "PlaylistTrack"}}
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    joined_qf = join([qf, qf], join_type="join", on="sq1.TrackId=sq2.TrackId", unique_col=True)
+    joined_qf.query("sq1.PlaylistId < sq2.PlaylistId AND sq2.PlaylistId = 8")
+    df = joined_qf.to_df().sort_values(["PlaylistId", "TrackId"], ignore_index=True)
+    assert "WITH" not in joined_qf.get_sql(print_sql=False)
+
+    joined_qf.cte = "with"
+    sql = joined_qf.get_sql(print_sql=False)
+    assert sql.startswith("WITH cte1 AS (SELECT PlaylistId, TrackId FROM PlaylistTrack) SELECT")
+    # conditions are not pushed into common tables
+    assert sql.endswith("FROM cte1 sq1 JOIN cte1 sq2 ON sq1.TrackId=sq2.TrackId WHERE sq1.PlaylistId < sq2.PlaylistId AND sq2.PlaylistId = 8")
+    assert joined_qf.to_df().sort_values(["PlaylistId", "TrackId"], ignore_index=True).equals(df)
+    assert joined_qf.run_local({"PlaylistTrack": qf.to_df()}).num_rows == len(df) > 0
+
+    joined_qf.cte = "temp"
+    assert joined_qf.get_sql(print_sql=False).startswith("SELECT sq1.PlaylistId AS PlaylistId")
+    assert joined_qf._compile()["temp_tables"] == ["CREATE TEMPORARY TABLE cte1 AS SELECT PlaylistId, TrackId FROM PlaylistTrack"]
+    assert joined_qf._get_session_sql() == []
+    assert joined_qf.to_df().sort_values(["PlaylistId", "TrackId"], ignore_index=True).equals(df)
+    # temporary tables are created only on the connections of the final queries, COUNT(*) of cut() and MIN/MAX
+    # of partition() use WITH
+    assert joined_qf._get_standalone_sql().startswith("WITH cte1 AS")
+    assert len(joined_qf.cut(20)) == math.ceil(len(df) / 20)
+    chunks = joined_qf.to_df(workers=2, partition_by="TrackId")
+    assert chunks.sort_values(["PlaylistId", "TrackId"], ignore_index=True).equals(df)
+    assert sum(len(chunk) for chunk in joined_qf.iter_df(batch_rows=20)) == len(df)
+    # the temporary tables are created also with the cursor given by the user
+    csv_path = get_path("joined_temp_test.csv", from_where="here")
+    user_con = sqlite3.connect(get_path("Chinook.sqlite", from_where="here"))
+    user_cursor = user_con.cursor()
+    assert joined_qf.to_csv(csv_path, cursor=user_cursor, debug=True) == len(df)
+    assert user_cursor.execute("SELECT name FROM sqlite_temp_master").fetchall() == []
+    user_con.close()
+    os.remove(csv_path)
+    con = joined_qf._get_sqldb().get_connection()
+    assert con.cursor().execute("SELECT name FROM sqlite_temp_master").fetchall() == []
+    con.close()
+
+    # the same query over other temporary tables has a different cache key
+    other_table = deepcopy(playlist_track)
+    other_table["select"]["table"] = "OtherTable"
+    other_qf = QFrame(engine=engine_string).read_dict(other_table)
+    other_qf = join([other_qf, other_qf], join_type="join", on="sq1.TrackId=sq2.TrackId", unique_col=True)
+    other_qf.query("sq1.PlaylistId < sq2.PlaylistId AND sq2.PlaylistId = 8")
+    other_qf.cte = "temp"
+    assert other_qf.get_sql(print_sql=False) == joined_qf.get_sql(print_sql=False)
+    other_qf.cache = joined_qf.cache = ResultCache(path=get_path("cache_cte_test", from_where="here"))
+    assert other_qf._get_cache_key("df") != joined_qf._get_cache_key("df")
+    os.rmdir(joined_qf.cache.path)
+
+    # nested repeated subqueries are defined before the common tables which use them
+    nested_qf = join([joined_qf, joined_qf], join_type="join", on="sq1.PlaylistId=sq2.PlaylistId", unique_col=True)
+    nested_qf.cte = "with"
+    sql = nested_qf.get_sql(print_sql=False)
+    assert sql.count("FROM PlaylistTrack") == 1
+    assert "cte2 AS (SELECT sq1.PlaylistId AS PlaylistId" in sql
+    assert "FROM cte2 sq1 JOIN cte2 sq2" in sql
@@ -0,0 +1,122 @@
+import os
+from copy import deepcopy
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas import read_sql
+from sqlalchemy import create_engine
+
+from ..grizly.utils import get_path
+from ..grizly.tools.qframe import QFrame, join, union
+
+engine_string = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+
+playlists = {"select": {"fields": {"PlaylistId": {"type": "dim"}, "Name": {"type": "dim"}}, "table": "Playlist"}}
+
+playlist_track = {
+    "select": {"fields": {"PlaylistId": {"type": "dim"}, "TrackId": {"type": "dim"}}, "table": "PlaylistTrack"}
+}
+
+tracks = {
+    "select": {
+        "fields": {
+            "TrackId": {"type": "dim"},
+            "Name": {"type": "dim"},
+            "AlbumId": {"type": "dim"},
+            "GenreId": {"type": "dim"},
+            "Composer": {"type": "dim"},
+            "Milliseconds": {"type": "num"},
+            "UnitPrice": {"type": "num"},
+        },
+        "table": "Track",
+    }
+}
+
+
+def get_tables():
+    engine = create_engine(engine_string)
+    return {table: read_sql(f"SELECT * FROM {table}", engine) for table in ("Playlist", "PlaylistTrack", "Track")}
+
+
+def assert_same_result(qf, tables, sort=True):
+    local_df = qf.run_local(tables).to_pandas()
+    sql_df = read_sql(qf.get_sql(print_sql=False), create_engine(engine_string))
+    assert list(local_df.columns) == list(sql_df.columns)
+    if sort:
+        local_df = local_df.sort_values(list(local_df.columns)).reset_index(drop=True)
+        sql_df = sql_df.sort_values(list(sql_df.columns)).reset_index(drop=True)
+    assert local_df.astype(str).equals(sql_df.astype(str))
+
+
+def test_select():
+    tables = get_tables()
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.query("GenreId IN (1, 2) AND Composer LIKE '%Jagger%' OR Name BETWEEN 'A' AND 'B'")
+    qf.assign(Minutes="Milliseconds / 60000", type="num")
+    qf.assign(Length="CASE WHEN Milliseconds > 300000 THEN 'long' ELSE 'short' END")
+    # SQLite converts only ASCII letters in UPPER()
+    qf.assign(Title="SUBSTR(Name, 1, 3) || ' - ' || COALESCE(Composer, 'unknown')")
+    assert_same_result(qf, tables)
+
+    qf.orderby(["Name", "TrackId"], ascending=[False, True]).limit(10)
+    assert_same_result(qf, tables, sort=False)
+
+
+def test_groupby():
+    tables = get_tables()
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.remove(["TrackId", "Name", "AlbumId", "Composer"])
+    qf.groupby(["GenreId"])["Milliseconds"].agg("sum")
+    qf.groupby(["GenreId"])["UnitPrice"].agg("max")
+    qf.having("SUM(Milliseconds) > 10000000")
+    assert_same_result(qf, tables)
+
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks)).remove(["Name", "Composer", "TrackId"]).distinct()
+    qf.remove(["AlbumId", "Milliseconds", "UnitPrice"])
+    assert_same_result(qf, tables)
+
+
+def test_join_and_union():
+    tables = get_tables()
+    qf1 = QFrame(engine=engine_string).read_dict(deepcopy(playlists))
+    qf2 = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    qf3 = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    joined_qf = join(
+        [qf1, qf2, qf3],
+        join_type=["left join", "inner join"],
+        on=["sq1.PlaylistId=sq2.PlaylistId", "sq2.TrackId=sq3.TrackId"],
+        unique_col=True,
+    )
+    joined_qf.rename({"sq1.Name": "Playlist", "sq3.Name": "Track"}).query("sq3.UnitPrice > 0.99")
+    assert_same_result(joined_qf, tables)
+
+    qf1 = QFrame(engine=engine_string).read_dict(deepcopy(playlists)).query("PlaylistId < 5")
+    qf2 = QFrame(engine=engine_string).read_dict(deepcopy(playlists)).query("PlaylistId > 15")
+    unioned_qf = union([qf1, qf2, qf1], union_type=["union all", "union"], union_by="position")
+    assert_same_result(unioned_qf, tables)
+
+
+def test_parquet():
+    parquet_path = os.path.join(os.getcwd(), "tracks_local.parquet")
+    pq.write_table(pa.Table.from_pandas(get_tables()["Track"]), parquet_path)
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks)).query("GenreId = 1")
+    assert_same_result(qf, {"Track": parquet_path})
+    os.remove(parquet_path)
+
+
+def test_expressions():
+    from pandas import DataFrame
+
+    orders = DataFrame(
+        {"Id": [1, 2, 3, 4], "Date": ["2019-01-05", "2020-03-01", None, "2020-12-31"], "Value": [10, 7, None, 5]}
+    )
+    data = {"select": {"fields": {"Id": {"type": "dim"}}, "table": "orders"}}
+    qf = QFrame().read_dict(data).query("Id NOT IN (4) AND (Value IS NULL OR Value % 5 = 0)")
+    qf.assign(Year="EXTRACT(year FROM Date)", Text="CAST(Id AS VARCHAR(10))", Kind="CASE Id WHEN 1 THEN 'one' END")
+    qf.assign(Rest="NULLIF(Value, 10)", type="num")
+    assert qf.run_local({"orders": orders}).to_pydict() == {
+        "Id": [1, 3],
+        "Year": [2019, None],
+        "Text": ["1", "3"],
+        "Kind": ["one", None],
+        "Rest": [None, None],
+    }
@@ -1,11 +1,18 @@
+import pytest
 import sqlparse
+import gc
 import os
+import sqlite3
+import threading
+import tracemalloc
+import pyarrow.parquet as pq
 from copy import deepcopy
 from sqlalchemy import create_engine
 from pandas import read_sql, read_csv, merge, concat
 
 from ..grizly.utils import get_path
 
+from ..grizly.tools.cache import ResultCache
 from ..grizly.tools.qframe import (
     QFrame,
     union,
@@ -13,6 +20,7 @@ from ..grizly.tools.qframe import (
     initiate,
     _build_column_strings,
     _get_sql,
+    _parse_plan,
 )
 
 excel_path = get_path("tables.xlsx", from_where="here")
@@ -90,7 +98,7 @@ def test_read_dict():
 def test_create_sql_blocks():
     q = QFrame().read_dict(deepcopy(orders))
     assert _build_column_strings(q.data)["select_names"] == [
-        "Order as Bookings",
+        "Order AS Bookings",
         "Part",
         "Customer",
         "Value",
@@ -276,6 +284,29 @@ def test_get_sql():
     assert sql == _get_sql(q.data)
 
 
+def test_get_sql_cache():
+    q = QFrame().read_dict(deepcopy(orders))
+    sql = q.get_sql()
+    assert q._sql_cache["pretty_sql"] == sql
+    assert q.get_sql() is sql
+
+    q.limit(10)
+    assert q._sql_cache == {}
+    assert q.get_sql()[-8:].upper() == "LIMIT 10"
+
+    q.data["select"]["limit"] = "5"
+    assert q.get_sql()[-7:].upper() == "LIMIT 5"
+
+
+def test_get_sql_unformatted():
+    q = QFrame().read_dict(deepcopy(orders))
+    q.query("Value > 0").orderby("Value", ascending=False).limit(10)
+    sql = q.get_sql(print_sql=False)
+    assert "\n" not in sql
+    assert sql == "SELECT Order AS Bookings, Part, Customer, Value FROM Orders WHERE Value > 0 ORDER BY Value DESC LIMIT 10"
+    assert clean_testexpr(q.get_sql()) == clean_testexpr(sql)
+
+
 def test_to_csv():
     q = QFrame(
         engine=engine_string,
@@ -307,6 +338,45 @@ def test_to_csv():
     assert df_from_qf.equals(test_df)
 
 
+def test_to_csv_compression_and_parts():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine)
+
+    csv_path = os.path.join(os.getcwd(), "tracks_test.csv.gz")
+    row_count = qf.to_csv(csv_path, compression="gzip", debug=True)
+    df_from_csv = read_csv(csv_path, sep="\t", compression="gzip")
+    os.remove(csv_path)
+    assert row_count == 3503
+    assert df_from_csv.equals(test_df)
+
+    row_count = qf.to_csv(csv_path, compression="gzip", max_rows=1000, debug=True)
+    part_paths = [os.path.join(os.getcwd(), f"tracks_test_{i:04d}.csv.gz") for i in range(4)]
+    dfs = [read_csv(part_path, sep="\t", compression="gzip") for part_path in part_paths]
+    for part_path in part_paths:
+        os.remove(part_path)
+    assert not os.path.exists(os.path.join(os.getcwd(), "tracks_test_0004.csv.gz"))
+    assert row_count == 3503
+    assert [len(df) for df in dfs] == [1000, 1000, 1000, 503]
+    assert concat(dfs, ignore_index=True).equals(test_df)
+
+    csv_path = os.path.join(os.getcwd(), "tracks_test.csv")
+    qf.to_csv(csv_path, chunksize=500, max_bytes=100000)
+    part_paths = sorted(path for path in os.listdir(os.getcwd()) if path.startswith("tracks_test_"))
+    dfs = [read_csv(part_path, sep="\t") for part_path in part_paths]
+    for part_path in part_paths:
+        assert os.path.getsize(part_path) < 100000 + 50000
+        os.remove(part_path)
+    assert len(part_paths) > 2
+    assert concat(dfs, ignore_index=True).equals(test_df)
+
+    csv_path = os.path.join(os.getcwd(), "tracks_test.csv.gz")
+    row_count = qf.to_csv(csv_path, chunksize=1000, keys="TrackId", workers=2, compression="gzip", debug=True)
+    df_from_csv = read_csv(csv_path, sep="\t", compression="gzip")
+    os.remove(csv_path)
+    assert df_from_csv.equals(test_df)
+
+
 def test_to_df():
     data = {
         "select": {
@@ -368,6 +438,228 @@ def test_copy():
     assert qf_copy.data != qf.data and qf_copy.sql != qf.sql and qf_copy.engine == qf.engine
 
 
+def test_copy_on_write():
+    qf = QFrame().read_dict(deepcopy(tracks))
+    qf_copy = qf.copy()
+    assert qf_copy.data is qf.data
+
+    qf_copy.limit(10)
+    assert qf_copy.data["select"] is not qf.data["select"]
+    assert qf_copy.data["select"]["fields"] is qf.data["select"]["fields"]
+    assert "limit" not in qf.data["select"]
+
+    qf_copy.rename({"Name": "TrackName"})
+    assert qf_copy.data["select"]["fields"] is not qf.data["select"]["fields"]
+    assert "as" not in qf.data["select"]["fields"]["Name"]
+
+    qf.orderby("Name")
+    assert "order_by" not in qf_copy.data["select"]["fields"]["Name"]
+
+
+def test_cut_benchmark():
+    fields = {"TrackId": {"type": "dim"}}
+    fields.update({f"col{i}": {"type": "num", "expression": "Milliseconds"} for i in range(299)})
+    qf = QFrame(engine=engine_string).read_dict({"select": {"fields": fields, "table": "Track"}})
+
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        qfs = qf.cut(1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+
+    assert len(qfs) == 3503
+    assert "OFFSET" not in qfs[0].get_sql() and qfs[-1].get_sql(print_sql=False).endswith("OFFSET 3502 LIMIT 1")
+    assert "ORDER BY" not in qf.get_sql()
+    # chunks share the sorted fields, only the part with offset and limit is copied
+    assert qfs[0].data["select"]["fields"] is qfs[-1].data["select"]["fields"]
+    assert peak < 50 * 2 ** 20
+
+
+def test_keyset_pagination():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    keys = ["PlaylistId", "TrackId"]
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql() + " ORDER BY PlaylistId, TrackId", con=engine)
+
+    qfs = qf.cut(1000, keys=keys)
+    assert len(qfs) == 9
+    assert "OFFSET" not in qfs[-1].get_sql()
+    # the condition is pushed down to the subquery
+    assert "(PlaylistId > 8 OR (PlaylistId = 8 AND TrackId > 3127))) sq" in qfs[-1].get_sql(print_sql=False)
+    qfs[-1].pushdown = False
+    assert "(sq.PlaylistId > 8 OR (sq.PlaylistId = 8 AND sq.TrackId > 3127))" in qfs[-1].get_sql(print_sql=False)
+    chunks_df = concat([read_sql(sql=qf.get_sql(), con=engine) for qf in qfs], ignore_index=True)
+    assert chunks_df.equals(test_df)
+
+    assert qf.to_df(chunksize=1000, keys=keys).reset_index(drop=True).equals(test_df)
+
+    csv_path = os.path.join(os.getcwd(), "playlist_track_keyset_test.csv")
+    qf.to_csv(csv_path, chunksize=1000, keys=keys)
+    df_from_csv = read_csv(csv_path, sep="\t")
+    os.remove(csv_path)
+    assert df_from_csv.equals(test_df)
+
+    with pytest.raises(ValueError):
+        qf.seek("Name")
+
+
+def test_keyset_pagination_null_keys():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    keys = ["Composer", "TrackId"]
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine).sort_values("TrackId").reset_index(drop=True)
+    assert test_df["Composer"].isna().any()
+
+    qfs = qf.cut(500, keys=keys)
+    assert "IS NULL" in qfs[-1].get_sql(print_sql=False)
+    chunks_df = concat([read_sql(sql=qf.get_sql(), con=engine) for qf in qfs], ignore_index=True)
+    assert chunks_df.sort_values("TrackId").reset_index(drop=True).equals(test_df)
+
+    for workers in [1, 4]:
+        df = qf.to_df(chunksize=500, keys=keys, workers=workers)
+        assert df.sort_values("TrackId").reset_index(drop=True).equals(test_df)
+
+
+def test_workers():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    keys = ["PlaylistId", "TrackId"]
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql() + " ORDER BY PlaylistId, TrackId", con=engine)
+
+    assert qf.to_df(chunksize=1000, keys=keys, workers=4).equals(test_df)
+
+    for method in ["range", "hash"]:
+        qfs = qf.partition(4, "TrackId", method=method)
+        assert len(qfs) == 4
+        df = qf.to_df(workers=4, partition_by="TrackId", partition_method=method)
+        assert df.sort_values(keys).reset_index(drop=True).equals(test_df)
+
+    csv_path = os.path.join(os.getcwd(), "playlist_track_workers_test.csv")
+    row_count = qf.to_csv(csv_path, chunksize=1000, keys=keys, workers=3, debug=True)
+    df_from_csv = read_csv(csv_path, sep="\t")
+    os.remove(csv_path)
+    assert row_count == len(test_df)
+    assert df_from_csv.equals(test_df)
+
+    # more workers than connections of the pool (pool_size + max_overflow = 15)
+    df = qf.to_df(workers=20, partition_by="TrackId")
+    assert df.sort_values(keys).reset_index(drop=True).equals(test_df)
+    # all 20 workers hold their connections at the same time
+    barrier = threading.Barrier(20, timeout=10)
+
+    def query(chunk, con):
+        barrier.wait()
+        return con.cursor().execute(f"SELECT {chunk}").fetchone()[0]
+
+    assert qf._run_chunks(query, list(range(20)), workers=20) == list(range(20))
+
+    with pytest.raises(ValueError):
+        qf.to_df(workers=4)
+
+
+def test_iter_df():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(type="dim", custom_type="INTEGER", TrackId="TrackId")
+    qf.assign(type="num", custom_type="BIGINT", Bytes="Bytes")
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine)
+
+    dfs = list(qf.iter_df(1000))
+    assert [len(df) for df in dfs] == [1000, 1000, 1000, 503]
+    df = concat(dfs, ignore_index=True)
+    assert df.dtypes["TrackId"] == "Int32"
+    assert df.dtypes["Bytes"] == "Int64"
+    assert df.dtypes["Milliseconds"] == "float64"
+    assert df.dtypes["Composer"] == "object"
+    assert df.astype(test_df.dtypes).equals(test_df)
+
+
+def test_to_df_dtypes():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(type="dim", custom_type="INTEGER", TrackId="TrackId")
+    qf.assign(type="num", custom_type="BIGINT", Bytes="Bytes")
+    qf.assign(type="dim", custom_type="DATE", ReleaseDate="'2020-01-01'")
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine)
+
+    df = qf.to_df(dtypes=True)
+    assert df.dtypes["TrackId"] == "Int32"
+    assert df.dtypes["Bytes"] == "Int64"
+    assert df.dtypes["Milliseconds"] == "int64"
+    assert df.dtypes["UnitPrice"] == "float64"
+    assert df.dtypes["ReleaseDate"] == "datetime64[ns]"
+    assert df.dtypes["Composer"] == "category"
+    assert df.dtypes["Name"] == "string"
+    assert df.memory_usage(deep=True).sum() < test_df.memory_usage(deep=True).sum()
+    assert df.drop(columns="ReleaseDate").astype(object).equals(test_df.drop(columns="ReleaseDate").astype(object))
+
+    assert qf.to_df(dtypes=True, category_threshold=0).dtypes["Composer"] == "string"
+    workers_df = qf.to_df(dtypes=True, chunksize=1000, keys="TrackId", workers=2)
+    assert workers_df.sort_values("TrackId", ignore_index=True).equals(df.sort_values("TrackId", ignore_index=True))
+    # without workers the chunks are retrieved with seek() too, sorted by the keys, rows with NULL keys last
+    chunks_df = qf.to_df(dtypes=True, chunksize=1000, keys=["Composer", "TrackId"])
+    null_keys = test_df["Composer"].isna()
+    sorted_ids = test_df[~null_keys]["TrackId"].tolist() + test_df[null_keys]["TrackId"].tolist()
+    assert chunks_df["TrackId"].tolist() == sorted_ids
+    assert chunks_df.dtypes.equals(df.dtypes)
+    assert qf.to_df().dtypes["Composer"] == "object"
+
+
+def test_to_arrow():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(type="dim", custom_type="INTEGER", TrackId="TrackId")
+    qf.assign(type="num", custom_type="BIGINT", Bytes="Bytes")
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine)
+
+    reader = qf.to_arrow(stream=True, interface="sqlalchemy", batch_rows=1000)
+    assert str(reader.schema.field("TrackId").type) == "int32"
+    assert str(reader.schema.field("Bytes").type) == "int64"
+    assert str(reader.schema.field("UnitPrice").type) == "double"
+    assert str(reader.schema.field("Name").type) == "string"
+    assert [batch.num_rows for batch in reader] == [1000, 1000, 1000, 503]
+
+    table, rowcount = qf.to_arrow(interface="sqlalchemy", debug=True)
+    assert rowcount == 3503
+    assert table.to_pandas().astype(test_df.dtypes).equals(test_df)
+
+
+def test_to_parquet():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.assign(type="num", custom_type="BIGINT", Bytes="Bytes")
+    engine = create_engine(engine_string)
+    test_df = read_sql(sql=qf.get_sql(), con=engine)
+
+    parquet_path = os.path.join(os.getcwd(), "tracks_test.parquet")
+    row_count = qf.to_parquet(parquet_path, row_group_size=1000, compression="gzip", debug=True)
+    metadata = pq.ParquetFile(parquet_path).metadata
+    table = pq.read_table(parquet_path)
+    os.remove(parquet_path)
+
+    assert row_count == 3503
+    assert metadata.num_row_groups == 4
+    assert metadata.row_group(0).num_rows == 1000
+    name_column = metadata.row_group(0).column(1)
+    assert name_column.compression == "GZIP"
+    assert "RLE_DICTIONARY" in name_column.encodings
+    assert "RLE_DICTIONARY" not in metadata.row_group(0).column(6).encodings
+    assert str(table.schema.field("Bytes").type) == "int64"
+    assert table.to_pandas().astype(test_df.dtypes).equals(test_df)
+
+    qf.to_parquet(parquet_path, chunksize=1500, keys="TrackId", row_group_size=1000)
+    metadata = pq.ParquetFile(parquet_path).metadata
+    os.remove(parquet_path)
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [1000, 500, 1000, 500, 503]
+
+    # keys without chunksize are ignored, as in to_csv()
+    assert qf.to_parquet(parquet_path, keys="TrackId", debug=True) == 3503
+    os.remove(parquet_path)
+
+
 def test_join_1():
     # using grizly
 
@@ -475,6 +767,48 @@ def test_join_2():
     assert clean_testexpr(sql) == clean_testexpr(testsql)
 
 
+def test_join_shares_data():
+    playlist_track_qf = QFrame(engine=engine_string).read_dict(deepcopy(playlist_track))
+    playlists_qf = QFrame(engine=engine_string).read_dict(deepcopy(playlists))
+
+    joined_qf = join([playlist_track_qf, playlists_qf], join_type="left join", on="sq1.PlaylistId=sq2.PlaylistId",)
+    assert joined_qf.data["sq1"] is playlist_track_qf.data
+    sql = joined_qf.get_sql()
+
+    playlist_track_qf.rename({"TrackId": "Track"}).query("PlaylistId = 1")
+    assert joined_qf.data["sq1"] is not playlist_track_qf.data
+    assert joined_qf.get_sql() == sql
+    assert "sq1.TrackId=sq2.TrackId" not in sql and "Track" in playlist_track_qf.get_fields(aliased=True)
+
+
+def _join_tree(nodes):
+    fields = {f"col{i}": {"type": "dim"} for i in range(20)}
+    data = {"select": {"fields": fields, "table": "table"}}
+    qf = QFrame().read_dict(data)
+    for _ in range(nodes - 1):
+        qf = join([qf, QFrame().read_dict(data)], join_type="left join", on="sq1.col0=sq2.col0")
+    return qf
+
+
+def test_compile_benchmark():
+    for nodes in (10, 50, 200):
+        qf = _join_tree(nodes)
+
+        # garbage of the previous tests is collected before and not during the measurement
+        gc.collect()
+        gc.disable()
+        tracemalloc.start()
+        try:
+            sql = _get_sql(qf.data, pretty=False)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            gc.enable()
+
+        # without copying subqueries the memory needed is proportional to the size of the generated SQL
+        assert peak < 100 * len(sql)
+
+
 def test_union():
     playlists_qf = QFrame(engine=engine_string).read_dict(deepcopy(playlists))
 
@@ -565,3 +899,143 @@ def test_pyodbc_interface():
 
     df = qf.to_df(db="redshift")
     assert not df.empty
+
+
+def test_result_cache():
+    cache = ResultCache(path=get_path("cache_test", from_where="here"))
+    cache.clear()
+    qf = QFrame(engine=engine_string, cache=cache).read_dict(deepcopy(tracks))
+    qf.assign(type="num", custom_type="BIGINT", Bytes="Bytes")
+
+    df = qf.to_df()
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert qf.to_df().equals(df)
+    # results of other methods are cached separately
+    assert qf.copy().to_arrow(interface="sqlalchemy").num_rows == 3503
+    assert qf.copy().to_arrow(interface="sqlalchemy").num_rows == 3503
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    parquet_path = os.path.join(os.getcwd(), "tracks_test.parquet")
+    qf.limit(10).to_parquet(parquet_path, row_group_size=5)
+    assert qf.to_parquet(parquet_path, debug=True) == 10
+    os.remove(parquet_path)
+    assert (cache.hits, cache.misses) == (3, 3)
+    assert cache.stats()["entries"] == 3
+    cache.clear()
+    os.rmdir(cache.path)
+
+
+def test_result_cache_types():
+    invoices = {
+        "select": {
+            "fields": {
+                "InvoiceId": {"type": "dim", "custom_type": "INTEGER"},
+                "InvoiceDate": {"type": "dim", "custom_type": "TIMESTAMP"},
+                "Total": {"type": "num"},
+            },
+            "table": "Invoice",
+        }
+    }
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(invoices))
+    table = qf.to_arrow(interface="sqlalchemy")
+    df = qf.to_df()
+    typed_df = qf.to_df(dtypes=True)
+
+    cache = ResultCache(path=get_path("cache_types_test", from_where="here"))
+    cache.clear()
+    cached_qf = QFrame(engine=engine_string, cache=cache).read_dict(deepcopy(invoices))
+    # every method is called twice, first result is fetched and cached, second is read from the cache
+    for _ in range(2):
+        assert cached_qf.to_df(dtypes=True).dtypes.equals(typed_df.dtypes)
+        assert cached_qf.to_df().dtypes.equals(df.dtypes)
+        assert cached_qf.to_arrow(interface="sqlalchemy").schema.equals(table.schema)
+    assert (cache.hits, cache.misses) == (3, 3)
+    cache.clear()
+    os.rmdir(cache.path)
+
+
+def test_incremental():
+    state_path = os.path.join(os.getcwd(), "tracks_state.json")
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    qf.incremental("TrackId", state_path=state_path)
+    assert qf.get_high_water_mark() is None
+
+    assert len(qf.to_df()) == 3503
+    assert qf.get_high_water_mark() == 3503
+    assert len(qf.to_df()) == 0
+
+    qf._save_high_water_mark(3500)
+    csv_path = os.path.join(os.getcwd(), "tracks_test.csv")
+    qf.to_csv(csv_path)
+    df = read_csv(csv_path, sep="\t")
+    os.remove(csv_path)
+    assert df["TrackId"].tolist() == [3501, 3502, 3503]
+    assert qf.get_high_water_mark() == 3503
+    # QFrame itself is not modified
+    assert "3500" not in qf.get_sql(print_sql=False)
+
+    with pytest.raises(ValueError):
+        QFrame(engine=engine_string).read_dict(deepcopy(tracks)).incremental("TrackId", state_path=state_path).rename(
+            {"TrackId": "Id"}
+        ).incremental("Id", state_path=state_path).get_high_water_mark()
+    os.remove(state_path)
+
+
+def test_explain():
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks))
+    plan = qf.explain()
+    assert (plan[0]["operation"], plan[0]["relation"], plan[0]["rows"]) == ("SCAN", "Track", None)
+
+    redshift_plan = [
+        "XN Hash Join DS_DIST_NONE  (cost=1.25..16.63 rows=1000 width=24)",
+        "  Hash Cond: (\"outer\".catid = \"inner\".catid)",
+        "  ->  XN Seq Scan on event  (cost=0.00..0.20 rows=20 width=16)",
+        "  ->  XN Hash  (cost=1.00..1.00 rows=100 width=8)",
+        "        ->  XN Seq Scan on category  (cost=0.00..1.00 rows=100 width=8)",
+        "              Filter: (catid > 5)",
+    ]
+    plan = _parse_plan(redshift_plan)
+    assert [(node["operation"], node["relation"], node["rows"], node["depth"]) for node in plan] == [
+        ("XN Hash Join DS_DIST_NONE", None, 1000, 0),
+        ("XN Seq Scan", "event", 20, 1),
+        ("XN Hash", None, 100, 1),
+        ("XN Seq Scan", "category", 100, 2),
+    ]
+    assert plan[0]["total_cost"] == 16.63
+    assert plan[3]["details"] == ["Filter: (catid > 5)"]
+
+    # SQLite doesn't estimate rows, COUNT(*) is used
+    assert len(qf.cut(1000, estimate=True)) == 4
+    # Denodo's query plan has no estimates, it isn't run
+    assert QFrame(engine="mssql+pyodbc://DenodoPROD").read_dict(deepcopy(tracks))._estimate_rows() is None
+
+    # the last chunk retrieves all rows above a too low estimate
+    qf._estimate_rows = lambda: 1500
+    qfs = qf.cut(1000, estimate=True)
+    assert len(qfs) == 2
+    last_sql = qfs[-1].get_sql(print_sql=False)
+    assert "OFFSET 1000" in last_sql and "LIMIT" not in last_sql
+
+
+def test_hints():
+    qf = QFrame(engine="mssql+pyodbc://DenodoPROD").read_dict(deepcopy(tracks))
+    assert qf._add_hints("SELECT 1") == (
+        "SELECT 1 CONTEXT('swap' = 'ON', 'swapsize' = '400', 'swapblocksize' = '1000', 'maxresultsize' = '100',"
+        " 'i18n' = 'us_est', 'queryTimeout' = '9000000000', 'simplify' = 'off')"
+    )
+    qf.set_hints(swapsize=800, swap=None, maxresultsize=None, swapblocksize=None, i18n=None, simplify=None)
+    assert qf.copy()._add_hints("SELECT 1") == "SELECT 1 CONTEXT('swapsize' = '800', 'queryTimeout' = '9000000000')"
+
+    qf = QFrame(engine="mssql+pyodbc://redshift_acoe", hints={"query_group": "etl", "timeout": 1.5})
+    assert qf._get_sqldb().session_sql == ["SET query_group TO 'etl'", "SET statement_timeout TO 1500"]
+    # the hints are set also with the cursor given by the user, SQLite fails on SET statement
+    qf = qf.read_dict(deepcopy(tracks))
+    con = sqlite3.connect(get_path("Chinook.sqlite", from_where="here"))
+    with pytest.raises(sqlite3.OperationalError, match="SET"):
+        qf.to_csv(os.path.join(os.getcwd(), "hints_test.csv"), cursor=con.cursor())
+    con.close()
+
+    # hints are ignored by SQLite
+    qf = QFrame(engine=engine_string).read_dict(deepcopy(tracks)).set_hints(timeout=10)
+    assert qf._get_sqldb().session_sql == []
+    assert len(qf.to_df()) == 3503
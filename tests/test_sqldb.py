@@ -1,5 +1,13 @@
 import os
+import sqlite3
+import pytest
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import exc
 from ..grizly.tools.sqldb import SQLDB, check_if_valid_type
+from ..grizly.tools.cache import MetadataCache
+from ..grizly.tools.pool import configure_pools, dispose_pools, get_pool_metrics
 from ..grizly.utils import get_path
 
 
@@ -22,3 +30,244 @@ def test_check_if_valid_type():
     assert check_if_valid_type("INT")
     assert not check_if_valid_type("string")
     assert check_if_valid_type("varchar(30)")
+
+
+def test_session_sql():
+    engine_str = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    sqldb = SQLDB(db="redshift", engine_str=engine_str, session_sql=["PRAGMA cache_size = 1234"])
+    con = sqldb.get_connection()
+    cursor = con.cursor()
+    cursor.execute("PRAGMA cache_size")
+    assert cursor.fetchone()[0] == 1234
+    con.close()
+
+
+def test_pool():
+    engine_str = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    dispose_pools()
+    sqldb = SQLDB(db="redshift", engine_str=engine_str)
+    for _ in range(3):
+        con = sqldb.get_connection()
+        assert con.cursor().execute("SELECT COUNT(*) FROM Playlist").fetchone()[0] == 18
+        con.close()
+    SQLDB(db="redshift", engine_str=engine_str).get_connection().close()
+
+    (metrics,) = get_pool_metrics()
+    assert metrics["interface"] == "sqlalchemy"
+    assert metrics["connects"] == 1
+    assert metrics["checkouts"] == 4
+    assert metrics["checked_out"] == 0
+
+    # connections with session state are not taken from the pool
+    sqldb = SQLDB(db="redshift", engine_str=engine_str, session_sql=["PRAGMA cache_size = 1234"])
+    sqldb.get_connection().close()
+    assert get_pool_metrics()[0]["checkouts"] == 4
+
+    configure_pools(pool_size=1, max_overflow=0, timeout=1)
+    sqldb = SQLDB(db="redshift", engine_str=engine_str)
+    con = sqldb.get_connection()
+    with pytest.raises(exc.TimeoutError):
+        sqldb.get_connection()
+    con.close()
+    configure_pools(pool_size=5, max_overflow=10, timeout=30)
+
+
+def _create_catalog(path, rows):
+    """Creates SQLite database with columns table which attached as information_schema imitates Redshift catalog."""
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS columns (table_schema, table_name, ordinal_position, column_name, data_type, "
+        "character_maximum_length, numeric_precision)"
+    )
+    con.execute("DELETE FROM columns")
+    con.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    con.commit()
+    return con
+
+
+def test_metadata_cache():
+    engine_str = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    catalog_path = get_path("catalog_test.sqlite", from_where="here")
+    rows = [
+        ("sales", "orders", 2, "name", "character varying", 100, None),
+        ("sales", "orders", 1, "id", "integer", None, 32),
+    ]
+    con = _create_catalog(catalog_path, rows)
+
+    cache = MetadataCache(ttl=60)
+    session_sql = [f"ATTACH DATABASE '{catalog_path}' AS information_schema"]
+    sqldb = SQLDB(db="redshift", engine_str=engine_str, session_sql=session_sql, metadata_cache=cache)
+    assert sqldb.check_if_exists("orders", "sales")
+    assert sqldb.check_if_exists("orders", "sales", column="name")
+    assert not sqldb.check_if_exists("orders", "sales", column="value")
+    assert sqldb.get_columns("orders", "sales", column_types=True) == (["id", "name"], ["integer", "character varying"])
+    assert sqldb.get_columns("orders", "sales", columns=["name"]) == ["name"]
+    assert not sqldb.check_if_exists("customers", "sales")
+    assert (cache.hits, cache.misses) == (4, 2)
+
+    # new table is visible after its entry is invalidated
+    con.execute("INSERT INTO columns VALUES ('sales', 'customers', 1, 'id', 'integer', NULL, 32)")
+    con.commit()
+    con.close()
+    assert not sqldb.check_if_exists("customers", "sales")
+    cache.invalidate(engine_str, "sales", "customers")
+    assert sqldb.check_if_exists("customers", "sales")
+    assert SQLDB(db="redshift", engine_str=engine_str, session_sql=session_sql).check_if_exists("customers", "sales")
+    os.remove(catalog_path)
+
+
+def test_get_schemas():
+    engine_str = "sqlite:///" + get_path("Chinook.sqlite", from_where="here")
+    catalog_path = get_path("catalog_schemas_test.sqlite", from_where="here")
+    rows = [
+        ("sales", "orders", 1, "id", "integer", None, 32),
+        ("sales", "orders", 2, "name", "character varying", 100, None),
+        ("sales", "customers", 1, "id", "integer", None, 32),
+        ("sandbox", "customers", 1, "id", "bigint", None, 64),
+    ]
+    _create_catalog(catalog_path, rows).close()
+
+    cache = MetadataCache(ttl=60)
+    session_sql = [f"ATTACH DATABASE '{catalog_path}' AS information_schema"]
+    sqldb = SQLDB(db="redshift", engine_str=engine_str, session_sql=session_sql, metadata_cache=cache)
+    schemas = sqldb.get_schemas(["sales.orders", "sandbox.customers", "sales.missing"])
+    assert schemas["sales.orders"] == {
+        "columns": ["id", "name"],
+        "types": ["integer", "character varying"],
+        "max_lengths": [32, 100],
+    }
+    assert schemas["sandbox.customers"]["types"] == ["bigint"]
+    assert schemas["sales.missing"] == {"columns": [], "types": [], "max_lengths": []}
+    assert "IN ('customers', 'missing', 'orders')" in " ".join(SQLDB.last_commit.split())
+
+    # the tables are retrieved with a single query and added to the cache
+    assert cache.misses == 3
+    assert sqldb.get_columns("orders", "sales") == ["id", "name"]
+    assert not sqldb.check_if_exists("missing", "sales")
+    assert cache.hits == 2
+
+    # tables without schema are searched in all schemas
+    schemas = sqldb.get_schemas(["customers", "sales.orders"])
+    assert schemas["customers"]["types"] == ["integer", "bigint"]
+    sql = " ".join(SQLDB.last_commit.split())
+    assert "table_schema IN" not in sql
+    assert "IN ('customers')" in sql
+    os.remove(catalog_path)
+
+
+def test_swap_table():
+    path = get_path("swap_test.sqlite", from_where="here")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE orders (id integer)")
+    con.execute("INSERT INTO orders VALUES (1)")
+    con.commit()
+    con.close()
+
+    sqldb = SQLDB(db="redshift", engine_str="sqlite:///" + path)
+    staging, create_sql = sqldb._get_staging_sql("orders", "sales")
+    assert staging.startswith("orders_staging_")
+    assert create_sql == f"CREATE TABLE sales.{staging} (LIKE sales.orders)"
+    # views bound to the table prevent DROP TABLE of the swap
+    sql = sqldb._get_dependent_views_sql("orders", "sales")
+    assert "FROM pg_depend" in sql and "WHERE t.relname = 'orders' AND tn.nspname = 'sales'" in sql
+
+    # SQLite has no CREATE TABLE ... (LIKE ...), so the staging table is created directly
+    statements = [f"CREATE TABLE {staging} (id integer)", f"INSERT INTO {staging} VALUES (2), (3)"]
+    statements += sqldb._get_swap_sql("orders", staging)
+    sqldb._execute_in_transaction(statements)
+
+    con = sqldb.get_connection()
+    assert con.cursor().execute("SELECT id FROM orders ORDER BY id").fetchall() == [(2,), (3,)]
+    tables = con.cursor().execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    assert tables == [("orders",)]
+    con.close()
+
+    # failed statement rolls back the whole transaction, DELETE makes SQLite begin it before CREATE TABLE
+    statements = ["DELETE FROM orders", f"CREATE TABLE {staging} (id integer)", "INSERT INTO missing VALUES (1)"]
+    statements += sqldb._get_swap_sql("orders", staging)
+    with pytest.raises(Exception):
+        sqldb._execute_in_transaction(statements)
+    con = sqldb.get_connection()
+    assert con.cursor().execute("SELECT id FROM orders ORDER BY id").fetchall() == [(2,), (3,)]
+    assert con.cursor().execute("SELECT count(*) FROM sqlite_master WHERE type = 'table'").fetchall() == [(1,)]
+    con.close()
+
+    with pytest.raises(ValueError):
+        sqldb._replace("orders", ["id"], "SELECT 1", method="rename")
+    dispose_pools()
+    os.remove(path)
+
+
+def test_insert_df():
+    path = get_path("insert_test.sqlite", from_where="here")
+    con = sqlite3.connect(path)
+    con.execute("DROP TABLE IF EXISTS orders")
+    con.execute("CREATE TABLE orders (id integer, name varchar(10), amount real, created timestamp)")
+    con.commit()
+    con.close()
+
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "name": ["a", None, "c"],
+            "amount": [1.5, np.nan, 3.0],
+            "created": pd.to_datetime(["2020-01-01", None, "2020-01-03"]),
+        }
+    )
+    sqldb = SQLDB(db="redshift", engine_str="sqlite:///" + path)
+    assert sqldb.insert_stats is None
+    sqldb.insert_df("orders", df)
+    assert sqldb.insert_stats["method"] == "executemany"
+    assert sqldb.insert_stats["rows"] == 3
+    assert sqldb.insert_stats["rows_per_second"] > 0
+
+    # multi-row VALUES in batches of 2 rows, pyarrow Table input
+    sqldb.insert_df("orders", pa.Table.from_pandas(df), columns=["id", "name"], method="values", batch_rows=2)
+    assert sqldb.insert_stats["method"] == "values"
+    assert SQLDB.last_commit == "INSERT INTO orders (id, name) VALUES (?, ?), (?, ?)"
+
+    con = sqldb.get_connection()
+    rows = con.cursor().execute("SELECT id, name, amount, created FROM orders ORDER BY id, amount").fetchall()
+    con.close()
+    assert rows == [
+        (1, "a", None, None),
+        (1, "a", 1.5, "2020-01-01 00:00:00"),
+        (2, None, None, None),
+        (2, None, None, None),
+        (3, "c", None, None),
+        (3, "c", 3.0, "2020-01-03 00:00:00"),
+    ]
+
+    statements = sqldb._get_insert_statements("orders", ["id"], [(1,), (2,), (3,)], "values", 2)
+    assert statements == [("INSERT INTO orders (id) VALUES (?), (?)", [1, 2]), ("INSERT INTO orders (id) VALUES (?)", [3])]
+    assert sqldb._get_insert_method(10 ** 6, s3_threshold=1000) == "s3"
+    assert SQLDB(db="redshift", interface="pyodbc")._get_insert_method(10) == "fast_executemany"
+    with pytest.raises(ValueError):
+        sqldb.insert_df("orders", df, method="multi")
+    dispose_pools()
+    os.remove(path)
+
+
+def test_merge():
+    path = get_path("merge_test.sqlite", from_where="here")
+    con = sqlite3.connect(path)
+    con.execute("DROP TABLE IF EXISTS orders")
+    con.execute("CREATE TABLE orders (id integer, amount integer)")
+    con.execute("INSERT INTO orders VALUES (1, 10), (2, 20)")
+    con.commit()
+    con.close()
+
+    sqldb = SQLDB(db="redshift", engine_str="sqlite:///" + path)
+    sqldb._merge("orders", ["id", "amount"], "SELECT 2 AS id, 21 AS amount UNION ALL SELECT 3, 30", keys=["id"])
+    con = sqldb.get_connection()
+    assert con.cursor().execute("SELECT * FROM orders ORDER BY id").fetchall() == [(1, 10), (2, 21), (3, 30)]
+    con.close()
+
+    # failed INSERT rolls back DELETE
+    with pytest.raises(Exception):
+        sqldb._merge("orders", ["id", "missing"], "SELECT 1 AS id, 11 AS amount", keys=["id"])
+    con = sqldb.get_connection()
+    assert con.cursor().execute("SELECT * FROM orders ORDER BY id").fetchall() == [(1, 10), (2, 21), (3, 30)]
+    con.close()
+    dispose_pools()
+    os.remove(path)